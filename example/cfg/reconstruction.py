@@ -1,4 +1,3 @@
-import cupy as cp
 from arrus.utils.imaging import *
 
 
@@ -1,27 +1,22 @@
 import importlib
 import sys
 import argparse
-import pathlib
-import os
-import arrus
 import traceback
 
 import logging
 
 import gui4us
-from gui4us.common import EventQueue
-from gui4us.view import View, start_view
-from gui4us.model.ultrasound import Env
-from gui4us.controller import Controller
+from gui4us.log import configure_logging, parse_levels
+from gui4us.profiling import StartupProfiler
+from gui4us.metrics import MetricsServer, MetricsFileWriter
+from gui4us.tracing import TRACER
 
 
-logging_file_handler = logging.FileHandler(filename="gui4us.log")
-# logging_stderr_handler = logging.StreamHandler(sys.stderr)
-logging_handlers = [logging_file_handler]# , logging_stderr_handler]
-logging.basicConfig(level=logging.INFO, handlers=logging_handlers)
-
 
 def load_cfg(path):
+    if path.endswith((".yaml", ".yml")):
+        import gui4us.cfg.loader
+        return gui4us.cfg.loader.load_cfg(path)
     module_name = "gui4us_cfg"
     spec = importlib.util.spec_from_file_location(module_name, path)
     module = importlib.util.module_from_spec(spec)
@@ -30,24 +25,91 @@ def load_cfg(path):
     return module
 
 
-if __name__ == "__main__":
-    # Read input parameters.
-    try:
-        parser = argparse.ArgumentParser(description="GUI4us.")
-        parser.add_argument("--cfg", dest="cfg",
-                        help="Path to the initial configuration file",
+def main():
+    parser = argparse.ArgumentParser(description="GUI4us.")
+    parser.add_argument("--cfg", dest="cfg",
+                        help="Path to the initial configuration file "
+                             "(.py or .yaml)",
                         required=True)
-        args = parser.parse_args()
-        cfg_path = args.cfg
-        cfg = load_cfg(cfg_path)
+    parser.add_argument("--profile-startup", dest="profile_startup",
+                        help="Print the duration of each startup phase",
+                        action="store_true")
+    parser.add_argument("--metrics-port", dest="metrics_port",
+                        help="Serve the metrics (Prometheus text format) on "
+                             "http://127.0.0.1:<port>/metrics",
+                        type=int, default=None)
+    parser.add_argument("--metrics-file", dest="metrics_file",
+                        help="Periodically write the metrics to the given "
+                             "file", default=None)
+    parser.add_argument("--metrics-interval", dest="metrics_interval",
+                        help="Metrics file write interval [s]",
+                        type=float, default=5.0)
+    parser.add_argument("--trace", dest="trace",
+                        help="Record the tracing spans from the start and "
+                             "write them to the given file on exit (Chrome "
+                             "trace event JSON). Tracing can be also "
+                             "toggled at runtime with Ctrl+Shift+T.",
+                        default=None)
+    parser.add_argument("--log-file", dest="log_file",
+                        help="Path to the output log file",
+                        default="gui4us.log")
+    parser.add_argument("--log-level", dest="log_levels",
+                        help="Log level of the given subsystem (model, "
+                             "controller, view, state_graph, cfg) or "
+                             "logger, e.g. controller=DEBUG; can be "
+                             "repeated",
+                        action="append", default=[])
+    args = parser.parse_args()
+    log_listener = configure_logging(
+        log_file=args.log_file, level=logging.INFO,
+        levels=parse_levels(args.log_levels))
+    if args.trace is not None:
+        TRACER.enable()
+    if args.metrics_port is not None:
+        MetricsServer(port=args.metrics_port).start()
+    metrics_writer = None
+    if args.metrics_file is not None:
+        metrics_writer = MetricsFileWriter(args.metrics_file,
+                                           interval=args.metrics_interval)
+        metrics_writer.start()
+    profiler = StartupProfiler(enabled=args.profile_startup)
+    # The heavy modules (arrus, PyQt5, matplotlib) are imported only here.
+    with profiler.phase("imports"):
+        with profiler.phase("model module"):
+            from gui4us.model.ultrasound import Env
+        with profiler.phase("controller module"):
+            from gui4us.controller import Controller
+        with profiler.phase("view module"):
+            from gui4us.view import start_view
+    with profiler.phase("cfg load"):
+        cfg = load_cfg(args.cfg)
 
+    # The model is created on the controller thread, while the view is
+    # being built.
+    def create_model():
         print("Creating model")
-        model = Env(cfg.environment)
-        print("Creating controller")
-        controller = Controller(model)
-        print("Creating View")
-        result = start_view(f"gui4us {gui4us.__version__}",
-                        cfg.view_cfg, controller)
+        with profiler.phase("model creation"):
+            return Env(cfg.environment, profiler=profiler)
+
+    print("Creating controller")
+    controller = Controller(model_factory=create_model)
+    print("Creating View")
+    try:
+        return start_view(f"gui4us {gui4us.__version__}",
+                          cfg.view_cfg, controller, profiler=profiler)
+    finally:
+        if metrics_writer is not None:
+            metrics_writer.close()
+        if args.trace is not None:
+            TRACER.disable()
+            TRACER.export_chrome_trace(args.trace)
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    # Read input parameters.
+    try:
+        result = main()
         print(f"view returned with {result}")
         sys.exit(result)
     except Exception as e:
@@ -55,5 +117,3 @@ if __name__ == "__main__":
         print(e)
     finally:
         pass
-
-
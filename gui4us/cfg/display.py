@@ -1,5 +1,72 @@
 from dataclasses import dataclass
-from typing import Sequence, Dict
+from typing import Sequence, Dict, Union
+
+
+@dataclass(frozen=True)
+class ScanConversion:
+    """
+    Display-side scan conversion of the images delivered in the beam
+    coordinates (sample, beam) to the cartesian (OZ, OX) grid.
+
+    :param angles: beam angles [rad], measured from the OZ axis, one per beam
+    :param z_grid: output image OZ grid points [m]
+    :param x_grid: output image OX grid points [m]
+    :param radii: distance of each beam sample from the apex [m]; if None,
+      the samples are assumed to uniformly cover the OZ extent of the input
+      image
+    :param apex: position of the beams apex (oz, ox) [m]
+    :param fill_value: value of the pixels outside the scanned sector
+    """
+    angles: object
+    z_grid: object
+    x_grid: object
+    radii: object = None
+    apex: tuple = (0.0, 0.0)
+    fill_value: float = 0.0
+
+
+@dataclass(frozen=True)
+class AutoRange:
+    """
+    Automatic display value range, determined by the streaming approximate
+    percentiles of the incoming frames.
+
+    :param percentiles: (lower, upper) percentiles that determine the
+      displayed value range
+    :param n_bins: the number of histogram bins used to estimate the
+      percentiles
+    :param stride: subsampling stride along each frame axis
+    :param decay: decay of the histogram counts from the previous frames
+    :param smoothing: weight of the new estimate in the exponential
+      smoothing of the value range
+    """
+    percentiles: tuple = (1, 99)
+    n_bins: int = 1024
+    stride: int = 4
+    decay: float = 0.9
+    smoothing: float = 0.2
+
+
+@dataclass(frozen=True)
+class Persistence:
+    """
+    Display-only temporal filter of the incoming frames; does not change
+    the captured data.
+
+    :param mode: "ema" (exponential moving average), "boxcar" (mean of
+      the last n_frames frames) or "peak_hold" (maximum with decay)
+    :param alpha: weight of the new frame in the "ema" mode
+    :param n_frames: the number of averaged frames in the "boxcar" mode
+    :param decay: decay factor of the held values in the "peak_hold" mode
+    :param floor: value the held values decay to in the "peak_hold" mode;
+      None: the minimum of the layer value range, if given, otherwise the
+      running minimum of the frames
+    """
+    mode: str = "ema"
+    alpha: float = 0.3
+    n_frames: int = 4
+    decay: float = 0.95
+    floor: float = None
 
 
 @dataclass(frozen=True)
@@ -7,12 +74,24 @@ class Layer2D:
     """
     :param extent: image dimensions, a pair (oz_extent, ox_extent),
         each (min, max)
+    :param scan_conversion: scan conversion to apply before displaying
+        the data, None means that the data is already on the cartesian grid
+    :param downsampling: reduction of the visible part of the image to the
+        display pixel grid: "mean" (area averaging), "max" (max-preserving,
+        e.g. for envelope peaks) or None (pass the full resolution image)
+    :param auto_range: automatic value range; when set, value_range is
+        used only as the initial value range
+    :param persistence: display-only temporal filter
     """
     cmap: str
     input: object
     value_range: tuple = None
     extent: tuple = None
     ax_labels: tuple = None
+    scan_conversion: ScanConversion = None
+    downsampling: str = None
+    auto_range: AutoRange = None
+    persistence: Persistence = None
 
 
 @dataclass(frozen=True)
@@ -21,6 +100,65 @@ class Display2D:
     layers: Sequence[Layer2D]
 
 
+@dataclass(frozen=True)
+class MModeDisplay:
+    """
+    M-mode (time vs depth) display of a single line of the input image.
+
+    :param title: display title
+    :param input: input data id
+    :param line: OX index of the displayed image column, or a pair
+        (start, end): the mean of the columns [start, end) is displayed
+    :param cmap: color map
+    :param value_range: displayed value range (min, max)
+    :param n_lines: the number of the most recent lines to display
+    :param mode: "scroll": the newest line is always on the right side,
+        "sweep": the lines are drawn from left to right, replacing the
+        oldest ones
+    """
+    title: str
+    input: object
+    line: Union[int, tuple]
+    cmap: str = "gray"
+    value_range: tuple = None
+    n_lines: int = 1000
+    mode: str = "scroll"
+
+
+@dataclass(frozen=True)
+class Roi:
+    """
+    Rectangular region of interest of the 2D display input image.
+
+    :param name: ROI name
+    :param oz_range: (min, max) OZ coordinates, in the image units
+    :param ox_range: (min, max) OX coordinates, in the image units
+    """
+    name: str
+    oz_range: tuple
+    ox_range: tuple
+
+
+@dataclass(frozen=True)
+class MeasurementsCfg:
+    """
+    Live measurements of the 2D display input image.
+
+    :param rois: regions of interest, for which the statistics should be
+      computed
+    :param a_scan: whether to display the image line under the cursor
+    :param update_interval: measurement widgets refresh interval [s]
+    """
+    rois: Sequence[Roi] = ()
+    a_scan: bool = True
+    update_interval: float = 0.2
+
+
 @dataclass(frozen=True)
 class ViewCfg:
-    displays: Dict[str, Display2D]
+    """
+    :param displays: displays to show
+    :param measurements: live measurements, None means no measurements
+    """
+    displays: Dict[str, Union[Display2D, MModeDisplay]]
+    measurements: MeasurementsCfg = None
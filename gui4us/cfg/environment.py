@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 import numpy as np
-from typing import Union, Iterable
+from typing import Union, Iterable, Dict, Callable
 
 
 @dataclass(frozen=True)
@@ -15,6 +15,179 @@ class LinearFunction:
     slope: float
 
 
+@dataclass(frozen=True)
+class CapturePolicy:
+    """
+    Reduction of the captured frames of a single output.
+
+    :param decimation: only every decimation-th acquired frame is captured
+    :param roi: captured part of the frame: a (start, end) index range for
+      each frame axis; None means the whole axis
+    :param dtype: captured data type: None (unchanged), "float16", "uint8"
+      or "uint16"; the integer types require value_range
+    :param value_range: (min, max) range of values mapped to the range of
+      the integer dtype (e.g. the dynamic range of the log-compressed
+      image); the values outside the range are clipped
+    """
+    decimation: int = 1
+    roi: tuple = None
+    dtype: str = None
+    value_range: tuple = None
+
+
+@dataclass(frozen=True)
+class CaptureCompression:
+    """
+    Lossless compression of the captured frames (see
+    gui4us.model.compression). The frames are compressed by a pool of
+    background threads; the frames waiting for compression are kept in
+    a bounded staging ring, when the ring is full, the new frames are
+    stored uncompressed.
+
+    :param codec: "zlib" or "lzma"
+    :param level: compression level (zlib level or lzma preset: 0-9)
+    :param delta: whether to delta-encode the values before compression
+    :param n_workers: the number of compression threads
+    :param staging_size: the number of frames of each output that can
+      wait for compression
+    :param memory_limit: maximum size of the compressed frames [bytes],
+      the capture stops when the limit is reached; None: no limit (the
+      capture stops when the capture buffer capacity is reached)
+    """
+    codec: str = "zlib"
+    level: int = 1
+    delta: bool = True
+    n_workers: int = 2
+    staging_size: int = 16
+    memory_limit: int = None
+
+
+@dataclass(frozen=True)
+class CapturePreview:
+    """
+    Preview of the captured frames: thumbnails and per-frame statistics,
+    computed on a background thread during the capture and saved as
+    the capture sidecar (see gui4us.model.preview).
+
+    :param ordinal: ordinal number of the output
+    :param max_size: maximum size of the largest thumbnails
+    :param min_size: minimum size of the smallest thumbnails
+    :param interval: interval between the preview updates [s]
+    """
+    ordinal: int = 0
+    max_size: int = 128
+    min_size: int = 16
+    interval: float = 0.2
+
+
+@dataclass(frozen=True)
+class MaxAboveThreshold:
+    """
+    Trigger condition: the maximum value in the gate is above the threshold.
+
+    :param threshold: threshold value
+    :param gate: evaluated part of the frame: a (start, end) index range
+      for each frame axis; None means the whole axis
+    :param stride: only every stride-th sample (along each axis) is
+      evaluated; an int (all axes) or a tuple (one value per axis)
+    :param ordinal: ordinal number of the evaluated output
+    """
+    threshold: float
+    gate: tuple = None
+    stride: Union[int, tuple] = 1
+    ordinal: int = 0
+
+
+@dataclass(frozen=True)
+class MeanChange:
+    """
+    Trigger condition: the mean value in the gate differs from its running
+    average by more than min_change.
+
+    :param min_change: minimum absolute change of the mean value
+    :param smoothing: running average weight of the previous frames
+      (0: compare with the previous frame only)
+    :param gate: see MaxAboveThreshold
+    :param stride: see MaxAboveThreshold
+    :param ordinal: ordinal number of the evaluated output
+    """
+    min_change: float
+    smoothing: float = 0.9
+    gate: tuple = None
+    stride: Union[int, tuple] = 1
+    ordinal: int = 0
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """
+    Trigger condition given by a function: subsample (numpy array) -> bool.
+    The function should be vectorized (e.g. use numpy reductions).
+
+    :param func: the predicate function
+    :param gate: see MaxAboveThreshold
+    :param stride: see MaxAboveThreshold
+    :param ordinal: ordinal number of the evaluated output
+    """
+    func: Callable
+    gate: tuple = None
+    stride: Union[int, tuple] = 1
+    ordinal: int = 0
+
+
+@dataclass(frozen=True)
+class CaptureTrigger:
+    """
+    Starts (and optionally stops) the capture when the given conditions
+    are met.
+
+    :param start: condition that starts the capture (MaxAboveThreshold,
+      MeanChange or Predicate)
+    :param stop: condition that stops the capture; if None, the capture
+      stops when the capture buffer is full
+    :param n_pre_trigger: the number of frames acquired before the start
+      condition was met, prepended to the capture (included in the capture
+      buffer capacity)
+    :param rearm: if False, the trigger is disarmed after starting the
+      capture (so the captured frames are not overwritten by the next
+      capture), otherwise it is re-armed when the capture stops
+    :param max_eval_time: when the average condition evaluation time
+      exceeds this value [s], the conditions are evaluated on a separate
+      thread (frames arriving while the evaluation is in progress are not
+      evaluated)
+    """
+    start: object
+    stop: object = None
+    n_pre_trigger: int = 0
+    rearm: bool = False
+    max_eval_time: float = 1e-3
+
+
+@dataclass(frozen=True)
+class OverloadPolicy:
+    """
+    Response to the sustained overload of the acquisition callback, i.e.
+    when the frames are processed slower than they are acquired (see
+    gui4us.model.load).
+
+    :param action: "drop_display": only every display_decimation-th frame
+      is passed to the outputs (displays), the capture is not affected;
+      "pause_capture": the capture is stopped; "alarm": the overload is
+      only reported
+    :param high_load: the overload starts when the load (callback
+      processing time / frame interval) exceeds this value
+    :param low_load: the overload ends when the load drops below this
+      value
+    :param window: the number of frames the load is averaged over
+    :param display_decimation: see action
+    """
+    action: str = "drop_display"
+    high_load: float = 0.9
+    low_load: float = 0.6
+    window: int = 32
+    display_decimation: int = 2
+
+
 @dataclass(frozen=True)
 class UltrasoundEnvironment:
     """
@@ -26,12 +199,29 @@ class UltrasoundEnvironment:
       the tgc_curve parameter
     :param processing: processing implementation
     :param work_mode: HOST, ASYNC or MANUAL
-    :param capture_buffer_capacity: capacity of the capture buffer
+    :param capture_buffer_capacity: capacity of the capture buffer (the
+      number of acquired frames)
+    :param capture_policies: output ordinal -> CapturePolicy, the captured
+      frames of the output are reduced according to the given policy
+    :param capture_compression: lossless compression of the captured
+      frames (see CaptureCompression); None: the frames are stored
+      uncompressed
+    :param capture_preview: preview of the captured frames, saved with
+      the capture (see CapturePreview); None: no preview
+    :param capture_trigger: starts the capture automatically when the
+      trigger conditions are met (see CaptureTrigger); the trigger is
+      armed on start
+    :param overload_policy: response to the sustained overload of the
+      acquisition callback, see OverloadPolicy
     :param log_file: path to the output log file, if None, a default path
         will be used
     :param log_file_level: log file severity level
     :param tgc_curve: initial tgc curve to apply
     :param tgc_sampling: the distance between TGC curve sampling points
+    :param tgc_sampling_points: TGC curve sampling points (depths) [m];
+      overrides tgc_sampling, if provided
+    :param tgc_interpolation: interpolation of the TGC curve between the
+      sampling points: "linear" or "pchip" (monotone cubic)
     """
     session_cfg: str
     tx_rx_sequence: object
@@ -44,6 +234,11 @@ class UltrasoundEnvironment:
     rx_buffer_size: int = 4
     host_buffer_size: int = 4
     capture_buffer_capacity: int = 100
+    capture_policies: Dict[int, CapturePolicy] = None
+    capture_compression: CaptureCompression = None
+    capture_preview: CapturePreview = None
+    capture_trigger: CaptureTrigger = None
+    overload_policy: OverloadPolicy = OverloadPolicy()
     # Voltage
     tx_voltage: int = 5
     tx_voltage_step: int = 1
@@ -51,6 +246,8 @@ class UltrasoundEnvironment:
     tgc_curve: float = 54
     tgc_step: float = 1
     tgc_sampling: float = 5e-3
+    tgc_sampling_points: Iterable = None
+    tgc_interpolation: str = "linear"
 
 
 @dataclass(frozen=True)
@@ -0,0 +1,310 @@
+"""
+YAML configuration files.
+
+The YAML file should contain two sections: ``environment``
+(UltrasoundEnvironment) and ``view_cfg`` (ViewCfg). The values are
+converted as follows:
+
+- a mapping with the ``class`` key is an object: the remaining keys are
+  the constructor keyword arguments. The class is given by its name in
+  gui4us.cfg (e.g. ``Display2D``), full import path (e.g.
+  ``arrus.ops.imaging.StaSequence``) or ``file.py:Class``, where the
+  file path is relative to the YAML file,
+- a mapping with a single ``path`` key is a file path, relative to the
+  YAML file,
+- a mapping with one of the keys: ``arange``, ``linspace``, ``firwin``,
+  ``array`` is a derived array: the value of the key are the function
+  arguments (a list or a mapping); optionally, ``scale`` (multiplier)
+  and ``dtype`` can be provided, e.g. ``{arange: [-40, 50, 0.2],
+  scale: 1.0e-3}``,
+- lists are converted to tuples.
+
+The whole configuration is validated before any object is created. The
+derived arrays are cached in the ``<config file>.cache.npz`` file, which is
+reused as long as the configuration file does not change.
+"""
+import dataclasses
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import logging
+import os
+import sys
+import typing
+
+import numpy as np
+import yaml
+
+import gui4us.cfg
+
+_LOGGER = logging.getLogger("gui4us.cfg")
+CLASS_KEY = "class"
+PATH_KEY = "path"
+CACHE_SUFFIX = ".cache.npz"
+_HASH_KEY = "__hash__"
+
+
+def _firwin(*args, **kwargs):
+    import scipy.signal
+    return scipy.signal.firwin(*args, **kwargs)
+
+
+_DERIVED_ARRAYS = {
+    "arange": np.arange,
+    "linspace": np.linspace,
+    "firwin": _firwin,
+    "array": np.asarray,
+}
+_DERIVED_ARRAY_OPTIONS = {"scale", "dtype"}
+
+
+@dataclasses.dataclass(frozen=True)
+class Cfg:
+    """
+    Loaded configuration, the same attributes as in the python
+    configuration modules.
+    """
+    environment: object
+    view_cfg: gui4us.cfg.ViewCfg
+
+
+def load_cfg(path) -> Cfg:
+    """
+    Loads, validates and creates the configuration from the given YAML file.
+
+    :raises ValueError: when the configuration is invalid; the message
+      lists all the detected problems
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    tree = yaml.safe_load(content)
+    loader = _Loader(path, digest=hashlib.sha256(content).hexdigest())
+    return loader.load(tree)
+
+
+class _Loader:
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.digest = digest
+        self.cache_path = path + CACHE_SUFFIX
+        self.cache = self._read_cache()
+        self.is_cache_modified = False
+
+    def load(self, tree):
+        if not isinstance(tree, dict):
+            raise ValueError(f"{self.path}: expected a mapping with the "
+                             f"'environment' and 'view_cfg' keys.")
+        tree = {key: tree.get(key, None) for key in ("environment",
+                                                       "view_cfg")}
+        if tree["environment"] is not None \
+                and CLASS_KEY not in tree["environment"]:
+            tree["environment"] = {CLASS_KEY: "UltrasoundEnvironment",
+                                   **tree["environment"]}
+        if tree["view_cfg"] is not None \
+                and CLASS_KEY not in tree["view_cfg"]:
+            tree["view_cfg"] = {CLASS_KEY: "ViewCfg", **tree["view_cfg"]}
+        errors = []
+        for key, value in tree.items():
+            if value is None:
+                errors.append(f"{key}: missing section")
+            else:
+                self._validate(value, key, errors)
+        if len(errors) > 0:
+            raise ValueError(f"Invalid configuration {self.path}:\n"
+                             + "\n".join(errors))
+        cfg = Cfg(environment=self._create(tree["environment"],
+                                           "environment"),
+                  view_cfg=self._create(tree["view_cfg"], "view_cfg"))
+        if self.is_cache_modified:
+            self._write_cache()
+        return cfg
+
+    # Validation.
+    def _validate(self, node, node_path, errors, annotation=None):
+        if isinstance(node, list):
+            for i, value in enumerate(node):
+                self._validate(value, f"{node_path}[{i}]", errors)
+        elif isinstance(node, dict):
+            kind = self._get_kind(node)
+            if kind == CLASS_KEY:
+                self._validate_object(node, node_path, errors)
+            elif kind == PATH_KEY:
+                if not isinstance(node[PATH_KEY], str):
+                    errors.append(f"{node_path}: path should be a string")
+            elif kind is not None:
+                self._validate_derived_array(node, kind, node_path, errors)
+            else:
+                for key, value in node.items():
+                    self._validate(value, f"{node_path}.{key}", errors)
+        elif annotation is not None:
+            self._validate_type(node, annotation, node_path, errors)
+
+    def _validate_object(self, node, node_path, errors):
+        try:
+            cls = self._get_class(node[CLASS_KEY])
+        except Exception as e:
+            errors.append(f"{node_path}: cannot import class "
+                          f"{node[CLASS_KEY]}: {e}")
+            return
+        kwargs = {k: v for k, v in node.items() if k != CLASS_KEY}
+        annotations = {}
+        if dataclasses.is_dataclass(cls):
+            fields = {f.name: f for f in dataclasses.fields(cls)}
+            try:
+                annotations = typing.get_type_hints(cls)
+            except Exception:
+                annotations = {}
+            for key in kwargs.keys() - fields.keys():
+                errors.append(f"{node_path}: unknown parameter of "
+                              f"{cls.__name__}: {key}")
+            for name, f in fields.items():
+                is_required = f.default is dataclasses.MISSING \
+                              and f.default_factory is dataclasses.MISSING
+                if is_required and name not in kwargs:
+                    errors.append(f"{node_path}: missing required "
+                                  f"parameter of {cls.__name__}: {name}")
+        else:
+            try:
+                inspect.signature(cls).bind(**kwargs)
+            except TypeError as e:
+                errors.append(f"{node_path}: invalid parameters of "
+                              f"{cls.__name__}: {e}")
+            except ValueError:
+                # No signature available (e.g. extension types).
+                pass
+        for key, value in kwargs.items():
+            self._validate(value, f"{node_path}.{key}", errors,
+                           annotation=annotations.get(key, None))
+
+    def _validate_derived_array(self, node, kind, node_path, errors):
+        for key in node.keys() - {kind} - _DERIVED_ARRAY_OPTIONS:
+            errors.append(f"{node_path}: unknown {kind} option: {key}")
+        args = node[kind]
+        if kind != "array" and not isinstance(args, (list, dict)):
+            errors.append(f"{node_path}: {kind} arguments should be a list "
+                          f"or a mapping")
+        if "dtype" in node:
+            try:
+                np.dtype(node["dtype"])
+            except TypeError:
+                errors.append(f"{node_path}: unknown dtype: {node['dtype']}")
+
+    def _validate_type(self, value, annotation, node_path, errors):
+        if annotation is float:
+            is_valid = isinstance(value, (int, float)) \
+                       and not isinstance(value, bool)
+        elif annotation is int:
+            is_valid = isinstance(value, int) and not isinstance(value, bool)
+        elif annotation in (str, bool):
+            is_valid = isinstance(value, annotation)
+        else:
+            # Other types (unions, generic types) are not validated here.
+            return
+        # None is the default value of many of the optional parameters.
+        if not is_valid and value is not None:
+            errors.append(f"{node_path}: expected {annotation.__name__}, "
+                          f"got: {value!r}")
+
+    # Creation.
+    def _create(self, node, node_path):
+        if isinstance(node, list):
+            return tuple(self._create(value, f"{node_path}[{i}]")
+                         for i, value in enumerate(node))
+        if not isinstance(node, dict):
+            return node
+        kind = self._get_kind(node)
+        if kind == CLASS_KEY:
+            cls = self._get_class(node[CLASS_KEY])
+            kwargs = {key: self._create(value, f"{node_path}.{key}")
+                      for key, value in node.items() if key != CLASS_KEY}
+            return cls(**kwargs)
+        elif kind == PATH_KEY:
+            return self._get_path(node[PATH_KEY])
+        elif kind is not None:
+            return self._get_derived_array(node, kind, node_path)
+        else:
+            return {key: self._create(value, f"{node_path}.{key}")
+                    for key, value in node.items()}
+
+    def _get_derived_array(self, node, kind, node_path):
+        if node_path in self.cache:
+            return self.cache[node_path]
+        func = _DERIVED_ARRAYS[kind]
+        args = node[kind]
+        if isinstance(args, dict):
+            value = func(**args)
+        elif kind == "array":
+            value = func(args)
+        else:
+            value = func(*args)
+        value = np.asarray(value)
+        if "scale" in node:
+            value = value*node["scale"]
+        if "dtype" in node:
+            value = value.astype(node["dtype"])
+        self.cache[node_path] = value
+        self.is_cache_modified = True
+        return value
+
+    def _get_kind(self, node):
+        if CLASS_KEY in node:
+            return CLASS_KEY
+        if len(node) == 1 and PATH_KEY in node:
+            return PATH_KEY
+        kinds = node.keys() & _DERIVED_ARRAYS.keys()
+        if len(kinds) == 1:
+            return next(iter(kinds))
+        return None
+
+    def _get_class(self, name):
+        if ":" in name:
+            # file.py:Class
+            file_path, class_name = name.rsplit(":", 1)
+            file_path = self._get_path(file_path)
+            module_name = f"gui4us_cfg_" \
+                          f"{os.path.splitext(os.path.basename(file_path))[0]}"
+            module = sys.modules.get(module_name, None)
+            if module is None:
+                spec = importlib.util.spec_from_file_location(module_name,
+                                                              file_path)
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[module_name] = module
+                spec.loader.exec_module(module)
+            return getattr(module, class_name)
+        if "." not in name:
+            return getattr(gui4us.cfg, name)
+        module_name, class_name = name.rsplit(".", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def _get_path(self, path):
+        path = os.path.expanduser(path)
+        return os.path.join(self.directory, path)
+
+    # Derived arrays cache.
+    def _read_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                if str(cache[_HASH_KEY]) != self.digest:
+                    return {}
+                return {key: cache[key] for key in cache.files
+                        if key != _HASH_KEY}
+        except Exception as e:
+            _LOGGER.warning("Ignoring invalid configuration cache %s: %s",
+                            self.cache_path, e)
+            return {}
+
+    def _write_cache(self):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **{_HASH_KEY: np.asarray(self.digest)},
+                         **self.cache)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            _LOGGER.warning("Could not write configuration cache %s: %s",
+                            self.cache_path, e)
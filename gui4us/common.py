@@ -24,5 +24,28 @@ class ImageMetadata:
     ids: tuple
 
 
+def get_pixel_range(value_range, extent, n):
+    """
+    Returns the range [start, end) of the indices of the image pixels
+    covering the given (min, max) range of coordinates (at least one pixel).
+
+    The image extent (min, max) spans the outer edges of its n pixels
+    (as in matplotlib imshow), i.e. the pixel size is (max-min)/n.
+    """
+    start, end = extent
+    step = (end-start)/n
+    lo, hi = sorted(value_range)
+    i0 = int(np.clip(np.floor((lo-start)/step), 0, n-1))
+    i1 = int(np.clip(np.ceil((hi-start)/step), i0+1, n))
+    return i0, i1
 
 
+def get_pixel_extent(pixel_range, extent, n):
+    """
+    Returns the extent (min, max) of the image pixels [start, end), see
+    get_pixel_range.
+    """
+    start, end = extent
+    step = (end-start)/n
+    i0, i1 = pixel_range
+    return start+i0*step, start+i1*step
@@ -1,10 +1,30 @@
-import traceback
 from dataclasses import dataclass, field
+import inspect
 import threading
 import queue
 import logging
-
-_LOGGER = logging.getLogger("Controller")
+import time
+
+from gui4us.controller.scheduler import TriggerScheduler
+from gui4us.metrics import REGISTRY
+from gui4us.tracing import TRACER
+
+_LOGGER = logging.getLogger("gui4us.controller")
+_TASKS = REGISTRY.counter(
+    "gui4us_controller_tasks_total", "Tasks executed by the controller")
+_TASK_ERRORS = REGISTRY.counter(
+    "gui4us_controller_task_errors_total", "Tasks that raised an error")
+_TASK_LATENCY = REGISTRY.histogram(
+    "gui4us_controller_task_latency_seconds",
+    "Time from sending a task to its completion (including model flush)")
+_BATCH_SIZE = REGISTRY.histogram(
+    "gui4us_controller_batch_size", "Number of tasks executed in a batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+_FLUSH_SPAN = TRACER.register("Controller.flush")
+# Maximum number of items waiting in an output queue; when a consumer
+# (e.g. the display) is slower than the acquisition, the oldest items are
+# dropped.
+_OUTPUT_QUEUE_SIZE = 256
 
 
 class Event:
@@ -23,49 +43,96 @@ class CloseEvent:
     pass
 
 
+class TaskCancelledError(Exception):
+    pass
+
+
 class Task:
     def __init__(self, event):
         self.event = event
+        self.created_at = time.perf_counter()
         self.completed = threading.Event()
         self.completed.clear()
-        self.result = queue.Queue(maxsize=1)
-        self.error = queue.Queue(maxsize=1)
+        self.is_cancelled = False
+        self.result = None
+        self.error = None
+        self.done_callbacks = []
+        self.lock = threading.Lock()
 
     def wait(self, timeout=None):
-        self.completed.wait()
+        """
+        Returns True if the task was completed within the given timeout.
+        """
+        return self.completed.wait(timeout)
+
+    def is_done(self):
+        return self.completed.is_set()
+
+    def cancel(self):
+        self.is_cancelled = True
 
     def set_ready(self):
-        self.completed.set()
+        with self.lock:
+            self.completed.set()
+            callbacks, self.done_callbacks = self.done_callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+
+    def add_done_callback(self, func):
+        """
+        Calls func() when the task is completed: on the controller thread,
+        or immediately, if the task is already completed.
+        """
+        with self.lock:
+            if not self.completed.is_set():
+                self.done_callbacks.append(func)
+                return
+        self._call(func)
 
     def set_result(self, value):
-        self.result.put(value)
+        self.result = value
 
     def set_error(self, exc):
-        self.error.put(exc)
+        self.error = exc
 
     def get_result(self):
         self.wait()
-        try:
-            result = self.result.get(block=False)
-            # print(f"RESULT: {result}")
-            return result
-        except queue.Empty:
-            return None
+        return self.result
 
     def get_error(self):
         self.wait()
+        return self.error
+
+    def _call(self, func):
         try:
-            return self.error.get(block=False)
-        except queue.Empty:
-            return None
+            func()
+        except Exception:
+            _LOGGER.exception("Error in the task done callback")
 
 
 class Promise:
     def __init__(self, task):
         self.task = task
 
-    def wait(self):
-        self.task.wait()
+    def wait(self, timeout=None):
+        return self.task.wait(timeout)
+
+    def is_done(self):
+        return self.task.is_done()
+
+    def cancel(self):
+        """
+        Cancels the task: a waiting task is not executed, a running job
+        (e.g. a sweep) is stopped before its next step. The cancelled task
+        fails with TaskCancelledError.
+        """
+        self.task.cancel()
+
+    def add_done_callback(self, func):
+        """
+        Calls func(promise) when the result is available.
+        """
+        self.task.add_done_callback(lambda: func(self))
 
     def get_result(self):
         result = self.task.get_result()
@@ -76,28 +143,120 @@ class Promise:
 
 
 class OutputWorker:
-    def __init__(self):
-        self.queue = queue.Queue()
+    """
+    Queue of the model output items, for a single consumer.
+
+    The queue is bounded: when it is full, the oldest item is dropped, so
+    a slow consumer never stalls the producer (the acquisition callback)
+    nor accumulates the items without limit.
+
+    :param name: output name
+    :param maxsize: maximum number of the queued items
+    """
+    def __init__(self, name=None, maxsize=_OUTPUT_QUEUE_SIZE):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        labels = {"output": name}
+        REGISTRY.gauge("gui4us_output_queue_size",
+                       "Number of items waiting in the output queue",
+                       labels=labels).set_function(self.queue.qsize)
+        self.items_counter = REGISTRY.counter(
+            "gui4us_output_items_total", "Items put to the output queue",
+            labels=labels)
+        self.dropped_counter = REGISTRY.counter(
+            "gui4us_output_dropped_items_total",
+            "Items dropped because the output consumer was too slow",
+            labels=labels)
 
     def put(self, data):
-        self.queue.put(data)
+        self.items_counter.inc()
+        while True:
+            try:
+                self.queue.put_nowait(data)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.dropped_counter.inc()
+                _LOGGER.warning("The consumer of output %s is too slow, "
+                                "dropping the oldest items.", self.name)
+            except queue.Empty:
+                pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+
+class LatencyStatistics:
+    """
+    Statistics of the time between sending a task and its completion
+    (including the model flush), in seconds.
+    """
+    def __init__(self):
+        self.count = 0
+        self.last = None
+        self.mean = 0.0
+        self.max = 0.0
 
-    def get(self):
-        return self.queue.get()
+    def add(self, value):
+        self.count += 1
+        self.last = value
+        self.mean += (value-self.mean)/self.count
+        self.max = max(self.max, value)
+
+    def __repr__(self):
+        return f"LatencyStatistics(count={self.count}, last={self.last}, " \
+               f"mean={self.mean}, max={self.max})"
 
 
 class Controller:
-    def __init__(self, model):
-        self.model = model
+    """
+    Runs the model methods on a separate thread.
+
+    A model method can return a generator: it is then run as a job, one
+    step (next() call) at a time, between the other tasks, so that e.g.
+    a long sweep does not block the settings changes. The task of the job
+    completes when the generator returns.
+
+    The model can be created on the controller thread, by the given
+    model_factory, so that e.g. the view can be created in the meantime.
+    All the tasks sent before the model is created wait until it is ready;
+    if the model cannot be created, they fail with the model creation
+    error.
+
+    :param model: model (environment)
+    :param model_factory: a function that creates the model, an alternative
+      to the model parameter
+    """
+    def __init__(self, model=None, model_factory=None):
+        if (model is None) == (model_factory is None):
+            raise ValueError("Exactly one of model and model_factory "
+                             "should be provided.")
+        self.model = None
+        self.model_factory = model_factory
+        self.model_error = None
         self.task_queue = queue.Queue()
         self.result_queue = queue.Queue()
-        self.event_queue_runner = threading.Thread(target=self._main_loop)
-        self.event_queue_runner.start()
+        self.latencies = {}
+        # Method name -> tracing span id.
+        self.span_ids = {}
         self.output_buffers = {}
-        for key, output in self.model.outputs.items():
-            worker = OutputWorker()
-            output.add_callback(worker.put)
-            self.output_buffers[key] = worker
+        self.output_lock = threading.Lock()
+        self.scheduler = None
+        # Task -> generator, the currently running jobs.
+        self.jobs = {}
+        REGISTRY.gauge("gui4us_controller_queue_size",
+                       "Number of tasks waiting for the controller") \
+            .set_function(self.task_queue.qsize)
+        if model is not None:
+            self._set_model(model)
+        self.event_queue_runner = threading.Thread(target=self._main_loop,
+                                                   name="gui4us-controller")
+        self.event_queue_runner.start()
 
     def send(self, event):
         task = Task(event)
@@ -120,36 +279,210 @@ class Controller:
     def set_setting(self, key, value):
         self.send(MethodCallEvent(f"set_{key}", value))
 
+    def apply_settings(self, values):
+        """
+        Applies a dict of settings (setting id -> value) in a single
+        transaction, see the model's apply_settings.
+        """
+        return self.send(MethodCallEvent("apply_settings", (values, )))
+
     def get_output(self, key):
-        return self.output_buffers[key]
+        """
+        Returns the output worker with the given key. The worker can be
+        requested before the model is created, it starts receiving data
+        when the model is ready.
+        """
+        with self.output_lock:
+            worker = self.output_buffers.get(key, None)
+            if worker is not None:
+                return worker
+            if self.model is not None and key not in self.model.outputs:
+                raise KeyError(f"Unknown output: {key}")
+            worker = OutputWorker(key)
+            self.output_buffers[key] = worker
+            if self.model is not None:
+                self.model.outputs[key].add_callback(worker.put)
+            return worker
+
+    def get_latency_statistics(self):
+        """
+        Returns a dict: method name -> LatencyStatistics, e.g.
+        "set_tgc" -> time from the UI change until the curve was written
+        to the device.
+        """
+        return dict(self.latencies)
+
+    def get_trigger_scheduler(self):
+        """
+        Returns the acquisition trigger scheduler, see
+        gui4us.controller.scheduler. The scheduler is created with the
+        model, if the model works in the MANUAL mode; None otherwise (also
+        when the model is not created yet).
+        """
+        return self.scheduler
 
     def start(self):
         self.send(MethodCallEvent("start"))
 
     def close(self):
+        if self.scheduler is not None:
+            # The scheduler thread may wait for the model (up to its
+            # ready timeout), it is joined on the controller thread.
+            self.scheduler.stop()
         self.send(CloseEvent())
 
+    def _set_model(self, model):
+        with self.output_lock:
+            for key, output in model.outputs.items():
+                if key not in self.output_buffers:
+                    self.output_buffers[key] = OutputWorker(key)
+                worker = self.output_buffers[key]
+                output.add_callback(worker.put)
+            if model.get_work_mode() == "MANUAL":
+                self.scheduler = TriggerScheduler(model)
+            self.model = model
+
+    def _create_model(self):
+        try:
+            self._set_model(self.model_factory())
+        except Exception as e:
+            _LOGGER.exception("Cannot create the model")
+            self.model_error = e
+
     def _main_loop(self):
+        if self.model is None:
+            self._create_model()
         while True:
-            task = None
-            try:
-                # print("Controller ready, waiting for new data...")
-                task = self.task_queue.get()
-                event = task.event
-                if isinstance(event, CloseEvent):
-                    print("Closing controller")
+            # Execute all the currently pending tasks as a single batch,
+            # the model applies the batched changes (e.g. TGC curve) on flush.
+            # print("Controller ready, waiting for new data...")
+            tasks = []
+            if len(self.jobs) == 0:
+                tasks.append(self.task_queue.get())
+            while True:
+                try:
+                    tasks.append(self.task_queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = []
+            rejected = []
+            for i, task in enumerate(tasks):
+                if isinstance(task.event, CloseEvent):
+                    rejected = tasks[i:]
+                    break
+                batch.append(task)
+                self._execute(task)
+            if len(batch) > 0:
+                self._flush(batch)
+            if len(rejected) > 0:
+                _LOGGER.info("Closing controller")
+                if self.scheduler is not None:
+                    self.scheduler.close()
+                self._cancel_jobs()
+                if self.model is not None:
                     self.model.close()
-                    return
-                print("EVENT")
-                print(event)
-                result = self.model.__getattribute__(event.name)(*event.args,
-                                                                **event.kwargs)
-                task.set_result(result)
-                task.set_ready()
+                self._reject(rejected)
+                return
+            self._run_jobs()
+
+    def _flush(self, batch):
+        start = TRACER.begin()
+        try:
+            if self.model is not None:
+                self.model.flush()
+        except Exception as e:
+            _LOGGER.exception("Model flush failed")
+            for task in batch:
+                if task.error is None:
+                    task.set_error(e)
+        finally:
+            TRACER.end(_FLUSH_SPAN, start)
+        _BATCH_SIZE.observe(len(batch))
+        for task in batch:
+            # The jobs complete when their generator returns.
+            if task not in self.jobs:
+                self._complete(task)
+
+    def _complete(self, task):
+        task.set_ready()
+        name = task.event.name
+        latency = time.perf_counter()-task.created_at
+        self.latencies.setdefault(name, LatencyStatistics()).add(latency)
+        _TASKS.inc()
+        _TASK_LATENCY.observe(latency)
+        if task.error is not None:
+            _TASK_ERRORS.inc()
+
+    def _run_jobs(self):
+        """
+        Runs a single step of each job.
+        """
+        for task, job in list(self.jobs.items()):
+            try:
+                if task.is_cancelled:
+                    job.close()
+                    raise TaskCancelledError(f"{task.event.name} cancelled")
+                next(job)
+                continue
+            except StopIteration as e:
+                task.set_result(e.value)
+            except TaskCancelledError as e:
+                _LOGGER.info("%s", e)
+                task.set_error(e)
             except Exception as e:
-                print(e)
-                print(traceback.format_exc())
+                _LOGGER.exception("Error while executing %s",
+                                  task.event.name)
                 task.set_error(e)
-                task.set_ready()
-
-
+            del self.jobs[task]
+            self._complete(task)
+
+    def _cancel_jobs(self):
+        for task in self.jobs.keys():
+            task.cancel()
+        self._run_jobs()
+
+    def _reject(self, tasks):
+        """
+        Completes the close event and all the tasks sent after it (which
+        will not be executed), so that nobody waits for them forever.
+        """
+        while True:
+            try:
+                tasks.append(self.task_queue.get_nowait())
+            except queue.Empty:
+                break
+        error = RuntimeError("The controller is closed.")
+        for task in tasks:
+            if not isinstance(task.event, CloseEvent):
+                task.set_error(error)
+            task.set_ready()
+
+    def _execute(self, task):
+        event = task.event
+        if self.model_error is not None:
+            task.set_error(self.model_error)
+            return
+        if task.is_cancelled:
+            task.set_error(TaskCancelledError(f"{event.name} cancelled"))
+            return
+        start = TRACER.begin()
+        try:
+            _LOGGER.debug("Executing: %s", event)
+            result = self.model.__getattribute__(event.name)(*event.args,
+                                                            **event.kwargs)
+            if inspect.isgenerator(result):
+                self.jobs[task] = result
+            else:
+                task.set_result(result)
+        except Exception as e:
+            _LOGGER.exception("Error while executing %s", event.name)
+            task.set_error(e)
+        finally:
+            TRACER.end(self._get_span_id(event.name), start)
+
+    def _get_span_id(self, name):
+        span_id = self.span_ids.get(name, None)
+        if span_id is None:
+            span_id = TRACER.register(f"Controller.{name}")
+            self.span_ids[name] = span_id
+        return span_id
@@ -0,0 +1,217 @@
+"""
+Acquisition trigger scheduler for the MANUAL work mode.
+
+In the MANUAL work mode the TX/RX sequence is executed only when requested
+(model.run). The scheduler issues the runs on a dedicated thread:
+periodically, in bursts of N runs or on demand. The runs are scheduled at
+absolute times (t0 + k/rate), so the timing errors do not accumulate; the
+thread sleeps until shortly before the scheduled time and then busy-waits,
+to reduce the jitter.
+
+Before each run, the scheduler waits until the data of the previous runs
+are processed (at most max_pending runs in flight) and the consumers are
+not overloaded; the runs that cannot be issued on time are skipped
+instead of overrunning the host buffer.
+"""
+import logging
+import math
+import threading
+import time
+
+from gui4us.metrics import REGISTRY
+
+_LOGGER = logging.getLogger("gui4us.controller")
+_RUNS = REGISTRY.counter(
+    "gui4us_manual_runs_total", "Acquisition runs issued by the scheduler")
+_MISSED_RUNS = REGISTRY.counter(
+    "gui4us_manual_missed_runs_total",
+    "Scheduled runs skipped because the consumers were not ready in time")
+_JITTER = REGISTRY.histogram(
+    "gui4us_manual_run_jitter_seconds",
+    "Delay of the issued run after its scheduled time",
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+             0.01, 0.025))
+# The number of the most recent runs the statistics are computed for.
+_STATS_WINDOW = 256
+# Interval between the readiness checks, when the consumers are overloaded
+# [s].
+_RETRY_INTERVAL = 0.01
+
+
+class TriggerScheduler:
+    """
+    Issues the acquisition runs of the model (MANUAL work mode).
+
+    The methods can be called from any thread.
+
+    :param model: model with the run and wait_until_ready methods
+      (see gui4us.model.ultrasound.Env)
+    :param max_pending: maximum number of runs whose data were not
+      processed yet
+    :param ready_timeout: maximum time to wait for the data of the
+      pending runs [s]
+    :param spin_time: the scheduler busy-waits for this time before
+      each run [s]
+    """
+
+    def __init__(self, model, max_pending=1, ready_timeout=1.0,
+                 spin_time=1e-3):
+        self.model = model
+        self.max_pending = max_pending
+        self.ready_timeout = ready_timeout
+        self.spin_time = spin_time
+        # Current schedule.
+        self.rate = None
+        self.n_remaining = 0
+        self._generation = 0
+        self._is_closed = False
+        self._condition = threading.Condition()
+        # Statistics.
+        self.n_runs = 0
+        self.n_missed = 0
+        # The number of runs of the current schedule.
+        self._n_window = 0
+        self._times = [0.0]*_STATS_WINDOW
+        self._jitters = [0.0]*_STATS_WINDOW
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="gui4us-scheduler")
+        self._thread.start()
+
+    @property
+    def is_running(self):
+        return self.n_remaining != 0
+
+    def start_periodic(self, rate):
+        """
+        Issues runs at the given rate [Hz], until stopped.
+        """
+        self._set_schedule(rate, n_runs=-1)
+
+    def start_burst(self, n_runs, rate):
+        """
+        Issues n_runs runs at the given rate [Hz].
+        """
+        self._set_schedule(rate, n_runs=n_runs)
+
+    def trigger(self, n_runs=1):
+        """
+        Issues n_runs runs as soon as the consumers are ready.
+        """
+        self._set_schedule(None, n_runs=n_runs)
+
+    def stop(self):
+        self._set_schedule(None, n_runs=0)
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def get_stats(self):
+        """
+        Returns the scheduler statistics: requested and achieved run rate
+        [Hz], mean, std and max jitter (delay after the scheduled time) [s]
+        of the most recent runs of the current schedule, the total number
+        of issued and missed runs.
+        """
+        # Imported here, the controller is imported on startup.
+        import numpy as np
+        with self._condition:
+            n = min(self._n_window, _STATS_WINDOW)
+            times = np.sort(self._times[:n])
+            jitters = np.asarray(self._jitters[:n])
+            stats = {"requested_rate": self.rate, "n_runs": self.n_runs,
+                     "n_missed": self.n_missed}
+        achieved_rate = None
+        if n >= 2 and times[-1] > times[0]:
+            achieved_rate = (n-1)/(times[-1]-times[0])
+        stats["achieved_rate"] = achieved_rate
+        if n > 0:
+            stats.update(jitter_mean=np.mean(jitters),
+                         jitter_std=np.std(jitters),
+                         jitter_max=np.max(jitters))
+        return stats
+
+    def _set_schedule(self, rate, n_runs):
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Rate should be positive, got: {rate}")
+        with self._condition:
+            self.rate = rate
+            self.n_remaining = n_runs
+            self._generation += 1
+            if rate is not None:
+                self._n_window = 0
+            self._condition.notify_all()
+
+    def _run(self):
+        next_time = None
+        generation = None
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._is_closed or self.n_remaining != 0)
+                if self._is_closed:
+                    return
+                if generation != self._generation:
+                    # New schedule: start now.
+                    generation = self._generation
+                    next_time = time.perf_counter()
+                rate = self.rate
+            try:
+                if not self.model.wait_until_ready(self.max_pending,
+                                                   self.ready_timeout):
+                    with self._condition:
+                        self._condition.wait(_RETRY_INTERVAL)
+                    continue
+                if not self._wait_until(next_time, generation):
+                    continue
+                run_time = time.perf_counter()
+                self.model.run()
+            except Exception:
+                _LOGGER.exception("Cannot issue the acquisition run, "
+                                  "stopping the scheduler")
+                with self._condition:
+                    if generation == self._generation:
+                        self.n_remaining = 0
+                continue
+            jitter = run_time-next_time
+            _RUNS.inc()
+            _JITTER.observe(jitter)
+            with self._condition:
+                k = self._n_window % _STATS_WINDOW
+                self._times[k] = run_time
+                self._jitters[k] = jitter
+                self._n_window += 1
+                self.n_runs += 1
+                if self.n_remaining > 0 and generation == self._generation:
+                    self.n_remaining -= 1
+            if rate is None:
+                next_time = time.perf_counter()
+                continue
+            period = 1/rate
+            next_time += period
+            now = time.perf_counter()
+            if now > next_time+period:
+                # Skip the slots missed while waiting for the consumers.
+                n_missed = math.floor((now-next_time)/period)
+                next_time += n_missed*period
+                with self._condition:
+                    self.n_missed += n_missed
+                _MISSED_RUNS.inc(n_missed)
+
+    def _wait_until(self, deadline, generation):
+        """
+        Waits until the given time; returns False if the schedule has
+        changed in the meantime.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._is_closed or self._generation != generation,
+                timeout=max(0.0, deadline-self.spin_time
+                            - time.perf_counter()))
+            if self._is_closed or self._generation != generation:
+                return False
+        while time.perf_counter() < deadline:
+            pass
+        return True
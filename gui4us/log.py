@@ -0,0 +1,111 @@
+"""
+Logging configuration.
+
+The log records are put to a queue by the emitting thread (e.g. the
+acquisition callback) and written to the handlers by a separate listener
+thread, so emitting a record never waits for I/O. Repeated records from
+the same call site are rate-limited: at most `burst` records per
+`interval` seconds are passed; the number of the suppressed records is
+appended to the next passed one.
+
+Loggers of the gui4us subsystems: gui4us.model, gui4us.controller,
+gui4us.view, gui4us.state_graph, gui4us.cfg; the level of each of them can
+be set separately.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(threadName)s %(name)s: " \
+                 "%(message)s"
+SUBSYSTEMS = ("model", "controller", "view", "state_graph", "cfg")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most burst records from each call site (file, line) per
+    interval. The subsequent records from that site are dropped and
+    counted; the count is reported with the next passed record.
+
+    :param interval: length of the rate limiting window [s]
+    :param burst: the number of records passed per window
+    """
+
+    def __init__(self, interval=5.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        # (pathname, lineno) -> [window start, n passed, n suppressed]
+        self.sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self.sites.get(key, None)
+            if site is None:
+                site = [now, 0, 0]
+                self.sites[key] = site
+            if now-site[0] >= self.interval:
+                site[0], site[1] = now, 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            n_suppressed, site[2] = site[2], 0
+        if n_suppressed > 0:
+            record.msg = f"{record.msg} [{n_suppressed} similar " \
+                         f"messages suppressed]"
+        return True
+
+
+def configure_logging(log_file="gui4us.log", level=logging.INFO,
+                      console_level=logging.WARNING, levels=None,
+                      rate_limit_interval=5.0, rate_limit_burst=5):
+    """
+    Configures the root logger: the records are written asynchronously
+    to the log file and to stderr (records with at least console_level).
+
+    :param levels: subsystem name (e.g. "controller") or logger name
+      -> level
+    :return: the started QueueListener, call stop() to flush the records
+      on exit
+    """
+    formatter = logging.Formatter(DEFAULT_FORMAT)
+    file_handler = logging.FileHandler(filename=log_file)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(console_level)
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter(interval=rate_limit_interval,
+                                            burst=rate_limit_burst))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    for name, subsystem_level in (levels or {}).items():
+        if name in SUBSYSTEMS:
+            name = f"gui4us.{name}"
+        logging.getLogger(name).setLevel(subsystem_level)
+    listener = logging.handlers.QueueListener(
+        records, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def parse_levels(values):
+    """
+    Parses a list of "name=LEVEL" strings.
+    """
+    levels = {}
+    for value in values or []:
+        name, sep, level = value.partition("=")
+        if sep == "" or not hasattr(logging, level.upper()):
+            raise ValueError(f"Invalid log level specification: {value}, "
+                             f"expected: name=LEVEL, e.g. controller=DEBUG")
+        levels[name] = getattr(logging, level.upper())
+    return levels
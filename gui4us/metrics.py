@@ -0,0 +1,322 @@
+"""
+In-process metrics: counters, gauges and histograms.
+
+The counters and histograms are accumulated per thread (each thread
+updates only its own shard, without locking); the shards are summed only
+when the metrics are collected. The collected metrics are available in
+the Prometheus text format, on the local HTTP endpoint (MetricsServer)
+and/or periodically written to a file (MetricsFileWriter).
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+
+_LOGGER = logging.getLogger("gui4us.metrics")
+
+
+def _format_labels(labels, extra=None):
+    labels = list(labels)
+    if extra is not None:
+        labels.append(extra)
+    if len(labels) == 0:
+        return ""
+    values = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{{{values}}}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._shards = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get_shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._create_shard()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _create_shard(self):
+        raise NotImplementedError()
+
+    def collect(self):
+        """
+        Returns the samples: a list of (suffix, extra label, value).
+        """
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value, e.g. the number of frames.
+    """
+    type = "counter"
+
+    def _create_shard(self):
+        return [0]
+
+    def inc(self, value=1):
+        self._get_shard()[0] += value
+
+    def get_value(self):
+        with self._lock:
+            return sum(shard[0] for shard in self._shards)
+
+    def collect(self):
+        return [("", None, self.get_value())]
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down, e.g. queue size. The value can be
+    also determined by a function, evaluated when the metrics are
+    collected.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labels):
+        super().__init__(name, help, labels)
+        self.value = 0
+        self.func = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, func):
+        self.func = func
+
+    def get_value(self):
+        if self.func is not None:
+            return self.func()
+        return self.value
+
+    def collect(self):
+        return [("", None, self.get_value())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of the observed values in fixed buckets, e.g. callback
+    processing time.
+
+    :param buckets: upper bounds of the buckets (increasing)
+    """
+    type = "histogram"
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, name, help, labels, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _create_shard(self):
+        # Counts of each bucket (the last one: +Inf), sum.
+        return [[0]*(len(self.buckets)+1), 0.0]
+
+    def observe(self, value):
+        shard = self._get_shard()
+        shard[0][bisect.bisect_left(self.buckets, value)] += 1
+        shard[1] += value
+
+    def time(self):
+        """
+        Returns a context manager, which observes the duration of the
+        with block [s].
+        """
+        return _Timer(self)
+
+    def collect(self):
+        counts = [0]*(len(self.buckets)+1)
+        total = 0.0
+        with self._lock:
+            for shard_counts, shard_sum in self._shards:
+                for i, count in enumerate(shard_counts):
+                    counts[i] += count
+                total += shard_sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf, ), counts):
+            cumulative += count
+            samples.append(("_bucket", ("le", _format_value(bound)),
+                            cumulative))
+        samples.append(("_sum", None, total))
+        samples.append(("_count", None, cumulative))
+        return samples
+
+
+class _Timer:
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter()-self.start)
+
+
+class Registry:
+    """
+    A set of metrics. A metric with the given name and labels is created
+    on the first request, the subsequent requests return the same object.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help="", labels=None) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=None) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", labels=None,
+                  buckets=Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self._lock:
+            metric = self.metrics.get(key, None)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as "
+                                 f"{metric.type}")
+            return metric
+
+    def to_text(self):
+        """
+        Returns all the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = sorted(self.metrics.values(),
+                             key=lambda m: (m.name, m.labels))
+        lines = []
+        previous_name = None
+        for metric in metrics:
+            if metric.name != previous_name:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                previous_name = metric.name
+            try:
+                samples = metric.collect()
+            except Exception as e:
+                _LOGGER.warning("Cannot collect metric %s: %s",
+                                metric.name, e)
+                continue
+            for suffix, extra_label, value in samples:
+                labels = _format_labels(metric.labels, extra_label)
+                lines.append(f"{metric.name}{suffix}{labels} "
+                             f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# The default registry.
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """
+    Serves the metrics in the Prometheus text format on
+    http://host:port/metrics. By default, only local connections are
+    accepted.
+    """
+
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY):
+        # Imported here, the metrics module is imported on startup.
+        import http.server
+        self.registry = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+                if handler.path not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = registry.to_text().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type",
+                                    "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsFileWriter:
+    """
+    Periodically writes the metrics to the given file (Prometheus text
+    format), replacing the previous content.
+
+    :param interval: interval between two writes [s]
+    """
+
+    def __init__(self, path, interval=5.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.registry.to_text())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                _LOGGER.warning("Cannot write metrics to %s: %s",
+                                self.path, e)
@@ -0,0 +1,279 @@
+"""
+Capture files.
+
+A capture is stored as a directory with the following files:
+
+- capture.pkl: pickled header: arrus metadata, the number of frames of each
+  output, per-frame tags and additional attributes,
+- out_{i}.npy: frames of the i-th output, an array with shape
+  (capacity, *frame_shape); only the first n_frames[i] frames are valid.
+
+The frames can be stored reduced (see FrameReducer), the reduction
+parameters of each output are then stored in the "reduction" attribute:
+a list of dicts (or None, when the output is not reduced); the frames are
+decoded when read with Capture.get_frame.
+
+The frames are stored in the regular .npy files, so they can be
+memory-mapped when reading.
+"""
+import os
+import pickle
+import numpy as np
+
+HEADER_FILE = "capture.pkl"
+REDUCTION_ATTR = "reduction"
+_INTEGER_DTYPES = {"uint8", "uint16"}
+
+
+def _get_output_path(path, ordinal):
+    return os.path.join(path, f"out_{ordinal}.npy")
+
+
+class FrameReducer:
+    """
+    Reduces the frames of a single output according to the capture policy
+    (see gui4us.cfg.CapturePolicy): crops to the ROI and converts the
+    values to the smaller data type. Integer types store
+    (value-offset)/scale, rounded and clipped to the type range.
+
+    All the operations are vectorized and write to the preallocated
+    arrays.
+
+    :param policy: capture policy
+    :param shape: input frame shape
+    :param dtype: input frame data type
+    """
+
+    def __init__(self, policy, shape, dtype):
+        self.decimation = policy.decimation
+        if self.decimation < 1:
+            raise ValueError(f"Decimation should be >= 1, "
+                             f"got: {self.decimation}")
+        roi = policy.roi
+        if roi is None:
+            roi = (None, )*len(shape)
+        if len(roi) != len(shape):
+            raise ValueError(f"ROI {roi} does not match the frame shape "
+                             f"{shape}")
+        shape = tuple(shape)
+        self.roi = tuple((0, n) if r is None else (max(r[0], 0), min(r[1], n))
+                         for r, n in zip(roi, shape))
+        self.slices = tuple(slice(start, end) for start, end in self.roi)
+        self.shape = tuple(end-start for start, end in self.roi)
+        self.dtype = np.dtype(policy.dtype if policy.dtype is not None
+                              else dtype)
+        self.scale, self.offset = None, None
+        self._buffer = None
+        if policy.dtype in _INTEGER_DTYPES:
+            if policy.value_range is None:
+                raise ValueError(f"Capture policy with dtype {policy.dtype} "
+                                 f"requires value_range.")
+            vmin, vmax = policy.value_range
+            self.max_value = np.iinfo(self.dtype).max
+            self.offset = float(vmin)
+            self.scale = (float(vmax)-float(vmin))/self.max_value
+            self._buffer = np.zeros(self.shape, dtype=np.float32)
+        # True if the frames are stored unchanged.
+        self.is_identity = self.decimation == 1 and self.shape == shape \
+            and self.dtype == np.dtype(dtype)
+
+    def get_attrs(self):
+        """
+        Returns the parameters required to decode the frames.
+        """
+        return {"roi": self.roi, "decimation": self.decimation,
+                "scale": self.scale, "offset": self.offset}
+
+    def reduce(self, frame, out):
+        """
+        Writes the reduced frame to the given array.
+        """
+        frame = frame[self.slices]
+        if self.scale is None:
+            np.copyto(out, frame, casting="unsafe")
+            return
+        buffer = self._buffer
+        np.subtract(frame, self.offset, out=buffer, casting="unsafe")
+        np.multiply(buffer, 1/self.scale, out=buffer)
+        np.clip(buffer, 0, self.max_value, out=buffer)
+        np.rint(buffer, out=buffer)
+        np.copyto(out, buffer, casting="unsafe")
+
+
+def decode_frame(frame, attrs):
+    """
+    Decodes the frame stored by the FrameReducer with the given attributes.
+    """
+    if attrs is None or attrs["scale"] is None:
+        return frame
+    return frame.astype(np.float32)*np.float32(attrs["scale"]) \
+        + np.float32(attrs["offset"])
+
+
+class Capture:
+    """
+    Captured frames.
+
+    :param metadata: arrus metadata of the captured outputs
+    :param outputs: frames of each output, each an array with shape
+      (number of frames, *frame_shape)
+    :param tags: per-frame tags, a dict: tag name -> array of values
+    :param attrs: additional capture attributes
+    """
+
+    def __init__(self, metadata, outputs, tags=None, attrs=None):
+        self.metadata = metadata
+        self.outputs = outputs
+        self.tags = tags if tags is not None else {}
+        self.attrs = attrs if attrs is not None else {}
+
+    def get_n_frames(self, ordinal=0):
+        return len(self.outputs[ordinal])
+
+    def get_frame(self, i, ordinal=0):
+        return decode_frame(self.outputs[ordinal][i],
+                            self.get_reduction(ordinal))
+
+    def get_reduction(self, ordinal=0):
+        """
+        Returns the reduction parameters of the given output (see
+        FrameReducer.get_attrs), None if the frames are not reduced.
+        """
+        reduction = self.attrs.get(REDUCTION_ATTR, None)
+        if reduction is None:
+            return None
+        return reduction[ordinal]
+
+
+class CaptureWriter:
+    """
+    Writes frames to the capture directory.
+
+    :param path: path to the output capture directory
+    :param metadata: arrus metadata of the captured outputs
+    :param shapes: shape of a single frame of each output
+    :param dtypes: data type of each output
+    :param capacity: maximum number of frames of each output
+    :param attrs: additional capture attributes
+    """
+
+    def __init__(self, path, metadata, shapes, dtypes, capacity,
+                 attrs=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.header = {
+            "metadata": metadata,
+            "capacity": capacity,
+            "n_frames": [0]*len(shapes),
+            "tags": {},
+            "attrs": dict(attrs) if attrs is not None else {}
+        }
+        self.outputs = [
+            np.lib.format.open_memmap(
+                _get_output_path(path, i), mode="w+", dtype=dtype,
+                shape=(capacity, *shape))
+            for i, (shape, dtype) in enumerate(zip(shapes, dtypes))
+        ]
+        self.flush()
+
+    @staticmethod
+    def reopen(path):
+        """
+        Opens an existing capture directory for writing, e.g. to resume
+        an interrupted write.
+        """
+        writer = CaptureWriter.__new__(CaptureWriter)
+        writer.path = path
+        with open(os.path.join(path, HEADER_FILE), "rb") as f:
+            writer.header = pickle.load(f)
+        writer.capacity = writer.header["capacity"]
+        writer.outputs = [
+            np.load(_get_output_path(path, i), mmap_mode="r+")
+            for i in range(len(writer.header["n_frames"]))
+        ]
+        return writer
+
+    @property
+    def n_frames(self):
+        return self.header["n_frames"]
+
+    def append(self, frames):
+        """
+        Appends a single frame of each output.
+        """
+        for i, frame in enumerate(frames):
+            self.write(i, self.n_frames[i], frame[np.newaxis, ...])
+
+    def write(self, ordinal, start, frames):
+        """
+        Writes the given frames of the output, starting from the given frame
+        number.
+        """
+        end = start+len(frames)
+        if end > self.capacity:
+            raise ValueError(f"Capture capacity exceeded: {end} > "
+                             f"{self.capacity}")
+        self.outputs[ordinal][start:end] = frames
+        self.n_frames[ordinal] = max(self.n_frames[ordinal], end)
+
+    def set_tags(self, name, values):
+        """
+        Sets the per-frame tag values.
+        """
+        self.header["tags"][name] = np.asarray(values)
+
+    def flush(self):
+        for output in self.outputs:
+            output.flush()
+        # Replace the header atomically, so that an interrupted write
+        # never leaves a corrupted capture.
+        header_path = os.path.join(self.path, HEADER_FILE)
+        tmp_path = header_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.header, f)
+        os.replace(tmp_path, header_path)
+
+    def close(self):
+        self.flush()
+        self.outputs = []
+
+
+def write_capture(path, metadata, frames, attrs=None):
+    """
+    Writes the given frames to a new capture directory.
+
+    :param frames: a sequence of frames, each frame is a sequence of
+      arrays, one for each output
+    """
+    first = frames[0]
+    writer = CaptureWriter(path, metadata,
+                           shapes=[f.shape for f in first],
+                           dtypes=[f.dtype for f in first],
+                           capacity=len(frames), attrs=attrs)
+    for frame in frames:
+        writer.append(frame)
+    writer.close()
+
+
+def load_capture(path, mmap_mode="r"):
+    """
+    Loads capture from the given path. Frames from the capture directory
+    are memory-mapped (unless mmap_mode is None); the captures saved in
+    the python pickle format are loaded into memory.
+    """
+    if not os.path.isdir(path):
+        with open(path, "rb") as f:
+            content = pickle.load(f)
+        frames = [f for f in content["data"] if f is not None]
+        outputs = [np.stack([frame[i] for frame in frames])
+                   for i in range(len(frames[0]))]
+        return Capture(metadata=content["metadata"], outputs=outputs)
+    with open(os.path.join(path, HEADER_FILE), "rb") as f:
+        header = pickle.load(f)
+    outputs = [
+        np.load(_get_output_path(path, i), mmap_mode=mmap_mode)[:n]
+        for i, n in enumerate(header["n_frames"])
+    ]
+    return Capture(metadata=header["metadata"], outputs=outputs,
+                   tags=header["tags"], attrs=header["attrs"])
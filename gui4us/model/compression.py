@@ -0,0 +1,89 @@
+"""
+Lossless frame compression.
+
+Before compression, the frame values are (optionally) delta-encoded: the
+difference between the consecutive values is computed on the integer
+representation of the values (wrapping around), so that the encoding is
+lossless also for the floating point data. The bytes are then shuffled:
+the k-th bytes of all the values are stored together, which makes the
+slowly changing ultrasound data much more compressible.
+"""
+import lzma
+import zlib
+
+import numpy as np
+
+CODECS = ("zlib", "lzma")
+# Value size -> unsigned integer type used for the delta encoding.
+_UINT_TYPES = {
+    1: np.uint8,
+    2: np.uint16,
+    4: np.uint32,
+    8: np.uint64
+}
+
+
+class CompressedFrame:
+    """
+    A single compressed frame.
+    """
+
+    def __init__(self, data, shape, dtype, codec, is_delta):
+        self.data = data
+        self.shape = shape
+        self.dtype = dtype
+        self.codec = codec
+        self.is_delta = is_delta
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+def compress(frame, codec="zlib", level=1, delta=True) -> CompressedFrame:
+    """
+    Compresses the given frame.
+
+    :param codec: "zlib" or "lzma"
+    :param level: compression level (zlib level or lzma preset: 0-9)
+    :param delta: whether to delta-encode the values before compression
+    """
+    frame = np.ascontiguousarray(frame)
+    itemsize = frame.dtype.itemsize
+    uint_type = _UINT_TYPES.get(itemsize, None)
+    is_delta = delta and uint_type is not None and frame.size > 0
+    if is_delta:
+        values = frame.reshape(-1).view(uint_type)
+        deltas = np.empty_like(values)
+        deltas[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=deltas[1:])
+        values = deltas
+    else:
+        values = frame.reshape(-1)
+    # Byte shuffle.
+    data = values.view(np.uint8).reshape(-1, itemsize).T.tobytes()
+    if codec == "zlib":
+        data = zlib.compress(data, level)
+    elif codec == "lzma":
+        data = lzma.compress(data, preset=level)
+    else:
+        raise ValueError(f"Unknown codec: {codec}, available: {CODECS}")
+    return CompressedFrame(data, frame.shape, frame.dtype, codec, is_delta)
+
+
+def decompress(frame: CompressedFrame):
+    """
+    Returns the decompressed frame (numpy array).
+    """
+    if frame.codec == "zlib":
+        data = zlib.decompress(frame.data)
+    else:
+        data = lzma.decompress(frame.data)
+    itemsize = frame.dtype.itemsize
+    # Byte unshuffle.
+    values = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.copy()
+    if frame.is_delta:
+        uint_type = _UINT_TYPES[itemsize]
+        values = np.cumsum(values.view(uint_type).reshape(-1),
+                           dtype=uint_type)
+    return values.view(frame.dtype).reshape(frame.shape)
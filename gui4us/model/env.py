@@ -48,6 +48,21 @@ class Env:
     def close(self) -> None:
         raise NotImplementedError()
 
+    def get_work_mode(self):
+        """
+        Returns the acquisition work mode; "MANUAL" means that each
+        acquisition is triggered by the controller (see the run method),
+        None if not applicable.
+        """
+        return None
+
+    def flush(self) -> None:
+        """
+        Applies the pending (batched) changes. Called by the controller after
+        each batch of tasks.
+        """
+        pass
+
     @abstractmethod
     def do(self, action: Action) -> None:
         raise NotImplementedError()
@@ -0,0 +1,78 @@
+"""
+Acquisition callback load monitoring.
+
+The load is the ratio of the new data callback processing time to the
+interval between the consecutive frames (both averaged over a window of
+frames). When the load approaches 1, the consumers process the frames
+slower than they are acquired: the host buffer fills up and overflows.
+"""
+import time
+
+import gui4us.cfg
+
+DROP_DISPLAY = "drop_display"
+PAUSE_CAPTURE = "pause_capture"
+ALARM = "alarm"
+OVERLOAD_ACTIONS = (DROP_DISPLAY, PAUSE_CAPTURE, ALARM)
+
+
+class LoadMonitor:
+    """
+    Detects the sustained overload of the acquisition callback.
+
+    The overload starts when the load exceeds high_load and ends when it
+    drops below low_load (see gui4us.cfg.OverloadPolicy).
+
+    :param policy: overload policy
+    """
+
+    def __init__(self, policy: gui4us.cfg.OverloadPolicy):
+        if policy.action not in OVERLOAD_ACTIONS:
+            raise ValueError(f"Unknown overload action: {policy.action}, "
+                             f"available: {OVERLOAD_ACTIONS}")
+        if not 0 < policy.low_load <= policy.high_load:
+            raise ValueError("The overload thresholds should satisfy: "
+                             "0 < low_load <= high_load.")
+        self.policy = policy
+        self.alpha = 2/(policy.window+1)
+        self.busy_time = 0.0
+        self.interval = 0.0
+        self.n_frames = 0
+        self.is_overloaded = False
+        self._last_start = None
+
+    @property
+    def load(self):
+        if self.interval <= 0.0:
+            return 0.0
+        return self.busy_time/self.interval
+
+    def begin(self):
+        """
+        Called at the beginning of the callback, returns the start time.
+        """
+        start = time.perf_counter()
+        if self._last_start is not None:
+            self.interval += self.alpha*(start-self._last_start
+                                         - self.interval)
+        self._last_start = start
+        return start
+
+    def end(self, start):
+        """
+        Called at the end of the callback; returns True if the overload
+        state has changed.
+        """
+        busy_time = time.perf_counter()-start
+        self.busy_time += self.alpha*(busy_time-self.busy_time)
+        self.n_frames += 1
+        if self.n_frames < self.policy.window:
+            return False
+        load = self.load
+        if not self.is_overloaded and load > self.policy.high_load:
+            self.is_overloaded = True
+            return True
+        if self.is_overloaded and load < self.policy.low_load:
+            self.is_overloaded = False
+            return True
+        return False
@@ -0,0 +1,263 @@
+"""
+Capture previews: downsampled thumbnails and per-frame statistics.
+
+The preview of a single output of the capture contains:
+
+- a thumbnail pyramid: level 0 is the frame downsampled (block mean) to at
+  most max_size samples along each axis, each next level is downsampled
+  by 2, down to min_size,
+- per-frame statistics of the full resolution frame: mean, max and energy
+  (mean square) of the sample magnitudes.
+
+The preview is stored as a sidecar of the capture: the "preview"
+subdirectory of the capture directory, or <capture>.preview for the
+captures in the python pickle format. The sidecar is a regular capture
+directory (see gui4us.model.capture): the outputs are the pyramid levels,
+the statistics are stored as the per-frame tags, so it can be read with
+load_capture or load_preview.
+
+Frames with more than two dimensions are averaged over the leading axes
+before downsampling.
+
+Usage (generates the sidecar of the saved capture):
+
+    python -m gui4us.model.preview capture_dir
+"""
+import argparse
+import logging
+import os
+import threading
+
+import numpy as np
+
+from gui4us.model.capture import CaptureWriter, load_capture
+
+_LOGGER = logging.getLogger("gui4us.model")
+PREVIEW_DIR = "preview"
+PREVIEW_SUFFIX = ".preview"
+STATS = ("mean", "max", "energy")
+# The number of frames processed between two sidecar header updates.
+_FLUSH_INTERVAL = 256
+
+
+def get_preview_path(capture_path):
+    """
+    Returns the path to the preview sidecar of the given capture.
+    """
+    if os.path.isdir(capture_path):
+        return os.path.join(capture_path, PREVIEW_DIR)
+    return os.path.splitext(capture_path)[0] + PREVIEW_SUFFIX
+
+
+def load_preview(capture_path, mmap_mode="r"):
+    """
+    Loads the preview of the given capture; returns a Capture with the
+    pyramid levels as the outputs and the statistics as the tags.
+    """
+    return load_capture(get_preview_path(capture_path), mmap_mode=mmap_mode)
+
+
+def _get_pyramid_shapes(shape, max_size, min_size):
+    shape = tuple(shape[-2:])
+    factors = tuple(max(1, -(-n // max_size)) for n in shape)
+    shapes = [tuple(n // f for n, f in zip(shape, factors))]
+    while all(n // 2 >= min_size for n in shapes[-1]):
+        shapes.append(tuple(n // 2 for n in shapes[-1]))
+    return factors, shapes
+
+
+def _downsample(image, factors, out):
+    """
+    Block mean of the image, written to the given array.
+    """
+    (n0, n1), (f0, f1) = out.shape, factors
+    blocks = image[:n0*f0, :n1*f1].reshape(n0, f0, n1, f1)
+    np.mean(blocks, axis=(1, 3), out=out, dtype=np.float32)
+
+
+class PreviewGenerator:
+    """
+    Computes the preview of the given capture output, incrementally:
+    each update processes the frames captured since the previous update.
+
+    The preview is kept in memory, unless the path to the sidecar is
+    given: then the results are written directly to the sidecar.
+
+    :param capture: captured frames, an object with get_n_frames and
+      get_frame methods (e.g. CaptureBuffer or Capture)
+    :param ordinal: ordinal number of the output
+    :param capacity: maximum number of frames (default: the current number
+      of the frames of the capture)
+    :param path: optional path to the output sidecar directory
+    :param max_size: maximum size of the level 0 thumbnails
+    :param min_size: minimum size of the smallest thumbnails
+    """
+
+    def __init__(self, capture, ordinal=0, capacity=None, path=None,
+                 max_size=128, min_size=16):
+        self.capture = capture
+        self.ordinal = ordinal
+        self.capacity = capacity if capacity is not None \
+            else capture.get_n_frames(ordinal)
+        self.max_size = max_size
+        self.min_size = min_size
+        self.n_frames = 0
+        self.factors = None
+        self.levels = None
+        self.stats = {name: np.zeros(self.capacity, dtype=np.float32)
+                      for name in STATS}
+        self.path = path
+        self.writer = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval=0.2):
+        """
+        Starts updating the preview on a background thread, every
+        interval seconds.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval, ),
+                                        daemon=True, name="gui4us-preview")
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, after processing all the captured
+        frames.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def update(self):
+        """
+        Processes the new frames; returns the number of processed frames.
+        """
+        with self._lock:
+            n_available = min(self.capture.get_n_frames(self.ordinal),
+                              self.capacity)
+            start = self.n_frames
+            for i in range(start, n_available):
+                self._process(i, self.capture.get_frame(i, self.ordinal))
+                self.n_frames = i+1
+                if self.writer is not None \
+                        and self.n_frames % _FLUSH_INTERVAL == 0:
+                    self._flush()
+            if self.writer is not None and self.n_frames > start:
+                self._flush()
+            return self.n_frames-start
+
+    def save(self, path):
+        """
+        Writes the preview of the processed frames to the given sidecar
+        directory.
+        """
+        with self._lock:
+            if self.levels is None:
+                return
+            writer = self._create_writer(path, capacity=self.n_frames)
+            for k, level in enumerate(self.levels):
+                writer.write(k, 0, level[:self.n_frames])
+            for name, values in self.stats.items():
+                writer.set_tags(name, values[:self.n_frames])
+            writer.close()
+
+    def close(self):
+        self.stop()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self._try_update()
+        self._try_update()
+
+    def _try_update(self):
+        try:
+            self.update()
+        except Exception:
+            _LOGGER.exception("Cannot update the capture preview")
+
+    def _process(self, i, frame):
+        frame = np.abs(frame)
+        self.stats["mean"][i] = np.mean(frame)
+        self.stats["max"][i] = np.max(frame)
+        self.stats["energy"][i] = np.mean(np.square(frame, dtype=np.float32))
+        if self.levels is None:
+            self._allocate(frame.shape)
+        image = frame
+        if image.ndim > 2:
+            image = np.mean(image.reshape(-1, *image.shape[-2:]), axis=0)
+        elif image.ndim == 1:
+            image = image[np.newaxis, :]
+        _downsample(image, self.factors, self.levels[0][i])
+        for k in range(1, len(self.levels)):
+            _downsample(self.levels[k-1][i], (2, 2), self.levels[k][i])
+
+    def _allocate(self, shape):
+        if len(shape) == 1:
+            shape = (1, *shape)
+        self.factors, shapes = _get_pyramid_shapes(shape, self.max_size,
+                                                   self.min_size)
+        if self.path is not None:
+            self.writer = self._create_writer(self.path, self.capacity,
+                                              shapes)
+            self.levels = self.writer.outputs
+        else:
+            self.levels = [np.zeros((self.capacity, *s), dtype=np.float32)
+                           for s in shapes]
+
+    def _create_writer(self, path, capacity, shapes=None):
+        if shapes is None:
+            shapes = [level.shape[1:] for level in self.levels]
+        return CaptureWriter(
+            path, metadata=None, shapes=shapes,
+            dtypes=[np.float32]*len(shapes), capacity=capacity,
+            attrs={"ordinal": self.ordinal, "factors": self.factors})
+
+    def _flush(self):
+        self.writer.header["n_frames"] = [self.n_frames]*len(self.levels)
+        for name, values in self.stats.items():
+            self.writer.set_tags(name, values[:self.n_frames])
+        self.writer.flush()
+
+
+def create_preview(capture_path, ordinal=0, max_size=128, min_size=16):
+    """
+    Generates the preview sidecar of the saved capture; returns the path
+    to the sidecar.
+    """
+    capture = load_capture(capture_path)
+    path = get_preview_path(capture_path)
+    generator = PreviewGenerator(capture, ordinal=ordinal, path=path,
+                                 max_size=max_size, min_size=min_size)
+    generator.update()
+    generator.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates the preview (thumbnails and per-frame "
+                    "statistics) of the saved capture.")
+    parser.add_argument("capture", help="Path to the capture (directory or "
+                                        ".pkl file)")
+    parser.add_argument("--ordinal", dest="ordinal", type=int, default=0,
+                        help="Ordinal number of the output")
+    parser.add_argument("--max-size", dest="max_size", type=int,
+                        default=128, help="Maximum size of the thumbnails")
+    parser.add_argument("--min-size", dest="min_size", type=int,
+                        default=16, help="Minimum size of the thumbnails")
+    args = parser.parse_args()
+    path = create_preview(args.capture, ordinal=args.ordinal,
+                          max_size=args.max_size, min_size=args.min_size)
+    print(f"Preview written to: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Parameter sweep acquisition.
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from gui4us.model.capture import CaptureWriter
+
+_LOGGER = logging.getLogger("gui4us.model")
+# Stops the writer thread.
+_STOP = object()
+
+
+class SweepRunner:
+    """
+    Acquires frames for each combination of the given setting values.
+
+    For each step of the sweep (the cartesian product of the grid values)
+    the settings are applied, the first n_settle frames are skipped and
+    the next n_frames frames are captured. All steps are written to
+    a single capture directory (see gui4us.model.capture); each frame is
+    tagged with the step number ("sweep_step") and the setting values.
+
+    The frames of step k are written to disk by a separate thread, while
+    step k+1 is acquired. The frames are copied to preallocated buffers
+    (two per sweep), the acquisition waits only when both buffers are
+    still being written.
+
+    The environment should be already started (i.e. producing frames).
+
+    The sweep can be run at once (run) or step by step (iter_steps), e.g.
+    by the controller, between the other tasks.
+
+    :param env: ultrasound environment
+    :param path: path to the output capture directory
+    :param grid: setting id -> a sequence of values
+    :param n_frames: the number of captured frames per step
+    :param n_settle: the number of skipped frames after applying settings
+    :param timeout: maximum time to wait for a single step [s]
+    :param on_step: optional callback, called with (step number,
+      number of steps, step settings) after each step is acquired
+    """
+
+    def __init__(self, env, path, grid: dict, n_frames: int,
+                 n_settle: int = 0, timeout: float = 10.0, on_step=None):
+        if n_frames < 1:
+            raise ValueError("At least one frame per step is required.")
+        self.env = env
+        self.path = path
+        self.names = list(grid.keys())
+        self.steps = list(itertools.product(*grid.values()))
+        self.n_frames = n_frames
+        self.n_settle = n_settle
+        self.timeout = timeout
+        self.on_step = on_step
+        self.shapes = [m.input_shape for m in env.metadata]
+        self.dtypes = [m.dtype for m in env.metadata]
+        self.write_time = 0.0
+        self._free_buffers = queue.Queue()
+        for _ in range(2):
+            self._free_buffers.put(self._allocate_buffer())
+        self._write_queue = queue.Queue(maxsize=1)
+        self._write_error = None
+        # Acquisition state, shared with the frame listener.
+        self._condition = threading.Condition()
+        self._buffer = None
+        self._n_skip = 0
+        self._n_captured = 0
+
+    def run(self):
+        """
+        Runs the sweep, returns the path to the output capture.
+        """
+        steps = self.iter_steps()
+        while True:
+            try:
+                next(steps)
+            except StopIteration as e:
+                return e.value
+
+    def iter_steps(self):
+        """
+        Returns a generator that runs a single step of the sweep on each
+        next() call; the generator returns the path to the output capture.
+        Closing the generator cancels the sweep, the already written steps
+        are kept.
+        """
+        writer = CaptureWriter(
+            self.path, self.env.metadata, shapes=self.shapes,
+            dtypes=self.dtypes, capacity=len(self.steps)*self.n_frames,
+            attrs={"sweep": {"names": self.names, "steps": self.steps,
+                             "n_frames": self.n_frames,
+                             "n_settle": self.n_settle}})
+        writer_thread = threading.Thread(target=self._write,
+                                         args=(writer, ), daemon=True)
+        writer_thread.start()
+        self.env.add_frame_listener(self._on_new_frame)
+        try:
+            for k, step in enumerate(self.steps):
+                settings = dict(zip(self.names, step))
+                self.env.apply_settings(settings)
+                buffer = self._free_buffers.get()
+                self._acquire(buffer)
+                self._put(k, buffer)
+                if self.on_step is not None:
+                    self.on_step(k, len(self.steps), settings)
+                yield k
+        finally:
+            self.env.remove_frame_listener(self._on_new_frame)
+            self._write_queue.put(_STOP)
+            writer_thread.join()
+            writer.close()
+        if self._write_error is not None:
+            raise self._write_error
+        return self.path
+
+    def _allocate_buffer(self):
+        return [np.zeros((self.n_frames, *shape), dtype=dtype)
+                for shape, dtype in zip(self.shapes, self.dtypes)]
+
+    def _acquire(self, buffer):
+        with self._condition:
+            self._buffer = buffer
+            self._n_skip = self.n_settle
+            self._n_captured = 0
+            is_done = self._condition.wait_for(
+                lambda: self._n_captured == self.n_frames,
+                timeout=self.timeout)
+            self._buffer = None
+        if not is_done:
+            raise TimeoutError(f"Acquired {self._n_captured} of "
+                               f"{self.n_frames} frames within "
+                               f"{self.timeout} s.")
+
+    def _put(self, k, buffer):
+        while True:
+            if self._write_error is not None:
+                raise self._write_error
+            try:
+                self._write_queue.put((k, buffer), timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _on_new_frame(self, data):
+        with self._condition:
+            if self._buffer is None or self._n_captured == self.n_frames:
+                return
+            if self._n_skip > 0:
+                self._n_skip -= 1
+                return
+            for output, frame in zip(self._buffer, data):
+                output[self._n_captured] = frame
+            self._n_captured += 1
+            if self._n_captured == self.n_frames:
+                self._condition.notify_all()
+
+    def _write(self, writer):
+        n_written = 0
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                return
+            k, buffer = item
+            if self._write_error is None:
+                try:
+                    start = time.perf_counter()
+                    for i, frames in enumerate(buffer):
+                        writer.write(i, k*self.n_frames, frames)
+                    n_written += 1
+                    self._set_tags(writer, n_written)
+                    writer.flush()
+                    self.write_time += time.perf_counter()-start
+                except Exception as e:
+                    _LOGGER.exception("Cannot write the sweep step %d", k)
+                    self._write_error = e
+            self._free_buffers.put(buffer)
+
+    def _set_tags(self, writer, n_steps):
+        steps = np.arange(n_steps)
+        writer.set_tags("sweep_step", np.repeat(steps, self.n_frames))
+        for j, name in enumerate(self.names):
+            values = [step[j] for step in self.steps[:n_steps]]
+            writer.set_tags(name, np.repeat(values, self.n_frames, axis=0))
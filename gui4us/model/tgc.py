@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class TgcInterpolator:
+    """
+    Maps TGC values at the UI sampling points to the device TGC sampling
+    points.
+
+    The interpolation operator (the interval of each device point and
+    the interpolation weights) is computed once. Changing some of the UI
+    values updates only the device points that depend on them.
+
+    Available modes:
+
+    - "linear": piecewise linear interpolation (like np.interp),
+    - "pchip": monotone piecewise cubic Hermite interpolation
+      (Fritsch-Carlson); monotone UI curves remain monotone.
+
+    The device points outside the UI sampling points range are set to the
+    first/last UI value.
+
+    :param points: UI sampling points, strictly increasing
+    :param device_points: device sampling points
+    :param values: initial values at the UI sampling points
+    :param mode: interpolation mode, "linear" or "pchip"
+    """
+    MODES = {"linear", "pchip"}
+
+    def __init__(self, points, device_points, values, mode="linear"):
+        if mode not in TgcInterpolator.MODES:
+            raise ValueError(f"Unknown TGC interpolation mode: {mode}, "
+                             f"available: {TgcInterpolator.MODES}")
+        self.points = np.asarray(points, dtype=np.float64)
+        self.device_points = np.asarray(device_points, dtype=np.float64)
+        self.mode = mode
+        n = len(self.points)
+        if n < 2:
+            raise ValueError("At least two TGC sampling points are required.")
+        # Interval [points[j], points[j+1]] of each device point.
+        x = np.clip(self.device_points, self.points[0], self.points[-1])
+        self._interval = np.clip(
+            np.searchsorted(self.points, x, side="right")-1, 0, n-2)
+        self._h = np.diff(self.points)
+        h = self._h[self._interval]
+        t = (x-self.points[self._interval])/h
+        # Device points are sorted, so the points of each interval form
+        # a contiguous range: [_starts[j], _starts[j+1]).
+        self._starts = np.searchsorted(self._interval, np.arange(n))
+        if self.mode == "linear":
+            self._weights = np.stack((1-t, t))
+        else:
+            # Cubic Hermite basis; slopes are scaled by the interval length.
+            t2, t3 = t*t, t*t*t
+            self._weights = np.stack((2*t3-3*t2+1, (t3-2*t2+t)*h,
+                                      -2*t3+3*t2, (t3-t2)*h))
+        self.values = np.zeros(n, dtype=np.float64)
+        self.slopes = np.zeros(n, dtype=np.float64)
+        self.curve = np.zeros(len(self.device_points), dtype=np.float64)
+        self.set_values(values)
+
+    def set_values(self, values):
+        """
+        Sets all UI values, returns the device curve.
+        """
+        self.values[:] = values
+        self._update_slopes(0, len(self.values))
+        self._update_curve(0, len(self.values)-1)
+        return self.curve
+
+    def update(self, values):
+        """
+        Applies only the changes of the UI values, returns the indices of
+        the changed UI points.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        changed = np.flatnonzero(values != self.values)
+        if len(changed) == 0:
+            return changed
+        self.values[changed] = values[changed]
+        lo, hi = changed[0], changed[-1]
+        if self.mode == "pchip":
+            # Slope at point k depends on the values at k-1, k, k+1.
+            self._update_slopes(lo-1, hi+2)
+            lo, hi = lo-1, hi+1
+        # Interval j depends on the points j and j+1.
+        self._update_curve(lo-1, hi+1)
+        return changed
+
+    def _update_curve(self, start, end):
+        """
+        Recomputes the device points of the intervals [start, end).
+        """
+        n_intervals = len(self.values)-1
+        start, end = max(start, 0), min(end, n_intervals)
+        if start >= end:
+            return
+        d0, d1 = self._starts[start], self._starts[end]
+        j = self._interval[d0:d1]
+        w = self._weights[:, d0:d1]
+        y0, y1 = self.values[j], self.values[j+1]
+        if self.mode == "linear":
+            self.curve[d0:d1] = w[0]*y0 + w[1]*y1
+        else:
+            m0, m1 = self.slopes[j], self.slopes[j+1]
+            self.curve[d0:d1] = w[0]*y0 + w[1]*m0 + w[2]*y1 + w[3]*m1
+
+    def _update_slopes(self, start, end):
+        """
+        Recomputes Fritsch-Carlson slopes at the points [start, end).
+        """
+        if self.mode != "pchip":
+            return
+        n = len(self.values)
+        start, end = max(start, 0), min(end, n)
+        # Secants of the intervals adjacent to the updated points.
+        lo, hi = max(start-1, 0), min(end, n-1)
+        delta = np.diff(self.values[lo:hi+1])/self._h[lo:hi]
+        for k in range(start, end):
+            if k == 0 or k == n-1:
+                # One-sided secant at the end points.
+                self.slopes[k] = delta[0] if k == 0 else delta[-1]
+                continue
+            d_left, d_right = delta[k-1-lo], delta[k-lo]
+            if d_left*d_right <= 0:
+                self.slopes[k] = 0.0
+            else:
+                h_left, h_right = self._h[k-1], self._h[k]
+                w1, w2 = 2*h_right+h_left, h_right+2*h_left
+                self.slopes[k] = (w1+w2)/(w1/d_left+w2/d_right)
@@ -0,0 +1,329 @@
+"""
+Condition-triggered capture.
+
+The trigger conditions (see gui4us.cfg.CaptureTrigger) are evaluated on a
+strided subsample of the gated part of each new frame (a view, the frame
+is not copied). When the start condition is met, the capture starts,
+optionally with the frames acquired right before the hit (pre-trigger
+history); the stop condition (if any) is evaluated during the triggered
+capture.
+
+The conditions are evaluated in the acquisition callback as long as the
+evaluation is cheap; when the average evaluation time exceeds
+max_eval_time, the subsamples are copied and evaluated on a separate
+thread, the result is applied on the next frame.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+import gui4us.cfg
+from gui4us.metrics import REGISTRY
+from gui4us.tracing import TRACER
+
+_LOGGER = logging.getLogger("gui4us.model")
+_EVAL_TIME = REGISTRY.histogram(
+    "gui4us_trigger_eval_seconds", "Trigger condition evaluation time",
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+             0.01, 0.025))
+_SKIPPED = REGISTRY.counter(
+    "gui4us_trigger_skipped_frames_total",
+    "Frames not evaluated because the previous evaluation was in progress")
+_EVAL_SPAN = TRACER.register("Trigger.evaluate")
+
+START = "start"
+STOP = "stop"
+# The number of evaluations before the evaluation mode can be changed.
+_MIN_EVALUATIONS = 10
+# Weight of the previous evaluation times in the average.
+_EVAL_TIME_SMOOTHING = 0.9
+
+
+def _get_slices(gate, stride, shape):
+    if gate is None:
+        gate = (None, )*len(shape)
+    if isinstance(stride, int):
+        stride = (stride, )*len(shape)
+    if len(gate) != len(shape) or len(stride) != len(shape):
+        raise ValueError(f"Trigger gate {gate} or stride {stride} does not "
+                         f"match the frame shape {shape}")
+    return tuple(slice(None, None, s) if g is None else slice(g[0], g[1], s)
+                 for g, s in zip(gate, stride))
+
+
+class Condition:
+    """
+    A trigger condition evaluated on the subsample of the frame.
+
+    :param cfg: condition configuration
+    :param shape: frame shape of the evaluated output
+    :param dtype: data type of the evaluated output
+    """
+
+    def __init__(self, cfg, shape, dtype):
+        self.ordinal = cfg.ordinal
+        self.slices = _get_slices(cfg.gate, cfg.stride, shape)
+        # Used to pass the subsample to the evaluation thread.
+        subsample_shape = tuple(len(range(*s.indices(n)))
+                                for s, n in zip(self.slices, shape))
+        self.buffer = np.zeros(subsample_shape, dtype=dtype)
+
+    def get_subsample(self, data):
+        return data[self.ordinal][self.slices]
+
+    def reset(self):
+        pass
+
+    def evaluate(self, subsample) -> bool:
+        raise NotImplementedError()
+
+
+class MaxAboveThreshold(Condition):
+
+    def __init__(self, cfg, shape, dtype):
+        super().__init__(cfg, shape, dtype)
+        self.threshold = cfg.threshold
+
+    def evaluate(self, subsample):
+        return np.max(subsample) > self.threshold
+
+
+class MeanChange(Condition):
+
+    def __init__(self, cfg, shape, dtype):
+        super().__init__(cfg, shape, dtype)
+        self.min_change = cfg.min_change
+        self.smoothing = cfg.smoothing
+        self.reference = None
+
+    def reset(self):
+        self.reference = None
+
+    def evaluate(self, subsample):
+        mean = float(np.mean(subsample))
+        if self.reference is None:
+            self.reference = mean
+            return False
+        is_hit = abs(mean-self.reference) > self.min_change
+        self.reference = self.smoothing*self.reference \
+            + (1-self.smoothing)*mean
+        return is_hit
+
+
+class Predicate(Condition):
+
+    def __init__(self, cfg, shape, dtype):
+        super().__init__(cfg, shape, dtype)
+        self.func = cfg.func
+
+    def evaluate(self, subsample):
+        return bool(self.func(subsample))
+
+
+_CONDITIONS = {
+    gui4us.cfg.MaxAboveThreshold: MaxAboveThreshold,
+    gui4us.cfg.MeanChange: MeanChange,
+    gui4us.cfg.Predicate: Predicate,
+}
+
+
+def create_condition(cfg, shapes, dtypes) -> Condition:
+    cls = _CONDITIONS.get(type(cfg), None)
+    if cls is None:
+        raise ValueError(f"Unsupported trigger condition: {type(cfg)}")
+    return cls(cfg, shapes[cfg.ordinal], dtypes[cfg.ordinal])
+
+
+class Trigger:
+    """
+    Decides when to start and stop the capture, based on the new frames.
+
+    All the methods except arm, disarm, get_stats and close should be called
+    by the acquisition thread.
+
+    :param cfg: trigger configuration
+    :param shapes: frame shape of each output
+    :param dtypes: data type of each output
+    """
+
+    def __init__(self, cfg: gui4us.cfg.CaptureTrigger, shapes, dtypes):
+        self.cfg = cfg
+        self.conditions = {START: create_condition(cfg.start, shapes, dtypes)}
+        if cfg.stop is not None:
+            self.conditions[STOP] = create_condition(cfg.stop, shapes, dtypes)
+        self.is_armed = False
+        self.is_async = False
+        self.eval_time = 0.0
+        self.n_evaluated = 0
+        self.n_hits = {START: 0, STOP: 0}
+        self.n_skipped = 0
+        self._is_reset_pending = False
+        # True while the capture started by this trigger is in progress.
+        self._is_triggered = False
+        # Pre-trigger history ring.
+        self.n_history = cfg.n_pre_trigger
+        self.history = [np.zeros((self.n_history, *shape), dtype=dtype)
+                        for shape, dtype in zip(shapes, dtypes)]
+        self._history_counter = 0
+        # Evaluation thread state.
+        self._condition = threading.Condition()
+        self._pending = None
+        self._result = None
+        self._is_closed = False
+        self._thread = None
+
+    def arm(self):
+        self.is_armed = True
+        self._is_reset_pending = True
+
+    def disarm(self):
+        self.is_armed = False
+
+    def get_stats(self):
+        return {
+            "is_armed": self.is_armed,
+            "is_async": self.is_async,
+            "n_evaluated": self.n_evaluated,
+            "n_start_hits": self.n_hits[START],
+            "n_stop_hits": self.n_hits[STOP],
+            "n_skipped": self.n_skipped,
+            "eval_time": self.eval_time
+        }
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def process(self, data, is_capturing):
+        """
+        Evaluates the trigger conditions on the new frame.
+
+        :param data: the new frame, a list of arrays, one for each output
+        :param is_capturing: whether the capture is in progress
+        :return: START, STOP or None (no action)
+        """
+        if self._is_reset_pending:
+            self._is_reset_pending = False
+            self._reset()
+        if is_capturing:
+            if not self._is_triggered or STOP not in self.conditions:
+                return None
+            kind = STOP
+        else:
+            if self._is_triggered:
+                # The triggered capture has ended.
+                self._is_triggered = False
+                if self.cfg.rearm:
+                    self.is_armed = True
+                    self._reset()
+            if not self.is_armed:
+                return None
+            kind = START
+        is_hit = self._evaluate(kind, data)
+        if is_hit:
+            self.n_hits[kind] += 1
+            _LOGGER.info("Capture trigger: %s condition met", kind)
+        if kind == START:
+            if is_hit:
+                self.is_armed = False
+                self._is_triggered = True
+                return START
+            self._push_history(data)
+            return None
+        return STOP if is_hit else None
+
+    def get_history(self):
+        """
+        Returns the pre-trigger frames, the oldest first; each frame is a
+        list of arrays, one for each output.
+        """
+        n = min(self._history_counter, self.n_history)
+        first = self._history_counter-n
+        return [[output[k % self.n_history] for output in self.history]
+                for k in range(first, self._history_counter)]
+
+    def _reset(self):
+        self._history_counter = 0
+        for condition in self.conditions.values():
+            condition.reset()
+        with self._condition:
+            self._result = None
+
+    def _push_history(self, data):
+        if self.n_history == 0:
+            return
+        k = self._history_counter % self.n_history
+        for output, frame in zip(self.history, data):
+            np.copyto(output[k], frame)
+        self._history_counter += 1
+
+    def _evaluate(self, kind, data):
+        condition = self.conditions[kind]
+        subsample = condition.get_subsample(data)
+        if self.is_async:
+            return self._evaluate_async(kind, condition, subsample)
+        is_hit = self._evaluate_condition(condition, subsample)
+        if self.n_evaluated >= _MIN_EVALUATIONS \
+                and self.eval_time > self.cfg.max_eval_time:
+            _LOGGER.info("Trigger evaluation takes %.3f ms on average, "
+                         "moving it to a separate thread.",
+                         self.eval_time*1e3)
+            self._start_thread()
+        return is_hit
+
+    def _evaluate_condition(self, condition, subsample):
+        start = time.perf_counter()
+        span_start = TRACER.begin()
+        try:
+            return condition.evaluate(subsample)
+        finally:
+            eval_time = time.perf_counter()-start
+            TRACER.end(_EVAL_SPAN, span_start)
+            _EVAL_TIME.observe(eval_time)
+            self.eval_time = _EVAL_TIME_SMOOTHING*self.eval_time \
+                + (1-_EVAL_TIME_SMOOTHING)*eval_time
+            self.n_evaluated += 1
+
+    def _evaluate_async(self, kind, condition, subsample):
+        with self._condition:
+            result, self._result = self._result, None
+            if self._pending is None:
+                np.copyto(condition.buffer, subsample)
+                self._pending = (kind, condition)
+                self._condition.notify_all()
+            else:
+                self.n_skipped += 1
+                _SKIPPED.inc()
+        # The result of the previous frame, applied only when the state
+        # has not changed in the meantime.
+        return result is not None and result[0] == kind and result[1]
+
+    def _start_thread(self):
+        self.is_async = True
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="gui4us-trigger")
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending is not None or self._is_closed)
+                if self._is_closed:
+                    return
+                kind, condition = self._pending
+            # The buffer is not modified until the pending evaluation is
+            # done.
+            is_hit = False
+            try:
+                is_hit = self._evaluate_condition(condition, condition.buffer)
+            except Exception:
+                _LOGGER.exception("Cannot evaluate the trigger condition")
+            with self._condition:
+                self._result = (kind, is_hit)
+                self._pending = None
@@ -1,32 +1,104 @@
+import concurrent.futures
+import logging
 import queue
+import threading
+import time
 import gui4us.cfg
 import numpy as np
 import datetime
 import pickle
-import traceback
 from collections.abc import Iterable
 import arrus.logging
 import arrus.utils.imaging
-from gui4us.settings import *
-from gui4us.common import *
-from arrus.ops.us4r import *
+from gui4us.settings import ContinuousRange, Setting
+from gui4us.common import ImageMetadata
+from arrus.ops.us4r import DataBufferSpec, Scheme
 from arrus.utils.imaging import (
     Processing,
     Pipeline
 )
 import gui4us.model.env
+from gui4us.model.capture import (
+    CaptureWriter, FrameReducer, decode_frame, REDUCTION_ATTR
+)
+from gui4us.model.tgc import TgcInterpolator
+from gui4us.model.compression import (
+    CODECS, CompressedFrame, compress, decompress
+)
+from gui4us.model.load import LoadMonitor, DROP_DISPLAY, PAUSE_CAPTURE
+from gui4us.model.preview import PreviewGenerator, get_preview_path
+from gui4us.model.sweep import SweepRunner
+from gui4us.model.trigger import Trigger, START, STOP
+from gui4us.profiling import NULL_PROFILER
+from gui4us.metrics import REGISTRY
+from gui4us.tracing import TRACER
+
+_LOGGER = logging.getLogger("gui4us.model")
+_FRAMES = REGISTRY.counter(
+    "gui4us_frames_total", "Frames received from the processing pipeline")
+_FRAME_ERRORS = REGISTRY.counter(
+    "gui4us_frame_errors_total", "Frames whose callback raised an error")
+_FRAME_CALLBACK_TIME = REGISTRY.histogram(
+    "gui4us_frame_callback_seconds", "New frame callback processing time")
+_CAPTURED_FRAMES = REGISTRY.counter(
+    "gui4us_captured_frames_total", "Frames appended to the capture buffer")
+_CAPTURE_SAVE_TIME = REGISTRY.histogram(
+    "gui4us_capture_save_seconds", "Capture save time",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+_RELEASE_ERRORS = REGISTRY.counter(
+    "gui4us_release_errors_total", "Buffer elements that failed to release")
+_LOAD = REGISTRY.gauge(
+    "gui4us_callback_load",
+    "New frame callback processing time / frame interval")
+_OVERLOADS = REGISTRY.counter(
+    "gui4us_overloads_total", "Detected acquisition callback overloads")
+_DROPPED_DISPLAY_FRAMES = REGISTRY.counter(
+    "gui4us_dropped_display_frames_total",
+    "Frames not passed to the outputs because of the overload")
+_COMPRESSION_TIME = REGISTRY.histogram(
+    "gui4us_capture_compression_seconds", "Captured frame compression time")
+_TGC_WRITE_TIME = REGISTRY.histogram(
+    "gui4us_tgc_write_seconds", "Device TGC curve write time")
+_NEW_DATA_SPAN = TRACER.register("Env._on_new_data")
+# The number of frames written at once when saving the capture buffer.
+_SAVE_CHUNK_SIZE = 64
 
 
 class CaptureBuffer:
-    def __init__(self, capacity):
+    """
+    Preallocated buffer of the captured frames.
+
+    The frames of each output are reduced according to the output capture
+    policy (see gui4us.cfg.CapturePolicy) and written directly to the
+    buffer, without any intermediate copies.
+
+    :param capacity: the number of acquired frames to capture
+    :param shapes: frame shape of each output
+    :param dtypes: data type of each output
+    :param policies: output ordinal -> capture policy
+    """
+    def __init__(self, capacity, shapes, dtypes, policies=None):
         self.capacity = capacity
+        policies = policies if policies is not None else {}
         self._counter = 0
-        self._data = [None]*self.capacity
+        self.reducers = [
+            FrameReducer(policies.get(i, gui4us.cfg.CapturePolicy()),
+                         shape, dtype)
+            for i, (shape, dtype) in enumerate(zip(shapes, dtypes))]
+        self.outputs = self._allocate_outputs()
+        self._n_frames = [0]*len(self.reducers)
 
     def append(self, data):
+        """
+        Appends a single acquired frame: a list of arrays, one for each
+        output.
+        """
         if self.is_ready():
             raise queue.Full()
-        self._data[self._counter] = data
+        for i, (reducer, frame) in enumerate(zip(self.reducers, data)):
+            if self._counter % reducer.decimation == 0:
+                self._store(i, self._n_frames[i], reducer, frame)
+                self._n_frames[i] += 1
         self._counter += 1
 
     def is_ready(self):
@@ -35,23 +107,233 @@ class CaptureBuffer:
     def get_current_size(self):
         return self._counter
 
+    def get_n_frames(self, ordinal=0):
+        return self._n_frames[ordinal]
+
+    def get_frame(self, i, ordinal=0):
+        return decode_frame(self.get_stored_frames(ordinal, i, i+1)[0],
+                            self.get_reduction(ordinal))
+
+    def get_stored_frames(self, ordinal, start, end):
+        """
+        Returns the frames as stored in the buffer (i.e. reduced, but not
+        decoded), an array with shape (end-start, *frame_shape).
+        """
+        return self.outputs[ordinal][start:end]
+
+    def get_stats(self):
+        """
+        Returns the buffer statistics (displayed in the buffer panel),
+        None if not available.
+        """
+        return None
+
+    def close(self):
+        pass
+
+    def get_reduction(self, ordinal=0):
+        reducer = self.reducers[ordinal]
+        if reducer.is_identity:
+            return None
+        return reducer.get_attrs()
+
+    def get_attrs(self):
+        """
+        Returns the capture attributes describing the reduced outputs.
+        """
+        reductions = [self.get_reduction(i)
+                      for i in range(len(self.reducers))]
+        if all(r is None for r in reductions):
+            return {}
+        return {REDUCTION_ATTR: reductions}
+
     @property
     def data(self):
-        return self._data
+        """
+        Captured frames: a list of frames, each a list of (decoded) arrays,
+        one for each output.
+        """
+        n_frames = min(self._n_frames)
+        return [[self.get_frame(i, ordinal)
+                 for ordinal in range(len(self.outputs))]
+                for i in range(n_frames)]
+
+    def get_output_capacity(self, ordinal=0):
+        """
+        Returns the maximum number of frames of the given output.
+        """
+        return -(-self.capacity // self.reducers[ordinal].decimation)
+
+    def _allocate_outputs(self):
+        return [np.zeros((self.get_output_capacity(i), *r.shape),
+                         dtype=r.dtype)
+                for i, r in enumerate(self.reducers)]
+
+    def _store(self, ordinal, k, reducer, frame):
+        reducer.reduce(frame, self.outputs[ordinal][k])
+
+
+class CompressedCaptureBuffer(CaptureBuffer):
+    """
+    Capture buffer that keeps the frames losslessly compressed (see
+    gui4us.model.compression).
+
+    The reduced frames are written to the staging ring, and compressed by
+    the background threads, so the acquisition callback never waits for
+    the compression. When the staging ring of the output is full, the
+    frame is stored uncompressed.
+
+    :param compression: compression configuration
+    """
+    def __init__(self, capacity, shapes, dtypes, policies=None,
+                 compression=gui4us.cfg.CaptureCompression()):
+        if compression.codec not in CODECS:
+            raise ValueError(f"Unknown codec: {compression.codec}, "
+                             f"available: {CODECS}")
+        self.compression = compression
+        super().__init__(capacity, shapes, dtypes, policies)
+        self.staging = [np.zeros((compression.staging_size, *r.shape),
+                                 dtype=r.dtype)
+                        for r in self.reducers]
+        self._free_slots = []
+        for _ in self.reducers:
+            slots = queue.SimpleQueue()
+            for slot in range(compression.staging_size):
+                slots.put(slot)
+            self._free_slots.append(slots)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=compression.n_workers,
+            thread_name_prefix="gui4us-compression")
+        self._condition = threading.Condition()
+        self._n_pending = 0
+        self.raw_size = 0
+        self.compressed_size = 0
+        self.n_uncompressed = 0
+        # Per output: the number of stored (compressed or not) frames and
+        # their size.
+        self._n_stored = [0]*len(self.reducers)
+        self._stored_sizes = [0]*len(self.reducers)
+
+    def is_ready(self):
+        memory_limit = self.compression.memory_limit
+        return super().is_ready() or (memory_limit is not None
+                                      and self.compressed_size >= memory_limit)
+
+    def get_stored_frames(self, ordinal, start, end):
+        frames = self.outputs[ordinal]
+        with self._condition:
+            self._condition.wait_for(
+                lambda: all(frames[k] is not None for k in range(start, end)))
+        frames = frames[start:end]
+        return np.stack([decompress(f) if isinstance(f, CompressedFrame)
+                         else f for f in frames])
+
+    def wait(self):
+        """
+        Waits until all the frames are compressed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._n_pending == 0)
+
+    def get_stats(self):
+        with self._condition:
+            raw_size, compressed_size = self.raw_size, self.compressed_size
+            # The average size of the stored frames per acquired frame;
+            # each output stores only every decimation-th frame.
+            frame_size = sum(
+                size/n/reducer.decimation for size, n, reducer
+                in zip(self._stored_sizes, self._n_stored, self.reducers)
+                if n > 0)
+        ratio = raw_size/compressed_size if compressed_size > 0 else 1.0
+        effective_capacity = self.capacity
+        memory_limit = self.compression.memory_limit
+        if memory_limit is not None and frame_size > 0:
+            effective_capacity = min(self.capacity,
+                                     int(memory_limit/frame_size))
+        return {
+            "ratio": ratio,
+            "memory": compressed_size,
+            "effective_capacity": effective_capacity,
+            "n_uncompressed": self.n_uncompressed
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _allocate_outputs(self):
+        return [[None]*self.get_output_capacity(i)
+                for i in range(len(self.reducers))]
+
+    def _store(self, ordinal, k, reducer, frame):
+        try:
+            slot = self._free_slots[ordinal].get_nowait()
+        except queue.Empty:
+            frame_copy = np.zeros(reducer.shape, dtype=reducer.dtype)
+            reducer.reduce(frame, frame_copy)
+            self._set_frame(ordinal, k, frame_copy, frame_copy.nbytes)
+            self.n_uncompressed += 1
+            return
+        reducer.reduce(frame, self.staging[ordinal][slot])
+        with self._condition:
+            self._n_pending += 1
+        self.executor.submit(self._compress, ordinal, k, slot)
+
+    def _compress(self, ordinal, k, slot):
+        staged = self.staging[ordinal][slot]
+        try:
+            with _COMPRESSION_TIME.time():
+                frame = compress(staged, codec=self.compression.codec,
+                                 level=self.compression.level,
+                                 delta=self.compression.delta)
+        except Exception:
+            _LOGGER.exception("Cannot compress frame %d of output %d",
+                              k, ordinal)
+            frame = staged.copy()
+        self._set_frame(ordinal, k, frame, staged.nbytes)
+        self._free_slots[ordinal].put(slot)
+        with self._condition:
+            self._n_pending -= 1
+            self._condition.notify_all()
+
+    def _set_frame(self, ordinal, k, frame, raw_size):
+        self.outputs[ordinal][k] = frame
+        with self._condition:
+            self.raw_size += raw_size
+            self.compressed_size += frame.nbytes
+            self._n_stored[ordinal] += 1
+            self._stored_sizes[ordinal] += frame.nbytes
 
 
 class Output:
 
-    def __init__(self):
+    def __init__(self, name=None):
+        self.name = name
         self.callbacks = []
+        self.errors_counter = REGISTRY.counter(
+            "gui4us_output_callback_errors_total",
+            "Output callbacks that raised an error", labels={"output": name})
 
     def add_callback(self, func):
         self.callbacks.append(func)
 
+    def emit(self, data):
+        """
+        Calls all the callbacks with the given data. An error of one
+        callback does not prevent calling the others.
+        """
+        for callback in self.callbacks:
+            try:
+                callback(data)
+            except Exception:
+                self.errors_counter.inc()
+                _LOGGER.exception("Error in the callback of output %s",
+                                  self.name)
+
 
 class Env(gui4us.model.env.Env):
 
-    def __init__(self, cfg: gui4us.cfg.UltrasoundEnvironment):
+    def __init__(self, cfg: gui4us.cfg.UltrasoundEnvironment,
+                 profiler=NULL_PROFILER):
         self.cfg = cfg
         # LOGGING.
         self.log_file = self.cfg.log_file
@@ -66,8 +348,16 @@ class Env(gui4us.model.env.Env):
 
         # TODO The below should be performed in the start method.
         # START AND CONFIGURE NEW SESSION.
-        self.session = arrus.Session(self.cfg.session_cfg)
+        with profiler.phase("arrus.Session"):
+            self.session = arrus.Session(self.cfg.session_cfg)
         self.us4r = self.session.get_device("/Us4R:0")
+        # Serializes the device access of the controller thread and the
+        # trigger scheduler (MANUAL work mode).
+        self.device_lock = threading.Lock()
+        # The number of issued runs and processed frames (MANUAL work mode).
+        self.run_condition = threading.Condition()
+        self.n_runs = 0
+        self.n_processed_runs = 0
         self.probe_model = self.us4r.get_probe_model()
         scheme = Scheme(
             tx_rx_sequence=self.cfg.tx_rx_sequence,
@@ -77,7 +367,8 @@ class Env(gui4us.model.env.Env):
             work_mode=self.cfg.work_mode,
             processing=Processing(self.cfg.pipeline, callback=self._on_new_data)
         )
-        self.metadata = self.session.upload(scheme)
+        with profiler.phase("session.upload"):
+            self.metadata = self.session.upload(scheme)
         if not isinstance(self.metadata, Iterable):
             self.metadata = (self.metadata, )
         # TODO prepare List of action defs (/Ops?)
@@ -93,20 +384,59 @@ class Env(gui4us.model.env.Env):
         self.tgc_sampling = self._get_tgc_sampling_points(self.cfg)
         self.device_tgc_sampling_points = self._get_device_tgc_sampling_points(
             metadata=self.metadata[0])
+        # UI TGC sampling points -> device TGC sampling points.
+        self.tgc_interpolator = TgcInterpolator(
+            points=self.tgc_sampling,
+            device_points=self.device_tgc_sampling_points,
+            values=self._convert_tgc_to_ndarray(self.cfg.tgc_curve),
+            mode=self.cfg.tgc_interpolation)
+        self.is_tgc_pending = True
+        self.tgc_write_time = None
+        # Mirror of the values applied to the device: setting id -> value.
+        self.applied_values = {}
+        self.presets = {}
         # Prepare initial configuration.
         self.settings = self.create_settings()
         for setting in self.settings:
             self.set(setting.id, setting.init_value)
+        self.flush()
         # OUTPUTS
         # Set environment observation outputs.
         self.outputs = {
-            "main_events": Output(),
-            "capture_buffer_events": Output()
+            "main_events": Output("main_events"),
+            "capture_buffer_events": Output("capture_buffer_events"),
+            # (is overloaded, load), emitted when the overload state changes.
+            "overload_events": Output("overload_events")
         }
         for i in range(len(self.metadata)):
-            self.outputs[f"out_{i}"] = Output()
+            self.outputs[f"out_{i}"] = Output(f"out_{i}")
+        self.load_monitor = LoadMonitor(self.cfg.overload_policy)
+        _LOAD.set_function(lambda: self.load_monitor.load)
         self.is_capturing = False
-        self.capture_buffer = CaptureBuffer(self.cfg.capture_buffer_capacity)
+        self.capture_buffer = self._create_capture_buffer()
+        self.preview = None
+        self.trigger = None
+        if self.cfg.capture_trigger is not None:
+            if self.cfg.capture_trigger.n_pre_trigger \
+                    >= self.cfg.capture_buffer_capacity:
+                raise ValueError("The number of pre-trigger frames should be "
+                                 "less than the capture buffer capacity.")
+            self.trigger = Trigger(
+                self.cfg.capture_trigger,
+                shapes=[m.input_shape for m in self.metadata],
+                dtypes=[m.dtype for m in self.metadata])
+        # The triggered capture starts on the acquisition callback thread:
+        # it only switches to the preallocated spare buffer. Closing the
+        # previous buffer, restarting the preview and allocating the next
+        # spare buffer is done on the capture thread.
+        self.spare_capture_buffer = None
+        self.capture_executor = None
+        if self.trigger is not None:
+            self.spare_capture_buffer = self._create_capture_buffer()
+            self.capture_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="gui4us-capture")
+        # Functions called with the data of all outputs of each new frame.
+        self.frame_listeners = []
 
     def get_image_metadata(self, ordinal):
         image_metadata = self._determine_image_metadata(ordinal)
@@ -123,23 +453,82 @@ class Env(gui4us.model.env.Env):
         return self.id
 
     def start(self):
+        if self.trigger is not None:
+            self.trigger.arm()
         self.session.start_scheme()
 
+    def is_overloaded(self):
+        return self.load_monitor.is_overloaded
+
+    def get_work_mode(self):
+        return self.cfg.work_mode
+
+    def run(self):
+        """
+        Executes the TX/RX sequence once (MANUAL work mode), see
+        gui4us.controller.scheduler.
+        """
+        with self.run_condition:
+            self.n_runs += 1
+        with self.device_lock:
+            self.session.run()
+
+    def wait_until_ready(self, max_pending=1, timeout=1.0):
+        """
+        Waits until the data of all but max_pending-1 issued runs are
+        processed. Returns False if the consumers are overloaded or the
+        data did not arrive within the timeout (the runs are then
+        considered lost).
+        """
+        with self.run_condition:
+            is_ready = self.run_condition.wait_for(
+                lambda: self.n_runs-self.n_processed_runs < max_pending,
+                timeout=timeout)
+            if not is_ready:
+                _LOGGER.warning("No data of %d acquisition run(s) within "
+                                "%.1f s.", self.n_runs-self.n_processed_runs,
+                                timeout)
+                self.n_processed_runs = self.n_runs
+                return False
+        return not self.load_monitor.is_overloaded
+
     def stop(self):
         self.session.stop_scheme()
 
     def close(self):
         self.session.stop_scheme()
         self.session.close()
+        if self.trigger is not None:
+            self.trigger.close()
+        if self.capture_executor is not None:
+            self.capture_executor.shutdown(wait=True)
+        if self.preview is not None:
+            self.preview.close()
 
     def set(self, key: str, value: object):
         method = getattr(self, f"set_{key}")
         method(value)
 
     def start_capture(self):
-        self.capture_buffer = CaptureBuffer(self.cfg.capture_buffer_capacity)
+        self.capture_buffer.close()
+        self.capture_buffer = self._create_capture_buffer()
+        self._start_preview()
         self.is_capturing = True
 
+    def _start_preview(self):
+        preview_cfg = self.cfg.capture_preview
+        if preview_cfg is None:
+            return
+        if self.preview is not None:
+            self.preview.close()
+        self.preview = PreviewGenerator(
+            self.capture_buffer, ordinal=preview_cfg.ordinal,
+            capacity=self.capture_buffer.get_output_capacity(
+                preview_cfg.ordinal),
+            max_size=preview_cfg.max_size,
+            min_size=preview_cfg.min_size)
+        self.preview.start(interval=preview_cfg.interval)
+
     def clear_capture(self):
         self.is_capturing = False
 
@@ -148,16 +537,137 @@ class Env(gui4us.model.env.Env):
         Stop manually capturing data.
         """
         self.is_capturing = False
-        print("Stopping capture")
-        for callback in self.outputs["capture_buffer_events"].callbacks:
-            callback((self.capture_buffer.get_current_size(), True))
+        _LOGGER.info("Stopping capture")
+        self.outputs["capture_buffer_events"].emit(
+            (self.capture_buffer.get_current_size(), True,
+             self.capture_buffer.get_stats()))
 
     def save_capture(self, filepath):
+        """
+        Saves the captured frames. Files with the .pkl extension are saved
+        in the python pickle format, otherwise a capture directory is
+        created (see gui4us.model.capture). The capture preview (if
+        enabled) is saved as the capture sidecar (see
+        gui4us.model.preview).
+        """
         if self.capture_buffer.get_current_size() == 0:
             raise ValueError("Cannot save empty buffer")
-        pickle.dump({"metadata": self.metadata,
-                     "data": self.capture_buffer.data},
-                    open(filepath, "wb"))
+        with _CAPTURE_SAVE_TIME.time():
+            if filepath.endswith(".pkl"):
+                pickle.dump({"metadata": self.metadata,
+                             "data": self.capture_buffer.data},
+                            open(filepath, "wb"))
+            else:
+                self._write_capture_buffer(filepath)
+            if self.preview is not None:
+                # Processes the remaining frames.
+                self.preview.stop()
+                self.preview.save(get_preview_path(filepath))
+
+    def get_capture_buffer(self):
+        return self.capture_buffer
+
+    def arm_trigger(self):
+        """
+        Arms the capture trigger: the capture starts when the trigger
+        start condition is met.
+        """
+        self._get_trigger().arm()
+
+    def disarm_trigger(self):
+        self._get_trigger().disarm()
+
+    def get_trigger_stats(self):
+        """
+        Returns the capture trigger statistics, e.g. the average condition
+        evaluation time [s] (eval_time).
+        """
+        return self._get_trigger().get_stats()
+
+    def _get_trigger(self):
+        if self.trigger is None:
+            raise ValueError("Capture trigger is not configured.")
+        return self.trigger
+
+    def _start_triggered_capture(self):
+        # Called on the acquisition callback thread.
+        buffer = self.spare_capture_buffer
+        if buffer is None:
+            _LOGGER.warning("The spare capture buffer is not ready yet, "
+                            "allocating it on the acquisition thread.")
+            buffer = self._create_capture_buffer()
+        self.spare_capture_buffer = None
+        previous, self.capture_buffer = self.capture_buffer, buffer
+        for frame in self.trigger.get_history():
+            buffer.append(frame)
+        self.is_capturing = True
+        self.capture_executor.submit(self._replace_capture_buffer, previous)
+
+    def _replace_capture_buffer(self, previous):
+        # Called on the capture thread.
+        try:
+            previous.close()
+            self._start_preview()
+            self.spare_capture_buffer = self._create_capture_buffer()
+        except Exception:
+            _LOGGER.exception("Cannot prepare the next capture buffer")
+
+    def _create_capture_buffer(self):
+        kwargs = dict(shapes=[m.input_shape for m in self.metadata],
+                      dtypes=[m.dtype for m in self.metadata],
+                      policies=self.cfg.capture_policies)
+        if self.cfg.capture_compression is not None:
+            return CompressedCaptureBuffer(
+                self.cfg.capture_buffer_capacity,
+                compression=self.cfg.capture_compression, **kwargs)
+        return CaptureBuffer(self.cfg.capture_buffer_capacity, **kwargs)
+
+    def _write_capture_buffer(self, path):
+        # The frames are written as stored in the buffer (i.e. reduced),
+        # load_capture decodes them.
+        buffer = self.capture_buffer
+        n_frames = [buffer.get_n_frames(i)
+                    for i in range(len(buffer.outputs))]
+        writer = CaptureWriter(
+            path, self.metadata,
+            shapes=[reducer.shape for reducer in buffer.reducers],
+            dtypes=[reducer.dtype for reducer in buffer.reducers],
+            capacity=max(n_frames), attrs=buffer.get_attrs())
+        for i, n in enumerate(n_frames):
+            for start in range(0, n, _SAVE_CHUNK_SIZE):
+                end = min(start+_SAVE_CHUNK_SIZE, n)
+                writer.write(i, start, buffer.get_stored_frames(i, start, end))
+        writer.close()
+
+    def run_sweep(self, path, grid, n_frames, n_settle=0, timeout=10.0):
+        """
+        Captures n_frames frames for each combination of the given setting
+        values, see gui4us.model.sweep.SweepRunner.
+
+        Returns a generator of the sweep steps: the controller runs it as
+        a job, one step at a time between the other tasks, the sweep can
+        be cancelled with the returned promise (see
+        gui4us.controller.Promise.cancel).
+
+        :param path: path to the output capture directory
+        :param grid: setting id -> a sequence of values
+        :param n_frames: the number of captured frames per step
+        :param n_settle: the number of skipped frames after each change of
+          settings
+        """
+        def on_step(k, n_steps, settings):
+            _LOGGER.info("Sweep step %d/%d: %s", k+1, n_steps, settings)
+
+        runner = SweepRunner(self, path, grid, n_frames=n_frames,
+                             n_settle=n_settle, timeout=timeout,
+                             on_step=on_step)
+        return runner.iter_steps()
+
+    def add_frame_listener(self, func):
+        self.frame_listeners.append(func)
+
+    def remove_frame_listener(self, func):
+        self.frame_listeners.remove(func)
 
     def set_output_callback(self, output_key, func):
         self.outputs[output_key].add_callback(func)
@@ -191,19 +701,135 @@ class Env(gui4us.model.env.Env):
     def get_settings(self):
         return self.settings
 
+    def apply_settings(self, values: dict):
+        """
+        Applies the given settings as a single transaction.
+
+        Only the values that differ from the currently applied ones are
+        written. The TX voltage is decreased before and increased after
+        the other changes. If any of the writes fails, the already applied
+        changes are rolled back and the error is raised.
+
+        :param values: setting id -> new value
+        :return: ids of the settings that were actually changed
+        """
+        settings = {setting.id: setting for setting in self.settings}
+        for key, value in values.items():
+            if key not in settings:
+                raise ValueError(f"Unknown setting: {key}")
+            self._validate_setting_value(settings[key], value)
+        changes = {key: value for key, value in values.items()
+                   if not self._is_applied(key, value)}
+        order = sorted(changes.keys(),
+                       key=lambda key: self._get_apply_priority(key, changes))
+        previous_values = []
+        try:
+            for key in order:
+                previous_values.append((key, self.applied_values[key]))
+                self.set(key, changes[key])
+            self.flush()
+        except Exception:
+            for key, value in reversed(previous_values):
+                try:
+                    self.set(key, value)
+                except Exception as e:
+                    _LOGGER.error("Rollback of %s failed: %s", key, e)
+            self.flush()
+            raise
+        return order
+
+    def get_setting_values(self) -> dict:
+        """
+        Returns the currently applied settings: setting id -> value.
+        """
+        return {key: np.copy(value).tolist()
+                for key, value in self.applied_values.items()}
+
+    def save_preset(self, name):
+        """
+        Saves the current settings as a named preset.
+        """
+        self.presets[name] = self.get_setting_values()
+
+    def load_preset(self, name):
+        """
+        Restores the settings of the given preset; only the settings that
+        differ from the current ones are written to the device.
+
+        :return: ids of the settings that were actually changed
+        """
+        if name not in self.presets:
+            raise ValueError(f"Unknown preset: {name}")
+        return self.apply_settings(self.presets[name])
+
+    def get_presets(self):
+        return list(self.presets.keys())
+
     def set_tx_voltage(self, value):
-        self.us4r.set_hv_voltage(value)
+        if self._is_applied("tx_voltage", value):
+            return
+        with self.device_lock:
+            self.us4r.set_hv_voltage(value)
+        self.applied_values["tx_voltage"] = value
 
     def set_tgc(self, value):
         """
+        Updates TGC curve. Only the changed sampling points are
+        re-interpolated; the curve is written to the device on flush.
+
         :param value: a list of values
         """
-        # y (values)
         # TODO the below conversion and parameters should be done in arrus
         value = self._convert_tgc_to_ndarray(value)
-        tgc_curve = np.interp(self.device_tgc_sampling_points,
-                              self.tgc_sampling, value)
-        self.us4r.set_tgc(tgc_curve)
+        changed = self.tgc_interpolator.update(value)
+        if len(changed) > 0:
+            self.is_tgc_pending = True
+        self.applied_values["tgc"] = self.tgc_interpolator.values.copy()
+
+    def flush(self):
+        """
+        Writes the pending TGC curve changes to the device.
+        """
+        if not self.is_tgc_pending:
+            return
+        start = time.perf_counter()
+        with self.device_lock:
+            self.us4r.set_tgc(self.tgc_interpolator.curve)
+        self.tgc_write_time = time.perf_counter()-start
+        _TGC_WRITE_TIME.observe(self.tgc_write_time)
+        self.is_tgc_pending = False
+
+    def _is_applied(self, key, value):
+        if key not in self.applied_values:
+            return False
+        applied = self.applied_values[key]
+        if key == "tgc":
+            value = self._convert_tgc_to_ndarray(value)
+        return np.array_equal(np.asarray(applied), np.asarray(value))
+
+    def _get_apply_priority(self, key, changes):
+        if key != "tx_voltage":
+            return 1
+        # Lower the voltage first, raise it last.
+        current = self.applied_values.get(key)
+        if current is not None and changes[key] < current:
+            return 0
+        return 2
+
+    def _validate_setting_value(self, setting, value):
+        domain = setting.domain
+        if not isinstance(domain, ContinuousRange):
+            return
+        if setting.id == "tgc":
+            value = self._convert_tgc_to_ndarray(value)
+        value = np.asarray(value)
+        if value.size != np.prod(setting.shape):
+            raise ValueError(f"Invalid number of values for {setting.id}: "
+                             f"{value.size}, expected: "
+                             f"{np.prod(setting.shape)}")
+        if np.any(value < domain.start) or np.any(value > domain.end):
+            raise ValueError(f"Value of {setting.id} out of range "
+                             f"[{domain.start}, {domain.end}]")
 
     def _convert_tgc_to_ndarray(self, value):
         if isinstance(value, gui4us.cfg.LinearFunction):
@@ -220,6 +846,8 @@ class Env(gui4us.model.env.Env):
                              f"{type(value)}")
 
     def _get_tgc_sampling_points(self, cfg):
+        if cfg.tgc_sampling_points is not None:
+            return np.asarray(cfg.tgc_sampling_points)
         oz_min, oz_max = np.min(self.img0_oz_grid), np.max(self.img0_oz_grid)
         return np.arange(oz_min, oz_max, step=cfg.tgc_sampling)
 
@@ -267,29 +895,95 @@ class Env(gui4us.model.env.Env):
                 (np.min(oz_grid), np.max(oz_grid)))
 
     def _on_new_data(self, elements):
+        start = self.load_monitor.begin()
+        span_start = TRACER.begin()
+        _FRAMES.inc()
         try:
-            is_capturing = self.is_capturing
-            if is_capturing:
-                out_data = []
-            for i, element in enumerate(elements):
-                output = self.outputs[f"out_{i}"]
-                for callback in output.callbacks:
-                    callback(element.data)
-                    if is_capturing:
-                        out_data.append(element.data.copy())
-                    element.release()
-            if is_capturing:
-                self.capture_buffer.append(out_data)
-                capture_buffer_output = self.outputs["capture_buffer_events"]
-                if self.capture_buffer.is_ready():
-                    self.stop_capture()
-                else:
-                    for callback in capture_buffer_output.callbacks:
-                        callback((self.capture_buffer.get_current_size(), False))
-        except Exception as e:
-            print(e)
-            print(traceback.format_exc())
+            self._process_new_data([element.data for element in elements])
+        except Exception:
+            _FRAME_ERRORS.inc()
+            _LOGGER.exception("Error while processing new data")
         except:
-            print("Unknown exception")
-
-
+            _FRAME_ERRORS.inc()
+            _LOGGER.error("Unknown exception while processing new data")
+        finally:
+            # Each element is released, regardless of the consumer errors,
+            # otherwise the host buffer would stall the acquisition.
+            for element in elements:
+                try:
+                    element.release()
+                except Exception:
+                    _RELEASE_ERRORS.inc()
+                    _LOGGER.exception("Cannot release the buffer element")
+            with self.run_condition:
+                self.n_processed_runs += 1
+                self.run_condition.notify_all()
+            _FRAME_CALLBACK_TIME.observe(time.perf_counter()-start)
+            TRACER.end(_NEW_DATA_SPAN, span_start)
+            if self.load_monitor.end(start):
+                self._on_overload_changed()
+
+    def _process_new_data(self, data):
+        # The consumers are isolated: an error of one of them does not
+        # prevent passing the frame to the others.
+        for listener in tuple(self.frame_listeners):
+            try:
+                listener(data)
+            except Exception:
+                _FRAME_ERRORS.inc()
+                _LOGGER.exception("Error in the frame listener")
+        try:
+            self._capture(data)
+        except Exception:
+            _FRAME_ERRORS.inc()
+            _LOGGER.exception("Cannot capture the new frame")
+        policy = self.cfg.overload_policy
+        if self.load_monitor.is_overloaded and policy.action == DROP_DISPLAY \
+                and self.load_monitor.n_frames % policy.display_decimation:
+            _DROPPED_DISPLAY_FRAMES.inc()
+            return
+        for i, frame in enumerate(data):
+            output = self.outputs[f"out_{i}"]
+            if len(output.callbacks) == 0:
+                continue
+            # The output consumers (e.g. the display) are queued: they read
+            # the frame after the element is released and its host buffer
+            # memory is reused by the next acquisitions, so they get a copy.
+            output.emit(np.array(frame, copy=True))
+
+    def _capture(self, data):
+        is_capturing = self.is_capturing
+        if self.trigger is not None:
+            action = self.trigger.process(data, is_capturing)
+            if action == START:
+                self._start_triggered_capture()
+                is_capturing = True
+            elif action == STOP:
+                self.stop_capture()
+                is_capturing = False
+        if is_capturing:
+            # Reduced frames are written directly to the buffer.
+            self.capture_buffer.append(data)
+            _CAPTURED_FRAMES.inc()
+            if self.capture_buffer.is_ready():
+                self.stop_capture()
+            else:
+                self.outputs["capture_buffer_events"].emit(
+                    (self.capture_buffer.get_current_size(), False,
+                     self.capture_buffer.get_stats()))
+
+    def _on_overload_changed(self):
+        is_overloaded = self.load_monitor.is_overloaded
+        load = self.load_monitor.load
+        if is_overloaded:
+            _OVERLOADS.inc()
+            _LOGGER.warning("Acquisition callback overloaded (load: %.2f), "
+                            "action: %s", load,
+                            self.cfg.overload_policy.action)
+            if self.cfg.overload_policy.action == PAUSE_CAPTURE \
+                    and self.is_capturing:
+                self.stop_capture()
+        else:
+            _LOGGER.info("Acquisition callback overload ended (load: %.2f)",
+                         load)
+        self.outputs["overload_events"].emit((is_overloaded, load))
@@ -0,0 +1,76 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """
+    Measures the duration of the application startup phases.
+
+    Usage:
+
+        with profiler.phase("cfg load"):
+            ...
+
+    Phases can be nested and can be measured on different threads (e.g.
+    the model is created on the controller thread, while the view is being
+    built); the nesting level is kept per thread. The report lists the
+    phases of each thread in the order they were started, indented
+    according to the nesting level.
+
+    :param enabled: whether the phases should be measured; a disabled
+      profiler adds practically no overhead
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.start_time = time.perf_counter()
+        # (thread name, name, level, duration)
+        self.phases = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        thread_name = threading.current_thread().name
+        level = getattr(self._local, "level", 0)
+        with self._lock:
+            i = len(self.phases)
+            self.phases.append((thread_name, name, level, None))
+        self._local.level = level+1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter()-start
+            self._local.level = level
+            with self._lock:
+                self.phases[i] = (thread_name, name, level, duration)
+
+    def report(self):
+        """
+        Returns the phase durations as a printable string; the phases that
+        are still in progress are marked with "-".
+        """
+        with self._lock:
+            phases = list(self.phases)
+        threads = list(dict.fromkeys(thread for thread, *_ in phases))
+        lines = ["Startup time:"]
+        for thread in threads:
+            if len(threads) > 1:
+                lines.append(f"  {thread}:")
+            indent = 2 if len(threads) > 1 else 1
+            for _, name, level, duration in \
+                    (p for p in phases if p[0] == thread):
+                duration = "-" if duration is None else f"{duration:.3f} s"
+                lines.append(f"{'  '*(level+indent)}{name}: {duration}")
+        total = time.perf_counter()-self.start_time
+        lines.append(f"  total: {total:.3f} s")
+        return "\n".join(lines)
+
+
+# Used when the startup profiling is disabled.
+NULL_PROFILER = StartupProfiler(enabled=False)
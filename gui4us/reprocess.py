@@ -0,0 +1,276 @@
+"""
+Offline reprocessing of the saved captures.
+
+Runs the given NumPy pipeline on the frames of a capture and writes the
+results to a new capture directory (see gui4us.model.capture).
+
+The pipeline is a python file with the ``pipeline`` function (or any other
+function, given as ``file.py:name``): an array of frames with shape
+(n_frames, *frame_shape) -> an array of the processed frames with shape
+(n_frames, *output_frame_shape).
+
+The frames are processed in chunks by a pool of processes. The input and
+output frames are not sent between the processes: each worker
+memory-maps the input and output arrays, reads its input chunk and writes
+the results directly to their place in the output, so the output is
+always in the input order. The number of the completed frames is stored
+in the output capture header only up to the first unfinished chunk,
+so an interrupted run can be continued with --resume.
+
+Usage:
+
+    python -m gui4us.reprocess capture_dir output_dir \\
+        --pipeline pipeline.py --chunk-size 16 --workers 4
+"""
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from gui4us.model.capture import (
+    CaptureWriter, HEADER_FILE, decode_frame, load_capture
+)
+
+REPROCESS_ATTR = "reprocess"
+# The number of chunks submitted to the pool per worker.
+_N_CHUNKS_PER_WORKER = 2
+# Minimum interval between two progress reports [s].
+_PROGRESS_INTERVAL = 1.0
+
+# Worker process state, see _init_worker.
+_worker = None
+
+
+def load_pipeline(spec):
+    """
+    Loads the pipeline function given as "file.py" (the "pipeline"
+    function) or "file.py:function_name".
+    """
+    path, sep, name = spec.rpartition(":")
+    if sep == "" or not name.isidentifier():
+        path, name = spec, "pipeline"
+    module_name = f"gui4us_pipeline_" \
+                  f"{os.path.splitext(os.path.basename(path))[0]}"
+    module = sys.modules.get(module_name, None)
+    if module is None:
+        module_spec = importlib.util.spec_from_file_location(module_name,
+                                                             path)
+        module = importlib.util.module_from_spec(module_spec)
+        sys.modules[module_name] = module
+        module_spec.loader.exec_module(module)
+    return getattr(module, name)
+
+
+class _Worker:
+
+    def __init__(self, pipeline_spec, input_path, reduction, output_path):
+        self.pipeline = load_pipeline(pipeline_spec)
+        self.input = np.load(input_path, mmap_mode="r")
+        self.reduction = reduction
+        self.output = np.load(output_path, mmap_mode="r+")
+
+    def process(self, start, end):
+        frames = decode_frame(self.input[start:end], self.reduction)
+        self.output[start:end] = self.pipeline(frames)
+        self.output.flush()
+        return start, end
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+
+def _process_chunk(start, end):
+    return _worker.process(start, end)
+
+
+class Reprocessor:
+    """
+    Reprocesses the given output of the capture.
+
+    :param input_path: path to the input capture (directory or .pkl file)
+    :param output_path: path to the output capture directory
+    :param pipeline: pipeline specification, "file.py" or
+      "file.py:function_name"
+    :param ordinal: ordinal number of the processed output
+    :param chunk_size: the number of frames processed at once
+    :param n_workers: the number of worker processes
+    :param resume: continue the interrupted processing, if the output
+      capture exists
+    :param on_progress: optional callback, called with (the number of
+      completed frames, the number of all frames, frames per second)
+    """
+
+    def __init__(self, input_path, output_path, pipeline, ordinal=0,
+                 chunk_size=16, n_workers=None, resume=False,
+                 on_progress=None):
+        if chunk_size < 1:
+            raise ValueError("Chunk size should be >= 1.")
+        self.input_path = input_path
+        self.output_path = output_path
+        self.pipeline = pipeline
+        self.ordinal = ordinal
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers if n_workers is not None \
+            else os.cpu_count()
+        self.resume = resume
+        self.on_progress = on_progress
+        self.n_frames = 0
+        self.n_processed = 0
+        self.elapsed_time = 0.0
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    def run(self):
+        """
+        Runs the processing, returns the path to the output capture.
+        """
+        capture = load_capture(self.input_path)
+        reduction = capture.get_reduction(self.ordinal)
+        frames = capture.outputs[self.ordinal]
+        self.n_frames = len(frames)
+        if self.n_frames == 0:
+            raise ValueError(f"No frames in {self.input_path}.")
+        attrs = {REPROCESS_ATTR: {"input": os.path.abspath(self.input_path),
+                                  "pipeline": self.pipeline,
+                                  "ordinal": self.ordinal}}
+        tmp_dir = None
+        try:
+            if isinstance(frames, np.memmap):
+                input_path = frames.filename
+            else:
+                # Captures in the python pickle format are loaded into
+                # memory, the workers read them from a temporary file.
+                tmp_dir = tempfile.mkdtemp(prefix="gui4us_reprocess_")
+                input_path = os.path.join(tmp_dir, "input.npy")
+                np.save(input_path, frames)
+            writer, start = self._open_writer(capture, frames, reduction,
+                                              attrs)
+            try:
+                self._run(writer, start, input_path, reduction)
+            finally:
+                writer.close()
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.output_path
+
+    def _open_writer(self, capture, frames, reduction, attrs):
+        header_path = os.path.join(self.output_path, HEADER_FILE)
+        if self.resume and os.path.exists(header_path):
+            writer = CaptureWriter.reopen(self.output_path)
+            if writer.header["attrs"].get(REPROCESS_ATTR, None) \
+                    != attrs[REPROCESS_ATTR]:
+                raise ValueError(f"{self.output_path} was created from "
+                                 f"another input or pipeline, cannot "
+                                 f"resume.")
+            return writer, writer.n_frames[0]
+        # Determine the output frame shape and data type.
+        pipeline = load_pipeline(self.pipeline)
+        first = pipeline(decode_frame(frames[:1], reduction))
+        writer = CaptureWriter(
+            self.output_path, capture.metadata, shapes=[first.shape[1:]],
+            dtypes=[first.dtype], capacity=self.n_frames, attrs=attrs)
+        for name, values in capture.tags.items():
+            writer.set_tags(name, values)
+        return writer, 0
+
+    def _run(self, writer, start, input_path, reduction):
+        chunks = [(i, min(i+self.chunk_size, self.n_frames))
+                  for i in range(start, self.n_frames, self.chunk_size)]
+        chunks.reverse()
+        # Start of the chunk -> end of the chunk, for the completed chunks
+        # after the first unfinished one.
+        completed = {}
+        input_frame_bytes = np.load(input_path, mmap_mode="r")[0].nbytes
+        output_frame_bytes = writer.outputs[0][0].nbytes
+        self.n_processed = start
+        start_time = time.perf_counter()
+        last_report = start_time
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=_init_worker,
+            initargs=(self.pipeline, input_path, reduction,
+                      writer.outputs[0].filename))
+        with pool:
+            pending = set()
+            while len(chunks) > 0 or len(pending) > 0:
+                while len(chunks) > 0 and \
+                        len(pending) < self.n_workers*_N_CHUNKS_PER_WORKER:
+                    pending.add(pool.submit(_process_chunk, *chunks.pop()))
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    chunk_start, chunk_end = future.result()
+                    completed[chunk_start] = chunk_end
+                    self.n_processed += chunk_end-chunk_start
+                # Advance the completed frames up to the first gap.
+                n_completed = writer.n_frames[0]
+                while n_completed in completed:
+                    n_completed = completed.pop(n_completed)
+                if n_completed != writer.n_frames[0]:
+                    writer.n_frames[0] = n_completed
+                    writer.flush()
+                now = time.perf_counter()
+                self.elapsed_time = now-start_time
+                n_new = self.n_processed-start
+                self.input_bytes = n_new*input_frame_bytes
+                self.output_bytes = n_new*output_frame_bytes
+                if self.on_progress is not None \
+                        and (now-last_report >= _PROGRESS_INTERVAL
+                             or len(pending) == 0):
+                    last_report = now
+                    self.on_progress(self.n_processed, self.n_frames,
+                                     n_new/max(self.elapsed_time, 1e-9))
+
+
+def _print_progress(n_processed, n_frames, fps):
+    print(f"\rProcessed {n_processed}/{n_frames} frames "
+          f"({100*n_processed/max(n_frames, 1):.0f}%), {fps:.1f} frames/s",
+          end="", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs a NumPy pipeline on the frames of the saved "
+                    "capture.")
+    parser.add_argument("input", help="Path to the input capture "
+                                      "(directory or .pkl file)")
+    parser.add_argument("output", help="Path to the output capture "
+                                       "directory")
+    parser.add_argument("--pipeline", dest="pipeline", required=True,
+                        help="Python file with the pipeline function: "
+                             "file.py (function 'pipeline') or "
+                             "file.py:function_name")
+    parser.add_argument("--ordinal", dest="ordinal", type=int, default=0,
+                        help="Ordinal number of the processed output")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int,
+                        default=16,
+                        help="The number of frames processed at once")
+    parser.add_argument("--workers", dest="n_workers", type=int,
+                        default=None,
+                        help="The number of worker processes (default: the "
+                             "number of CPUs)")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="Continue the interrupted processing")
+    args = parser.parse_args()
+    reprocessor = Reprocessor(
+        args.input, args.output, args.pipeline, ordinal=args.ordinal,
+        chunk_size=args.chunk_size, n_workers=args.n_workers,
+        resume=args.resume, on_progress=_print_progress)
+    reprocessor.run()
+    print()
+    elapsed_time = max(reprocessor.elapsed_time, 1e-9)
+    print(f"Done: {args.output}, {elapsed_time:.2f} s, "
+          f"input: {reprocessor.input_bytes/2**20/elapsed_time:.1f} MiB/s, "
+          f"output: {reprocessor.output_bytes/2**20/elapsed_time:.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 from dataclasses import dataclass
 from typing import Union, Set
-from collections import Iterable
+from collections.abc import Iterable
+
+from gui4us.tracing import TRACER
+
+_DO_SPAN = TRACER.register("StateGraphIterator.do")
+_GO_SPAN = TRACER.register("StateGraphIterator.go")
 
 StateId = str
 ActionId = str
@@ -62,8 +67,6 @@ class StateGraph:
 
     def get_transition(self, in_state: Union[State, StateId],
                        out_state: Union[State, StateId]):
-        print(self.transition_idx)
-
         in_id = in_state if isinstance(in_state, StateId) else in_state.id
         out_id = out_state if isinstance(out_state, StateId) else out_state.id
         try:
@@ -114,6 +117,20 @@ class StateGraphIterator:
         self.current_state = state
 
     def do(self, action: Union[ActionId, Action]):
+        start = TRACER.begin()
+        try:
+            self._do(action)
+        finally:
+            TRACER.end(_DO_SPAN, start)
+
+    def go(self, state: Union[State, StateId]):
+        start = TRACER.begin()
+        try:
+            self._go(state)
+        finally:
+            TRACER.end(_GO_SPAN, start)
+
+    def _do(self, action: Union[ActionId, Action]):
         if isinstance(action, Action):
             action = action.id
         transition = self.state_graph.get_action(self.current_state, action)
@@ -135,7 +152,7 @@ class StateGraphIterator:
                 return
         self.current_state = output_state
 
-    def go(self, state: Union[State, StateId]):
+    def _go(self, state: Union[State, StateId]):
 
         transition = self.state_graph.get_transition(self.current_state, state)
         input_state = self.state_graph.get_state(state)
@@ -0,0 +1,151 @@
+"""
+Low-overhead span tracing.
+
+The span names are registered up front (register), each thread writes the
+completed spans to its own preallocated ring buffer, so no memory is
+allocated per span. The tracer is disabled by default, when disabled,
+begin/end only check a flag.
+
+Usage:
+
+    _SPAN = TRACER.register("Env._on_new_data")
+    ...
+    start = TRACER.begin()
+    try:
+        ...
+    finally:
+        TRACER.end(_SPAN, start)
+
+The recorded spans can be exported to the Chrome trace event format
+(JSON), which can be opened e.g. in Perfetto or chrome://tracing.
+"""
+import json
+import os
+import threading
+import time
+
+
+class _Ring:
+    """
+    Spans recorded by a single thread; the oldest spans are overwritten.
+    """
+
+    def __init__(self, capacity):
+        # Imported here: the rings are created only when the tracer is
+        # enabled, the tracing module is imported on startup.
+        import numpy as np
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.ids = np.zeros(capacity, dtype=np.int32)
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.ends = np.zeros(capacity, dtype=np.int64)
+        self.n = 0
+
+    def get_spans(self):
+        import numpy as np
+        capacity = len(self.ids)
+        n = min(self.n, capacity)
+        order = (np.arange(self.n-n, self.n)) % capacity
+        return self.ids[order], self.starts[order], self.ends[order]
+
+
+class Tracer:
+    """
+    :param capacity: the number of spans kept per thread
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.enabled = False
+        self.names = []
+        self._ids = {}
+        self._rings = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def register(self, name) -> int:
+        """
+        Returns the id of the span with the given name.
+        """
+        with self._lock:
+            span_id = self._ids.get(name, None)
+            if span_id is None:
+                span_id = len(self.names)
+                self.names.append(name)
+                self._ids[name] = span_id
+            return span_id
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            for ring in self._rings:
+                ring.n = 0
+
+    def begin(self):
+        """
+        Returns the span start time, 0 if the tracer is disabled.
+        """
+        if not self.enabled:
+            return 0
+        return time.perf_counter_ns()
+
+    def end(self, span_id, start):
+        """
+        Records the span that started at the given time (see begin).
+        """
+        if start == 0:
+            return
+        end = time.perf_counter_ns()
+        ring = getattr(self._local, "ring", None)
+        if ring is None:
+            ring = self._create_ring()
+        i = ring.n % self.capacity
+        ring.ids[i] = span_id
+        ring.starts[i] = start
+        ring.ends[i] = end
+        ring.n += 1
+
+    def _create_ring(self):
+        ring = _Ring(self.capacity)
+        self._local.ring = ring
+        with self._lock:
+            self._rings.append(ring)
+        return ring
+
+    def to_chrome_trace(self):
+        """
+        Returns the recorded spans as a dict in the Chrome trace event
+        format.
+        """
+        pid = os.getpid()
+        events = []
+        with self._lock:
+            rings = list(self._rings)
+            names = list(self.names)
+        for ring in rings:
+            events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                           "tid": ring.thread_id,
+                           "args": {"name": ring.thread_name}})
+            ids, starts, ends = ring.get_spans()
+            for span_id, start, end in zip(ids.tolist(), starts.tolist(),
+                                           ends.tolist()):
+                events.append({"name": names[span_id], "ph": "X",
+                               "pid": pid, "tid": ring.thread_id,
+                               "ts": start/1e3, "dur": (end-start)/1e3})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """
+        Writes the recorded spans to the given JSON file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+# The default tracer.
+TRACER = Tracer()
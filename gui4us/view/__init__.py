@@ -1 +1,18 @@
-from gui4us.view.view import *
\ No newline at end of file
+# The view modules import PyQt5 and matplotlib; they are loaded on first
+# access, so that importing gui4us.view itself is cheap.
+_LAZY_ATTRIBUTES = {
+    "View": "gui4us.view.view",
+    "start_view": "gui4us.view.view",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name])
+    return getattr(module, name)
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()))
@@ -1,11 +1,23 @@
-from gui4us.view.widgets import *
-from gui4us.state_graph import *
-from gui4us.view.common import *
-import numpy as np
+import logging
+
+from PyQt5.QtWidgets import QFileDialog
+
+from gui4us.view.widgets import Label, Panel, PushButton, show_error_message
+from gui4us.state_graph import (
+    Action,
+    State,
+    StateGraph,
+    StateGraphIterator,
+    Transition
+)
+from gui4us.view.common import OutputBridge, when_ready
+
+_LOGGER = logging.getLogger("gui4us.view")
 
 # Supported file extensions
 _FILE_EXTENSIONS = ";;".join([
     "Python pickle dataset (*.pkl)",
+    "gui4us capture directory (*)",
     # "MATLAB file (*.mat)"
 ])
 
@@ -18,14 +30,22 @@ class CaptureBufferComponent(Panel):
         # Action buttons
         self.capture_button = PushButton("Capture")
         self.save_button = PushButton("Save")
+        self.review_button = PushButton("Review")
         self.state_label = Label("Press capture ...")
         self.add_component(self.capture_button)
         self.add_component(self.save_button)
+        self.add_component(self.review_button)
         self.add_component(self.state_label)
         self.capture_button.on_pressed(self.__on_capture_button_press)
         self.save_button.on_pressed(self.__on_save_button_press)
+        self.review_button.on_pressed(self.__on_review_button_press)
+        self.on_review_callbacks = []
+        self.on_capture_start_callbacks = []
+        self.on_capture_end_callbacks = []
+        self.on_save_callbacks = []
 
         self.save_button.disable()
+        self.review_button.disable()
 
         self.state_graph = StateGraph(
             states={
@@ -45,6 +65,11 @@ class CaptureBufferComponent(Panel):
                            self.on_capture_start),  # Reset capture buffer
                 Transition("capturing", "capture_done", "captured",
                            self.on_capture_end),
+                # Captures started by the capture trigger (model side).
+                Transition("empty", "capture_done", "captured",
+                           self.on_capture_end),
+                Transition("captured", "capture_done", "captured",
+                           self.on_capture_end),
                 Transition("capturing", "save", "empty",
                            self.on_save),
                 Transition("captured", "capture", "capturing",
@@ -57,34 +82,49 @@ class CaptureBufferComponent(Panel):
             self.state_graph, start_state="empty")
         self.buffer_state_output = self.controller.get_output(
             "capture_buffer_events")
-        self.thread = QThread()
-        self.worker = ViewWorker(self.update)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
+        # Capture progress is delivered at most every 50 ms, only the most
+        # recent state matters.
+        self.bridge = OutputBridge(self.buffer_state_output,
+                                   min_interval=0.05, coalesce=True)
+        self.bridge.connect(self.update)
         self.is_started = False
 
     def start(self):
         self.is_started = True
-        self.thread.start(priority=QThread.TimeCriticalPriority)
+        self.bridge.start()
 
     def stop(self):
         self.is_started = False
 
-    def update(self):
+    def close(self):
+        self.stop()
+        self.bridge.stop()
+
+    def update(self, event):
         try:
-            event = self.buffer_state_output.get()
             if event is None:
                 # event buffer closed
                 return
             else:
-                capture_size, is_done = event
+                capture_size, is_done, stats = event
                 if is_done:
-                    self.state_label.set_text(f"Done, captured: {capture_size}")
+                    text = f"Done, captured: {capture_size}"
                     self.state.do("capture_done")
                 else:
-                    self.state_label.set_text(f"Captured frame {capture_size}")
-        except Exception as e:
-            print(e)
+                    text = f"Captured frame {capture_size}"
+                if stats is not None:
+                    text = f"{text}\n{self.__format_stats(stats)}"
+                self.state_label.set_text(text)
+        except Exception:
+            _LOGGER.exception("Cannot update the capture buffer state")
+
+    def __format_stats(self, stats):
+        text = f"Compression: {stats['ratio']:.2f}x, " \
+               f"{stats['memory']/2**20:.1f} MiB, " \
+               f"capacity: {stats['effective_capacity']} frames"
+        if stats["n_uncompressed"] > 0:
+            text = f"{text}, uncompressed: {stats['n_uncompressed']}"
+        return text
 
     def __on_capture_button_press(self):
         self.state.do("capture")
@@ -92,6 +132,25 @@ class CaptureBufferComponent(Panel):
     def __on_save_button_press(self):
         self.state.do("save")
 
+    def __on_review_button_press(self):
+        for callback in self.on_review_callbacks:
+            callback()
+
+    def add_on_review_callback(self, callback):
+        self.on_review_callbacks.append(callback)
+
+    def add_on_capture_start_callback(self, callback):
+        self.on_capture_start_callbacks.append(callback)
+
+    def add_on_capture_end_callback(self, callback):
+        self.on_capture_end_callbacks.append(callback)
+
+    def add_on_save_callback(self, callback):
+        """
+        Registers callback(filename), called after the capture is saved.
+        """
+        self.on_save_callbacks.append(callback)
+
     def on_capture_reset(self):
         # TODO
         pass
@@ -99,10 +158,16 @@ class CaptureBufferComponent(Panel):
     def on_capture_start(self, event):
         self.capture_button.enable()
         self.save_button.enable()
+        self.review_button.disable()
         self.controller.start_capture()
+        for callback in self.on_capture_start_callbacks:
+            callback()
 
     def on_capture_end(self, event):
         self.save_button.enable()
+        self.review_button.enable()
+        for callback in self.on_capture_end_callbacks:
+            callback()
 
     def on_save(self, event):
         filename, extension = QFileDialog.getSaveFileName(
@@ -111,8 +176,22 @@ class CaptureBufferComponent(Panel):
         if extension == "":
             event.stop()
             return
-        self.controller.save_capture(filename)
+        saved = self.controller.save_capture(filename)
         self.controller.clear_capture()
+        when_ready(saved, lambda result: self.__on_saved(filename),
+                   lambda error: self.__on_save_error(filename, error))
+
+    def __on_saved(self, filename):
+        for callback in self.on_save_callbacks:
+            try:
+                callback(filename)
+            except Exception:
+                _LOGGER.exception("Error in the save callback")
+
+    def __on_save_error(self, filename, error):
+        _LOGGER.error("Cannot save the capture to %s: %s", filename, error)
+        show_error_message(f"Cannot save the capture: {error}")
 
     def on_empty_buffer(self, event):
         self.save_button.disable()
+        self.review_button.disable()
@@ -0,0 +1,300 @@
+import threading
+
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_qt5agg import FigureCanvas
+from matplotlib.colors import Colormap, Normalize
+from matplotlib.figure import Figure
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QFileDialog, QSlider
+
+import gui4us.cfg
+from gui4us.common import ImageMetadata, get_pixel_extent
+from gui4us.model.capture import load_capture
+from gui4us.view.display.scan_conversion import ScanConverter
+from gui4us.view.widgets import CheckBox, Label, Panel, PushButton, SpinBox
+
+# Maximum number of displayed frames per second, higher playback speeds
+# skip frames.
+_MAX_DISPLAY_FPS = 50
+
+
+class FramePrefetcher:
+    """
+    Colormaps captured frames on a background thread, keeping the frames
+    right after the playhead ready to display.
+
+    The frames are read directly from the capture (e.g. CaptureBuffer or
+    memory-mapped Capture), without copying.
+
+    :param capture: captured frames, an object with get_n_frames and
+      get_frame methods
+    :param colormap: function: frame -> RGBA image
+    :param n_frames: the number of frames to keep ready after the playhead
+    :param ordinal: ordinal number of the output to display
+    """
+
+    def __init__(self, capture, colormap, n_frames=32, ordinal=0):
+        self.capture = capture
+        self.colormap = colormap
+        self.n_frames = n_frames
+        self.ordinal = ordinal
+        self.n_total = capture.get_n_frames(ordinal)
+        self._cache = {}
+        self._playhead = 0
+        self._step = 1
+        self._is_loop = True
+        self._is_closed = False
+        self._condition = threading.Condition()
+        # The colormap function is called both by the prefetching and the
+        # GUI thread (on cache miss).
+        self._render_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_playhead(self, i, step=1, is_loop=True):
+        with self._condition:
+            self._playhead = i
+            self._step = step
+            self._is_loop = is_loop
+            self._condition.notify()
+
+    def get(self, i):
+        """
+        Returns RGBA image of the i-th frame.
+        """
+        with self._condition:
+            image = self._cache.get(i, None)
+        if image is None:
+            # Cache miss, e.g. the user has just moved the scrubber.
+            image = self._render(i)
+            with self._condition:
+                self._cache[i] = image
+        return image
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _get_window(self):
+        window = []
+        if self.n_total == 0:
+            return window
+        for k in range(self.n_frames+1):
+            i = self._playhead + k*self._step
+            if self._is_loop:
+                i %= self.n_total
+            elif i >= self.n_total:
+                break
+            window.append(i)
+        return window
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._is_closed:
+                        return
+                    window = self._get_window()
+                    for i in set(self._cache).difference(window):
+                        del self._cache[i]
+                    missing = [i for i in window if i not in self._cache]
+                    if len(missing) > 0:
+                        break
+                    self._condition.wait()
+            i = missing[0]
+            image = self._render(i)
+            with self._condition:
+                self._cache[i] = image
+
+    def _render(self, i):
+        with self._render_lock:
+            return self.colormap(self.capture.get_frame(i, self.ordinal))
+
+
+class CinePanel(Panel):
+    """
+    Cine-loop playback of the captured frames: a scrubber over the captured
+    frames, play/pause, playback speed and looping.
+
+    :param capture: captured frames, an object with get_n_frames and
+      get_frame methods (e.g. CaptureBuffer or Capture)
+    :param layer_cfg: configuration of the displayed layer
+    :param image_metadata: metadata of the displayed output
+    :param fps: the number of frames per second played at speed 1.0
+    :param n_prefetch: the number of frames to prefetch
+    """
+
+    def __init__(self, capture, layer_cfg: gui4us.cfg.Layer2D,
+                 image_metadata: ImageMetadata, title="Cine", fps=25,
+                 n_prefetch=32):
+        super().__init__(title)
+        self.layer_cfg = layer_cfg
+        self.image_metadata = image_metadata
+        self.fps = fps
+        self.n_prefetch = n_prefetch
+        self.prefetcher = None
+        self.current = 0
+        self.step = 1
+        # Image
+        self.figure = Figure(figsize=(6, 6))
+        self.canvas = FigureCanvas(self.figure)
+        self.layout.addWidget(self.canvas)
+        self.ax = self.figure.subplots()
+        self.image = None
+        # Playback controls.
+        self.scrubber = QSlider(Qt.Horizontal)
+        self.scrubber.valueChanged.connect(self.show_frame)
+        self.layout.addWidget(self.scrubber)
+        self.controls = Panel("Playback", layout="h")
+        self.play_button = PushButton("Play")
+        self.play_button.on_pressed(self._on_play_pressed)
+        self.speed_box = SpinBox(value_range=(0.1, 10.0), step=0.1,
+                                 init_value=1.0, data_type="float")
+        self.speed_box.set_on_change(self._on_speed_changed)
+        self.loop_box = CheckBox("Loop", init_value=True)
+        self.open_button = PushButton("Open...")
+        self.open_button.on_pressed(self._on_open_pressed)
+        for component in (self.play_button, Label("Speed:"), self.speed_box,
+                          self.loop_box, self.open_button):
+            self.controls.add_component(component)
+        self.add_component(self.controls)
+        self.timer = QTimer()
+        self.timer.timeout.connect(self._on_timer)
+        self.backend_widget.setAttribute(Qt.WA_DeleteOnClose)
+        self.backend_widget.destroyed.connect(self.close)
+        self.set_capture(capture)
+
+    def show(self):
+        self.backend_widget.show()
+
+    def close(self, *args):
+        self.pause()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def set_capture(self, capture):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.prefetcher = FramePrefetcher(
+            capture, self._create_colormap(capture), self.n_prefetch)
+        n_frames = self.prefetcher.n_total
+        self.scrubber.blockSignals(True)
+        self.scrubber.setRange(0, max(n_frames-1, 0))
+        self.scrubber.setValue(0)
+        self.scrubber.blockSignals(False)
+        extent_oz, extent_ox = self._get_extents(capture)
+        extent = [extent_ox[0], extent_ox[1], extent_oz[1], extent_oz[0]]
+        if self.image is None:
+            self.image = self.ax.imshow(self.prefetcher.get(0),
+                                        extent=extent)
+        else:
+            self.image.set_extent(extent)
+        self.show_frame(0)
+
+    def play(self):
+        speed = self.speed_box.get_value()
+        # Skip frames when the requested frame rate cannot be displayed.
+        self.step = max(1, int(round(speed*self.fps/_MAX_DISPLAY_FPS)))
+        interval = 1000*self.step/(speed*self.fps)
+        self.timer.start(int(interval))
+        self.play_button.set_text("Pause")
+
+    def pause(self):
+        self.timer.stop()
+        self.play_button.set_text("Play")
+
+    def show_frame(self, i):
+        self.current = i
+        self.prefetcher.set_playhead(i, step=self.step,
+                                     is_loop=self.loop_box.get_value())
+        self.image.set_data(self.prefetcher.get(i))
+        self.ax.set_title(f"Frame {i+1}/{self.prefetcher.n_total}")
+        self.canvas.draw_idle()
+
+    def _on_timer(self):
+        i = self.current+self.step
+        n_frames = self.prefetcher.n_total
+        if i >= n_frames:
+            if not self.loop_box.get_value():
+                self.pause()
+                return
+            i %= n_frames
+        # Updates the current frame (see show_frame).
+        self.scrubber.setValue(i)
+
+    def _on_play_pressed(self):
+        if self.timer.isActive():
+            self.pause()
+        else:
+            self.play()
+
+    def _on_speed_changed(self, value):
+        if self.timer.isActive():
+            self.play()
+
+    def _on_open_pressed(self):
+        path = QFileDialog.getExistingDirectory(
+            parent=None, caption="Open capture", directory=".")
+        if path == "":
+            return
+        self.pause()
+        self.set_capture(load_capture(path))
+
+    def _get_extents(self, capture):
+        roi = self._get_roi(capture)
+        if roi is not None:
+            # Cropped frames are displayed without scan conversion.
+            return tuple(
+                get_pixel_extent(pixels, extent, n) for pixels, extent, n
+                in zip(roi, self.image_metadata.extents,
+                       self.image_metadata.shape))
+        if self.layer_cfg.scan_conversion is not None:
+            sc_cfg = self.layer_cfg.scan_conversion
+            return ((np.min(sc_cfg.z_grid), np.max(sc_cfg.z_grid)),
+                    (np.min(sc_cfg.x_grid), np.max(sc_cfg.x_grid)))
+        if self.layer_cfg.extent is not None:
+            return self.layer_cfg.extent
+        return self.image_metadata.extents
+
+    def _create_colormap(self, capture):
+        cmap = self.layer_cfg.cmap
+        if not isinstance(cmap, Colormap):
+            cmap = matplotlib.colormaps[cmap]
+        converter = None
+        if self.layer_cfg.scan_conversion is not None \
+                and self._get_roi(capture) is None:
+            converter = ScanConverter.from_metadata(
+                self.image_metadata, self.layer_cfg.scan_conversion)
+        if self.layer_cfg.value_range is not None:
+            vmin, vmax = self.layer_cfg.value_range
+        else:
+            first_frame = capture.get_frame(0)
+            vmin, vmax = np.min(first_frame), np.max(first_frame)
+        norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
+
+        def colormap(frame):
+            if converter is not None:
+                frame = converter.convert(frame)
+            return cmap(norm(frame), bytes=True)
+        return colormap
+
+    def _get_roi(self, capture):
+        """
+        Returns the ROI of the displayed output if the captured frames
+        were cropped, None otherwise.
+        """
+        get_reduction = getattr(capture, "get_reduction", None)
+        if get_reduction is None:
+            return None
+        reduction = get_reduction(0)
+        if reduction is None:
+            return None
+        roi = reduction["roi"]
+        shape = self.image_metadata.shape
+        if all(start == 0 and end == n for (start, end), n in zip(roi, shape)):
+            return None
+        return roi
@@ -1,30 +1,158 @@
+import logging
+import queue
+import threading
 import time
 
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
+from PyQt5.QtCore import QObject, Qt, pyqtSignal, pyqtSlot
 
+from gui4us.tracing import TRACER
 
-class ViewWorker(QObject):
+_LOGGER = logging.getLogger("gui4us.view")
+# Wakes up the bridge thread, so it can stop.
+_STOP = object()
+_EMIT_SPAN = TRACER.register("OutputBridge.emit")
+# How often the bridge thread checks if the GUI finished handling the
+# previous signal, when it has new data to deliver [s].
+_ACK_POLL_INTERVAL = 0.005
 
-    def __init__(self, func, interval=0.01):
+
+class OutputBridge(QObject):
+    """
+    Delivers data from the controller output to the GUI thread, as queued
+    Qt signals.
+
+    A background thread blocks on the output, so the GUI thread never
+    waits for the data. The signal is emitted at most once per
+    min_interval, and only after the connected slots handled the previous
+    one, so at most one signal per bridge waits in the Qt event queue.
+    In the meantime, the new items are merged into the pending ones:
+    when coalesce is True, only the most recent data item is delivered
+    (e.g. progress events); otherwise a list of the items received since
+    the previous signal is delivered (at most max_batch_size most recent
+    items).
+
+    :param output: controller output (OutputWorker)
+    :param min_interval: minimum interval between two signals [s]
+    :param coalesce: whether only the most recent item should be delivered
+    :param max_batch_size: maximum number of delivered items, when coalesce
+      is False; None means no limit
+    """
+    received = pyqtSignal(object)
+
+    def __init__(self, output, min_interval=0.0, coalesce=True,
+                 max_batch_size=None):
         super().__init__()
-        self.func = func
-        self.is_working = False
-        self.interval = interval
-
-    @pyqtSlot()
-    def run(self):
-        # TODO sync point
-        self.is_working = True
-        while self.is_working:
-            self.func()
-            time.sleep(self.interval)
-
-    def stop(self):
-        self.is_working = False
-
-    def wait_for_stop(self):
+        self.output = output
+        self.min_interval = min_interval
+        self.coalesce = coalesce
+        self.max_batch_size = max_batch_size
+        self._slots = []
+        # Set when the previously emitted data was handled by the slots.
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        self.received.connect(self._deliver, Qt.QueuedConnection)
+
+    def connect(self, slot):
+        """
+        Connects the slot, which will be called on the GUI thread.
+        """
+        self._slots.append(slot)
+
+    @pyqtSlot(object)
+    def _deliver(self, data):
+        try:
+            for slot in self._slots:
+                slot(data)
+        finally:
+            self._idle.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._idle.set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        if self._thread is None:
+            return
+        self.output.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        pending = []
+        last_emit_time = float("-inf")
         while True:
-            # TODO replace active waiting with signal
-            if self.is_working:
-                time.sleep(0.01)
+            timeout = None
+            if len(pending) > 0:
+                timeout = max(0.0, last_emit_time+self.min_interval
+                              - time.monotonic())
+                if not self._idle.is_set():
+                    timeout = max(timeout, _ACK_POLL_INTERVAL)
+            try:
+                item = self.output.get(timeout=timeout)
+                if item is _STOP:
+                    return
+                pending.append(item)
+                if self.coalesce:
+                    del pending[:-1]
+                elif self.max_batch_size is not None:
+                    del pending[:-self.max_batch_size]
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if len(pending) > 0 and now-last_emit_time >= self.min_interval \
+                    and self._idle.is_set():
+                self._idle.clear()
+                start = TRACER.begin()
+                self.received.emit(pending[-1] if self.coalesce else pending)
+                TRACER.end(_EMIT_SPAN, start)
+                pending = []
+                last_emit_time = now
+
+
+class _Invoker(QObject):
+    """
+    Calls the emitted functions on the thread of this object (GUI thread).
+    """
+    invoked = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.invoked.connect(self._invoke, Qt.QueuedConnection)
+
+    @pyqtSlot(object)
+    def _invoke(self, func):
+        try:
+            func()
+        except Exception:
+            _LOGGER.exception("Error in the GUI thread callback")
+
+
+_INVOKER = None
+
+
+def when_ready(promise, on_result, on_error=None):
+    """
+    Calls on_result(result) on the GUI thread, when the result of the given
+    controller promise is available. If the task failed, on_error(error)
+    is called instead (if provided).
+
+    Should be called on the GUI thread.
+    """
+    global _INVOKER
+    if _INVOKER is None:
+        _INVOKER = _Invoker()
+    invoker = _INVOKER
+
+    def on_done(p):
+        error = p.get_error()
+        if error is None:
+            result = p.get_result()
+            invoker.invoked.emit(lambda: on_result(result))
+        elif on_error is not None:
+            invoker.invoked.emit(lambda: on_error(error))
+
+    promise.add_done_callback(on_done)
@@ -1,35 +1,32 @@
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
-from PyQt5.QtWidgets import (
-    QPushButton,
-    QSlider,
-    QSpinBox,
-    QGroupBox,
-    QVBoxLayout,
-    QHBoxLayout,
-    QFormLayout,
-    QWidget,
-    QFileDialog,
-    QMessageBox,
-    QDoubleSpinBox
-)
-from PyQt5.QtCore import pyqtSlot
-
-
-from gui4us.view.widgets import *
+import logging
+
+from PyQt5.QtCore import QTimer
+
+from gui4us.view.widgets import Label, Panel, PushButton, SpinBox
 from gui4us.view.settings import SettingsPanel
 from gui4us.view.capture_buffer import CaptureBufferComponent
-from gui4us.state_graph import *
+
+_LOGGER = logging.getLogger("gui4us.view")
 
 
 class ControlPanel(Panel):
 
-    def __init__(self, controller, title="Control panel"):
+    def __init__(self, controller, settings=None, work_mode=None,
+                 title="Control panel"):
         super().__init__(title)
         self.controller = controller
         self.actions_panel = ActionsPanel(controller)
+        self.trigger_panel = None
+        if work_mode == "MANUAL":
+            scheduler = controller.get_trigger_scheduler()
+            if scheduler is not None:
+                self.trigger_panel = ManualTriggerPanel(scheduler)
+            else:
+                _LOGGER.warning("The trigger scheduler is not available, "
+                                "the acquisitions cannot be triggered.")
         self.buffer_panel = CaptureBufferComponent(controller)
-        settings = self.controller.get_settings().get_result()
+        if settings is None:
+            settings = self.controller.get_settings().get_result()
 
         self.settings_panel = SettingsPanel(
             controller,
@@ -40,9 +37,11 @@ class ControlPanel(Panel):
 
         self.panels = (
             self.actions_panel,
+            self.trigger_panel,
             self.buffer_panel,
             self.settings_panel
         )
+        self.panels = tuple(p for p in self.panels if p is not None)
         for panel in self.panels:
             self.add_component(panel)
 
@@ -73,3 +72,71 @@ class ActionsPanel(Panel):
 
     def add_on_start_stop_callback(self, callback):
         self.on_start_stop_callbacks.append(callback)
+
+
+class ManualTriggerPanel(Panel):
+    """
+    Acquisition triggering in the MANUAL work mode: single runs, bursts
+    of runs and periodic runs at the given rate.
+    """
+    def __init__(self, scheduler, title="Trigger"):
+        super().__init__(title)
+        self.scheduler = scheduler
+        self.rate_spin_box = SpinBox(value_range=(0.1, 1000), step=1,
+                                     init_value=10, data_type="float",
+                                     line_edit_read_only=False)
+        self.n_runs_spin_box = SpinBox(value_range=(1, 10000), step=1,
+                                       init_value=10,
+                                       line_edit_read_only=False)
+        self.trigger_button = PushButton("Trigger")
+        self.burst_button = PushButton("Burst")
+        self.run_button = PushButton("Run")
+        self.stats_label = Label("")
+        for component in (Label("Rate [Hz]"), self.rate_spin_box,
+                          Label("Burst size"), self.n_runs_spin_box,
+                          self.trigger_button, self.burst_button,
+                          self.run_button, self.stats_label):
+            self.add_component(component)
+        self.trigger_button.on_pressed(lambda *args: self.scheduler.trigger())
+        self.burst_button.on_pressed(self.on_burst)
+        self.run_button.on_pressed(self.on_run_stop)
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(500)
+
+    def on_burst(self, *args):
+        self.scheduler.start_burst(self.n_runs_spin_box.get_value(),
+                                   self.rate_spin_box.get_value())
+
+    def on_run_stop(self, *args):
+        if self.scheduler.is_running:
+            self.stop()
+        else:
+            self.scheduler.start_periodic(self.rate_spin_box.get_value())
+
+    def stop(self):
+        self.scheduler.stop()
+        self.update_stats()
+
+    def update_stats(self):
+        self.run_button.set_text(
+            "Stop" if self.scheduler.is_running else "Run")
+        stats = self.scheduler.get_stats()
+        if stats["n_runs"] == 0:
+            self.stats_label.set_text("")
+            return
+        lines = []
+        if stats["requested_rate"] is not None:
+            lines.append(f"Requested: {stats['requested_rate']:.1f} Hz")
+        if stats["achieved_rate"] is not None:
+            lines.append(f"Achieved: {stats['achieved_rate']:.1f} Hz")
+        if "jitter_mean" in stats:
+            lines.append(f"Jitter: {1e3*stats['jitter_mean']:.2f} "
+                         f"\u00b1 {1e3*stats['jitter_std']:.2f} ms "
+                         f"(max {1e3*stats['jitter_max']:.2f} ms)")
+        lines.append(f"Runs: {stats['n_runs']}, missed: {stats['n_missed']}")
+        self.stats_label.set_text("\n".join(lines))
+
+    def close(self):
+        self.stats_timer.stop()
+        self.scheduler.stop()
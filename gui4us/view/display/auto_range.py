@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class StreamingQuantiles:
+    """
+    Streaming approximate quantiles of the incoming frames.
+
+    A fixed-bin histogram is updated with a strided subsample of each frame,
+    the counts from the previous frames decay exponentially. The values
+    outside the histogram range are counted in the edge bins. The range
+    follows the estimated quantiles (not the extreme values, so that
+    outliers do not reset it): it is adjusted when the estimates reach
+    the edge bins or occupy only a small part of the range; the
+    accumulated counts are then rebinned to the new range.
+    The estimates are exponentially smoothed. No sorting is performed.
+
+    :param quantiles: quantiles to estimate, each in range [0, 1]
+    :param n_bins: the number of histogram bins
+    :param stride: subsampling stride along each frame axis
+    :param decay: histogram decay factor, applied on each new frame
+    :param smoothing: weight of the new estimate in the exponential smoothing
+    """
+
+    def __init__(self, quantiles=(0.01, 0.99), n_bins=1024, stride=4,
+                 decay=0.9, smoothing=0.2):
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.n_bins = n_bins
+        self.stride = stride
+        self.decay = decay
+        self.smoothing = smoothing
+        self.histogram = np.zeros(n_bins, dtype=np.float64)
+        self.range = None
+        self.scale = None
+        self.estimate = None
+
+    def update(self, frame):
+        """
+        Updates the estimates with the given frame, returns the current
+        estimates (None if there is no valid data yet).
+        """
+        sample = frame[(slice(None, None, self.stride), )*frame.ndim]
+        sample = sample[np.isfinite(sample)]
+        if sample.size == 0:
+            return self.estimate
+        if self.range is None:
+            self._set_range(np.min(sample), np.max(sample))
+        self.histogram *= self.decay
+        self.histogram += self._get_counts(sample)
+        bins = self._get_quantile_bins()
+        # Adjust the histogram range when the quantiles do not fit it, or
+        # when they occupy only a small part of the range. The range
+        # extends by the margin on each adjustment, until the quantiles fit.
+        if bins[0] == 0 or bins[-1] == self.n_bins-1 \
+                or bins[-1]-bins[0] < self.n_bins//8:
+            values = self._get_bin_values(bins)
+            lo, hi = values[0], values[-1]
+            margin = max(hi-lo, 1/self.scale)/4
+            self._rebin(lo-margin, hi+margin)
+            bins = self._get_quantile_bins()
+        values = self._get_bin_values(bins)
+        if self.estimate is None:
+            self.estimate = values
+        else:
+            self.estimate = self.estimate \
+                            + self.smoothing*(values-self.estimate)
+        return self.estimate
+
+    def _set_range(self, lo, hi):
+        if hi <= lo:
+            hi = lo+1
+        self.range = (float(lo), float(hi))
+        self.scale = self.n_bins/(self.range[1]-self.range[0])
+
+    def _get_counts(self, sample, weights=None):
+        indices = ((sample-self.range[0])*self.scale).astype(np.intp)
+        np.clip(indices, 0, self.n_bins-1, out=indices)
+        return np.bincount(indices, weights=weights, minlength=self.n_bins)
+
+    def _rebin(self, lo, hi):
+        """
+        Changes the histogram range; the counts of each bin are moved to
+        the new bin containing its center.
+        """
+        centers = self._get_bin_values(np.arange(self.n_bins))
+        self._set_range(lo, hi)
+        self.histogram = self._get_counts(centers, weights=self.histogram)
+
+    def _get_quantile_bins(self):
+        cdf = np.cumsum(self.histogram)
+        bins = np.searchsorted(cdf, self.quantiles*cdf[-1])
+        return np.minimum(bins, self.n_bins-1)
+
+    def _get_bin_values(self, bins):
+        return self.range[0]+(bins+0.5)/self.scale
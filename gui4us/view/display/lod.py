@@ -0,0 +1,126 @@
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class _ReductionPlan:
+    """
+    Precomputed reduction of an image with the given shape to the target
+    pixel grid.
+
+    :param row_starts: first input row of each output row, None if
+      the rows are not reduced
+    :param col_starts: first input column of each output column, None if
+      the columns are not reduced
+    :param scale: 1/(number of input pixels) of each output pixel, None if
+      the output should not be scaled
+    :param rows_output: preallocated output of the rows reduction
+    :param output: preallocated output image
+    """
+    row_starts: np.ndarray
+    col_starts: np.ndarray
+    scale: np.ndarray
+    rows_output: np.ndarray
+    output: np.ndarray
+
+
+class Downsampler:
+    """
+    Reduces the visible part of the image to the display pixel grid,
+    so that the display backend does not need to resample pixels that
+    cannot be shown on the screen.
+
+    The reduction indices are computed once per (image shape, target shape)
+    and cached. The array returned by `reduce` is reused by the subsequent
+    calls.
+
+    :param mode: "mean" (area averaging) or "max" (max-preserving, e.g. for
+      the envelope peaks)
+    :param cache_size: maximum number of cached reduction plans
+    """
+    MODES = {
+        "mean": np.add,
+        "max": np.maximum
+    }
+
+    def __init__(self, mode="mean", cache_size=8):
+        if mode not in Downsampler.MODES:
+            raise ValueError(f"Unknown downsampling mode: {mode}, "
+                             f"available: {list(Downsampler.MODES)}")
+        self.mode = mode
+        self.ufunc = Downsampler.MODES[mode]
+        self.cache_size = cache_size
+        self._plans = {}
+
+    def reduce(self, data, region, target_shape):
+        """
+        Reduces the given region of the image to (at most) the target shape.
+        When the region already fits the target shape, a view of the input
+        data at full resolution is returned.
+
+        :param data: input image (OZ, OX)
+        :param region: visible region, ((row start, row end),
+          (column start, column end))
+        :param target_shape: the number of display pixels (height, width)
+        """
+        (r0, r1), (c0, c1) = region
+        view = data[r0:r1, c0:c1]
+        plan = self._get_plan(view.shape, tuple(target_shape), view.dtype)
+        if plan is None:
+            return view
+        if plan.row_starts is not None:
+            view = self.ufunc.reduceat(view, plan.row_starts, axis=0,
+                                       dtype=plan.output.dtype,
+                                       out=plan.rows_output)
+        if plan.col_starts is not None:
+            view = self.ufunc.reduceat(view, plan.col_starts, axis=1,
+                                       dtype=plan.output.dtype,
+                                       out=plan.output)
+        else:
+            plan.output[:] = view
+        if plan.scale is not None:
+            np.multiply(plan.output, plan.scale, out=plan.output)
+        return plan.output
+
+    def _get_plan(self, shape, target_shape, dtype):
+        key = (shape, target_shape, dtype.str)
+        if key in self._plans:
+            plan = self._plans.pop(key)
+        else:
+            plan = self._create_plan(shape, target_shape, dtype)
+            if len(self._plans) >= self.cache_size:
+                del self._plans[next(iter(self._plans))]
+        self._plans[key] = plan
+        return plan
+
+    def _create_plan(self, shape, target_shape, dtype):
+        n_rows, n_cols = shape
+        row_starts, row_counts = self._get_bins(n_rows, target_shape[0])
+        col_starts, col_counts = self._get_bins(n_cols, target_shape[1])
+        if row_starts is None and col_starts is None:
+            return None
+        if self.mode == "mean":
+            dtype = np.result_type(dtype, np.float32)
+            scale = (1.0/np.outer(row_counts, col_counts)).astype(dtype)
+        else:
+            scale = None
+        out_rows = n_rows if row_starts is None else len(row_starts)
+        out_cols = n_cols if col_starts is None else len(col_starts)
+        return _ReductionPlan(
+            row_starts=row_starts,
+            col_starts=col_starts,
+            scale=scale,
+            rows_output=np.zeros((out_rows, n_cols), dtype=dtype),
+            output=np.zeros((out_rows, out_cols), dtype=dtype))
+
+    def _get_bins(self, n, target_n):
+        """
+        Returns the first index and the size of each of the target_n
+        (almost) equal bins covering range [0, n); (None, ones) if no
+        reduction is needed.
+        """
+        if n <= target_n:
+            return None, np.ones(n)
+        starts = (np.arange(target_n)*n)//target_n
+        counts = np.diff(np.append(starts, n))
+        return starts, counts
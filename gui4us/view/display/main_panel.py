@@ -1,71 +1,92 @@
+import logging
 import time
 
 import numpy as np
 import datetime
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
-from PyQt5.QtWidgets import (
-    QPushButton,
-    QSlider,
-    QSpinBox,
-    QGroupBox,
-    QVBoxLayout,
-    QHBoxLayout,
-    QFormLayout,
-    QWidget,
-    QFileDialog,
-    QMessageBox,
-    QDoubleSpinBox
-)
 from matplotlib.backends.backend_qt5agg import (
     FigureCanvas, NavigationToolbar2QT as NavigationToolbar)
-from matplotlib.backends.qt_compat import QtCore, QtWidgets
-from matplotlib.animation import FuncAnimation
-import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
-import matplotlib
-matplotlib.use("tkagg")
 
+from gui4us.common import get_pixel_extent, get_pixel_range
 from gui4us.view.widgets import Panel
-from gui4us.view.common import *
+from gui4us.view.common import OutputBridge
+from gui4us.view.display.scan_conversion import ScanConverter
+from gui4us.view.display.lod import Downsampler
+from gui4us.view.display.mmode import MModeRenderer
+from gui4us.view.display.auto_range import StreamingQuantiles
+from gui4us.view.display.persistence import PersistenceFilter
 import gui4us.cfg
+from gui4us.metrics import REGISTRY
+from gui4us.tracing import TRACER
 from typing import Dict
 
+_LOGGER = logging.getLogger("gui4us.view")
+_FRAMES = REGISTRY.counter(
+    "gui4us_display_frames_total",
+    "Frames delivered to the display (including the skipped ones)")
+_UPDATES = REGISTRY.counter(
+    "gui4us_display_updates_total", "Display updates (rendered frames)")
+_UPDATE_TIME = REGISTRY.histogram(
+    "gui4us_display_update_seconds", "Display update processing time")
+_UPDATE_SPAN = TRACER.register("DisplayPanel.update")
+
 
 class DisplayPanel(Panel):
 
     def __init__(self, cfg: Dict[str, gui4us.cfg.Display2D], controller,
-                 parent_window, title="Display"):
+                 parent_window, image_metadata=None, title="Display",
+                 refresh_rate=60):
         super().__init__(title)
         # Validate configuration.
-        # TODO handle multiple displays
-        if len(cfg) > 1:
-            raise ValueError("Currently only a single display is supported")
-        _, self.cfg = list(cfg.items())[0]
+        # TODO handle multiple 2D displays
+        displays_2d = [d for d in cfg.values()
+                       if isinstance(d, gui4us.cfg.Display2D)]
+        m_mode_displays = [d for d in cfg.values()
+                           if isinstance(d, gui4us.cfg.MModeDisplay)]
+        if len(displays_2d) != 1:
+            raise ValueError("Currently exactly one 2D display is supported")
+        self.cfg = displays_2d[0]
         if len(self.cfg.layers) > 1:
             raise ValueError("Currently only a single layer of data is "
                              "supported.")
         self.layer_cfg = self.cfg.layers[0]
         self.controller = controller
-        image_metadata = self.controller.get_image_metadata(0).get_result()
+        if image_metadata is None:
+            image_metadata = self.controller.get_image_metadata(0)\
+                .get_result()
+        self.image_metadata = image_metadata
         self.figure = Figure(figsize=(6, 6))
         img_canvas = FigureCanvas(self.figure)
         self.layout.addWidget(img_canvas)
         self.layout.addWidget(NavigationToolbar(img_canvas, parent_window))
-        # Create a single Ax.
-        ax = img_canvas.figure.subplots()
+        # Create a single Ax for the 2D display, and one for each M-mode.
+        axes = img_canvas.figure.subplots(1, 1+len(m_mode_displays),
+                                          squeeze=False)[0]
+        ax = axes[0]
+        self.m_modes = [MModeRenderer(m_mode_ax, m_mode_cfg, image_metadata)
+                        for m_mode_ax, m_mode_cfg
+                        in zip(axes[1:], m_mode_displays)]
         # Ax parameters
         input_shape = image_metadata.shape
         dtype = image_metadata.dtype
+        extent_oz, extent_ox = image_metadata.extents
+        self.scan_converter = None
+        sc_cfg = self.layer_cfg.scan_conversion
+        if sc_cfg is not None:
+            self.scan_converter = ScanConverter.from_metadata(
+                image_metadata, sc_cfg)
+            input_shape = self.scan_converter.output_shape
+            extent_oz = (np.min(sc_cfg.z_grid), np.max(sc_cfg.z_grid))
+            extent_ox = (np.min(sc_cfg.x_grid), np.max(sc_cfg.x_grid))
         if self.layer_cfg.extent is not None:
             extent_oz, extent_ox = self.layer_cfg.extent
-        else:
-            extent_oz, extent_ox = image_metadata.extents
         if self.layer_cfg.ax_labels is not None:
             label_oz, label_ox = self.layer_cfg.ax_labels
         else:
             label_oz, label_ox = image_metadata.ids
         unit_oz, unit_ox = image_metadata.units
+        if self.scan_converter is not None:
+            unit_oz, unit_ox = "m", "m"
         ax_vmin, ax_vmax = None, None
         if self.layer_cfg.value_range is not None:
             ax_vmin, ax_vmax = self.layer_cfg.value_range
@@ -80,41 +101,194 @@ class DisplayPanel(Panel):
             extent=[extent_ox[0], extent_ox[1], extent_oz[1], extent_oz[0]])
         self.img_canvas.figure.tight_layout()
         self.figure.colorbar(self.img_canvas)
-        # View worker
+        # Level of detail: reduce the visible part of the image to the
+        # display pixel grid.
+        self.extents = (tuple(extent_oz), tuple(extent_ox))
+        self.image_shape = input_shape
+        self.downsampler = None
+        self.visible_region = None
+        self.target_shape = None
+        self.is_view_changed = True
+        if self.layer_cfg.downsampling is not None:
+            self.downsampler = Downsampler(self.layer_cfg.downsampling)
+            # The image extent will follow the visible region, the view
+            # limits should be changed by the user only.
+            ax.set_autoscale_on(False)
+            ax.callbacks.connect("xlim_changed", self._on_view_changed)
+            ax.callbacks.connect("ylim_changed", self._on_view_changed)
+            self.figure.canvas.mpl_connect("resize_event",
+                                           self._on_view_changed)
+        # Automatic value range.
+        self.auto_range = None
+        auto_range_cfg = self.layer_cfg.auto_range
+        if auto_range_cfg is not None:
+            self.auto_range = StreamingQuantiles(
+                quantiles=np.asarray(auto_range_cfg.percentiles)/100,
+                n_bins=auto_range_cfg.n_bins,
+                stride=auto_range_cfg.stride,
+                decay=auto_range_cfg.decay,
+                smoothing=auto_range_cfg.smoothing)
+        # Temporal filter.
+        self.persistence = None
+        persistence_cfg = self.layer_cfg.persistence
+        if persistence_cfg is not None:
+            floor = persistence_cfg.floor
+            if floor is None and self.layer_cfg.value_range is not None:
+                floor = self.layer_cfg.value_range[0]
+            self.persistence = PersistenceFilter(
+                mode=persistence_cfg.mode,
+                alpha=persistence_cfg.alpha,
+                n_frames=persistence_cfg.n_frames,
+                decay=persistence_cfg.decay,
+                floor=floor)
+        # Raw frame and cursor observers (e.g. measurements).
+        self.on_frame_callbacks = []
+        self.on_cursor_callbacks = []
+        self.figure.canvas.mpl_connect("motion_notify_event",
+                                       self._on_mouse_move)
+        # Input: the frames are delivered on the GUI thread, at most
+        # refresh_rate times per second. M-modes need every frame, the 2D
+        # display only the most recent one.
         self.is_started = False  # TODO state_graph
         self.input = self.controller.get_output("out_0")
-        self.i = 0
+        max_batch_size = max([m.n_lines for m in self.m_modes], default=1)
+        self.bridge = OutputBridge(self.input, min_interval=1/refresh_rate,
+                                   coalesce=False,
+                                   max_batch_size=max_batch_size)
+        self.bridge.connect(self.update)
         self.ax = ax
 
     def start(self):
         self.is_started = True
-        self.anim = FuncAnimation(self.figure, self.update, interval=0.01,
-                                  blit=True)
-        plt.show()
+        self.bridge.start()
 
     def stop(self):
         self.is_started = False
-        self.anim.pause()
 
     def close(self):
         self.stop()
+        self.bridge.stop()
 
-    def update(self, ev):
+    def update(self, frames):
+        start = time.perf_counter()
+        span_start = TRACER.begin()
         try:
             if self.is_started:
-                data = self.input.get()  # Data index
-                if data is None or not self.is_started:
+                if frames[0] is None:
                     # None means that the buffer has stopped
-                    # Just discard results if the current device now is stopped
-                    # (e.g. when the save button was pressed).
                     return
+                _FRAMES.inc(len(frames))
+                for m_mode in self.m_modes:
+                    for frame in frames:
+                        if frame is not None:
+                            m_mode.write(frame)
+                    m_mode.render()
+                data = frames[-1]
+                if data is None:
+                    return
+                for callback in self.on_frame_callbacks:
+                    callback(data)
+                if self.downsampler is not None and self.is_view_changed:
+                    self._update_visible_region()
+                if self.persistence is not None:
+                    # Every frame of the batch is filtered, so the filter
+                    # time constant does not depend on the display rate.
+                    for frame in frames:
+                        if frame is not None:
+                            data = self.persistence.process(frame)
+                if self.scan_converter is not None:
+                    data = self.scan_converter.convert(data)
+                if self.auto_range is not None:
+                    value_range = self.auto_range.update(data)
+                    if value_range is not None:
+                        self.img_canvas.set_clim(*value_range)
+                if self.scan_converter is None and self.downsampler is not None:
+                    data = self.downsampler.reduce(
+                        data, self.visible_region, self.target_shape)
                 self.img_canvas.set_data(data)
-                self.img_canvas.figure.canvas.draw()
                 self.ax.set_title(f"{self.cfg.title}")
-        except Exception as e:
+                self.figure.canvas.draw_idle()
+                _UPDATES.inc()
+                _UPDATE_TIME.observe(time.perf_counter()-start)
+        except Exception:
             # TODO notify that there was an error while drawing
-            print(e)
-        return self.img_canvas,
+            _LOGGER.exception("Error while updating the display")
+        finally:
+            TRACER.end(_UPDATE_SPAN, span_start)
+
+    def add_on_frame_callback(self, callback):
+        """
+        Registers callback(frame), called with each displayed input frame
+        (before any display-side processing).
+        """
+        self.on_frame_callbacks.append(callback)
+
+    def add_on_cursor_callback(self, callback):
+        """
+        Registers callback(column), called with the input image column under
+        the cursor.
+        """
+        self.on_cursor_callbacks.append(callback)
+
+    def _on_mouse_move(self, event):
+        if event.inaxes is not self.ax or len(self.on_cursor_callbacks) == 0:
+            return
+        if self.scan_converter is not None:
+            column = self.scan_converter.get_beam(event.ydata, event.xdata)
+            if column is None:
+                return
+        else:
+            ox_min, ox_max = self.extents[1]
+            n_columns = self.image_metadata.shape[1]
+            column = int((event.xdata-ox_min)/(ox_max-ox_min)*n_columns)
+            column = int(np.clip(column, 0, n_columns-1))
+        for callback in self.on_cursor_callbacks:
+            callback(column)
+
+    def reset_filters(self):
+        """
+        Resets the temporal filters, e.g. after the acquisition settings
+        have changed.
+        """
+        if self.persistence is not None:
+            self.persistence.reset()
+
+    def _on_view_changed(self, *args):
+        self.is_view_changed = True
+
+    def _update_visible_region(self):
+        """
+        Determines the part of the image visible in the current zoom/pan
+        rectangle and the number of display pixels available for it.
+        """
+        self.is_view_changed = False
+        bbox = self.ax.get_window_extent()
+        self.target_shape = (max(int(round(bbox.height)), 1),
+                             max(int(round(bbox.width)), 1))
+        oz_lim = sorted(self.ax.get_ylim())
+        ox_lim = sorted(self.ax.get_xlim())
+        rows, extent_oz = self._get_visible_range(
+            oz_lim, self.extents[0], self.image_shape[0])
+        cols, extent_ox = self._get_visible_range(
+            ox_lim, self.extents[1], self.image_shape[1])
+        if self.scan_converter is not None:
+            # Re-grid the visible part of the sector on the display pixels.
+            n_rows, n_cols = self.target_shape
+            self.scan_converter.set_output_grid(
+                np.linspace(*extent_oz, n_rows),
+                np.linspace(*extent_ox, n_cols))
+        self.visible_region = (rows, cols)
+        self.img_canvas.set_extent(
+            [extent_ox[0], extent_ox[1], extent_oz[1], extent_oz[0]])
+
+    def _get_visible_range(self, lim, extent, n):
+        """
+        Returns the range of indices [start, end) of the image pixels
+        visible within the given axis limits, and the extent of
+        these pixels.
+        """
+        pixels = get_pixel_range(lim, extent, n)
+        return pixels, get_pixel_extent(pixels, extent, n)
 
     def get_ax_label(self, label, unit):
         label = f"{label}"
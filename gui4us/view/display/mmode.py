@@ -0,0 +1,93 @@
+import numpy as np
+
+import gui4us.cfg
+from gui4us.common import ImageMetadata
+
+
+class MModeRenderer:
+    """
+    Renders M-mode (time vs depth) image of a single line of the input
+    frames.
+
+    Each new line is written into a preallocated circular buffer;
+    the buffer is never shifted or reallocated. In the "scroll" mode the
+    buffer is rendered as two images (the oldest and the newest part),
+    placed at the offset determined by the current write position.
+
+    :param ax: matplotlib axes to render on
+    :param cfg: M-mode display configuration
+    :param image_metadata: metadata of the input frames
+    """
+
+    def __init__(self, ax, cfg: gui4us.cfg.MModeDisplay,
+                 image_metadata: ImageMetadata):
+        if cfg.mode not in {"scroll", "sweep"}:
+            raise ValueError(f"Unknown M-mode display mode: {cfg.mode}")
+        self.cfg = cfg
+        self.ax = ax
+        if isinstance(cfg.line, int):
+            self.columns = slice(cfg.line, cfg.line+1)
+        else:
+            self.columns = slice(*cfg.line)
+        depth = image_metadata.shape[0]
+        self.n_lines = cfg.n_lines
+        # Ring buffer: (line number, depth), so that each new line is
+        # a contiguous write.
+        self.ring = np.zeros((self.n_lines, depth),
+                             dtype=image_metadata.dtype)
+        self.position = 0
+        self.extent_oz = image_metadata.extents[0]
+        vmin, vmax = None, None
+        if cfg.value_range is not None:
+            vmin, vmax = cfg.value_range
+        params = dict(cmap=cfg.cmap, vmin=vmin, vmax=vmax, aspect="auto")
+        oz_min, oz_max = self.extent_oz
+        if cfg.mode == "scroll":
+            self.images = (
+                ax.imshow(self.ring.T, extent=self._get_extent(-1, 0),
+                          **params),
+                ax.imshow(self.ring.T, extent=self._get_extent(-1, 0),
+                          **params)
+            )
+            ax.set_xlim(-self.n_lines, 0)
+            self.cursor = None
+        else:
+            self.images = (
+                ax.imshow(self.ring.T,
+                          extent=self._get_extent(0, self.n_lines),
+                          **params),
+            )
+            self.cursor = ax.axvline(0, color="red")
+        ax.set_ylim(oz_max, oz_min)
+        ax.set_title(cfg.title)
+        ax.set_xlabel("Line")
+
+    def write(self, frame):
+        """
+        Writes a line of the new frame into the ring buffer.
+        """
+        np.mean(frame[:, self.columns], axis=1, out=self.ring[self.position])
+        self.position = (self.position+1) % self.n_lines
+
+    def render(self):
+        """
+        Updates the rendered images, returns the modified artists.
+        """
+        p = self.position
+        if self.cursor is not None:
+            self.images[0].set_data(self.ring.T)
+            self.cursor.set_xdata([p, p])
+            return self.images[0], self.cursor
+        oldest, newest = self.images
+        oldest.set_data(self.ring[p:].T)
+        oldest.set_extent(self._get_extent(-self.n_lines, -p))
+        # The newest part is empty right after the ring buffer wraps.
+        newest.set_visible(p > 0)
+        if p > 0:
+            newest.set_data(self.ring[:p].T)
+            newest.set_extent(self._get_extent(-p, 0))
+        return oldest, newest
+
+    def _get_extent(self, start, end):
+        oz_min, oz_max = self.extent_oz
+        return [start, end, oz_max, oz_min]
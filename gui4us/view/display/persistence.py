@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class PersistenceFilter:
+    """
+    Display-only temporal filter of the incoming frames.
+
+    Available modes:
+
+    - "ema": exponential moving average, new frame weight: alpha,
+    - "boxcar": mean of the last n_frames frames (running sum),
+    - "peak_hold": maximum of the frames, the held values decay towards
+      the floor on each new frame: floor + decay*(held-floor), so that
+      signed and log-scaled data decay in the same way as the
+      non-negative ones.
+
+    The accumulators are allocated once and updated in place. The filter is
+    reset automatically when the frame shape or data type changes; call
+    `reset` e.g. after changing the acquisition settings.
+    The array returned by `process` is reused by the subsequent calls.
+
+    :param mode: filter mode, "ema", "boxcar" or "peak_hold"
+    :param alpha: weight of the new frame in the "ema" mode
+    :param n_frames: the number of averaged frames in the "boxcar" mode
+    :param decay: decay factor in the "peak_hold" mode
+    :param floor: value the held values decay to in the "peak_hold" mode
+      (e.g. the minimum of the displayed value range); None: the minimum
+      of the frames processed since the last reset
+    """
+    MODES = {"ema", "boxcar", "peak_hold"}
+
+    def __init__(self, mode="ema", alpha=0.3, n_frames=4, decay=0.95,
+                 floor=None):
+        if mode not in PersistenceFilter.MODES:
+            raise ValueError(f"Unknown persistence mode: {mode}, "
+                             f"available: {PersistenceFilter.MODES}")
+        self.mode = mode
+        self.alpha = alpha
+        self.n_frames = n_frames
+        self.decay = decay
+        self.floor = floor
+        self._key = None
+
+    def reset(self):
+        self._key = None
+
+    def process(self, frame):
+        key = (frame.shape, frame.dtype.str)
+        if key != self._key:
+            self._allocate(frame)
+            self._key = key
+            return self._output
+        if self.mode == "ema":
+            # acc = (1-alpha)*acc + alpha*frame
+            np.multiply(frame, self.alpha, out=self._buffer)
+            np.multiply(self._output, 1-self.alpha, out=self._output)
+            np.add(self._output, self._buffer, out=self._output)
+        elif self.mode == "boxcar":
+            ring = self._ring[self._position]
+            np.subtract(self._sum, ring, out=self._sum)
+            ring[:] = frame
+            np.add(self._sum, ring, out=self._sum)
+            self._position = (self._position+1) % self.n_frames
+            self._n_filled = min(self._n_filled+1, self.n_frames)
+            np.multiply(self._sum, 1.0/self._n_filled, out=self._output)
+        else:
+            floor = self.floor
+            if floor is None:
+                self._min = min(self._min, np.min(frame))
+                floor = self._min
+            # held = floor + decay*(held-floor)
+            np.subtract(self._output, floor, out=self._output)
+            np.multiply(self._output, self.decay, out=self._output)
+            np.add(self._output, floor, out=self._output)
+            np.maximum(self._output, frame, out=self._output)
+        return self._output
+
+    def _allocate(self, frame):
+        dtype = np.result_type(frame.dtype, np.float32)
+        self._output = np.array(frame, dtype=dtype)
+        if self.mode == "ema":
+            self._buffer = np.zeros(frame.shape, dtype=dtype)
+        elif self.mode == "boxcar":
+            self._ring = np.zeros((self.n_frames, ) + frame.shape,
+                                  dtype=dtype)
+            self._ring[0] = frame
+            # Running sum in double precision to limit the accumulation
+            # of rounding errors.
+            self._sum = np.array(frame, dtype=np.float64)
+            self._position = 1 % self.n_frames
+            self._n_filled = 1
+        elif self.floor is None:
+            self._min = np.min(self._output)
@@ -0,0 +1,171 @@
+import numpy as np
+from dataclasses import dataclass
+
+import gui4us.cfg
+from gui4us.common import ImageMetadata
+
+
+@dataclass(frozen=True)
+class _IndexMap:
+    """
+    Precomputed pixel -> (sample, beam) mapping for a single output grid.
+
+    :param indices: flat input indices of the 4 bilinear neighbours,
+      shape (4, number of output pixels)
+    :param weights: bilinear weights, shape (4, number of output pixels)
+    :param outside: flat indices of the output pixels outside the sector
+    :param gathered: preallocated buffer for the gathered input values
+    :param output: preallocated output image
+    """
+    indices: np.ndarray
+    weights: np.ndarray
+    outside: np.ndarray
+    gathered: np.ndarray
+    output: np.ndarray
+
+
+class ScanConverter:
+    """
+    Converts images in the beam coordinates (sample, beam) to the
+    cartesian grid (OZ, OX), using bilinear interpolation.
+
+    The pixel -> (sample, beam) index map is computed once per output grid
+    and cached, so converting a single frame is a single gather and
+    weighted sum into a preallocated output array. The array returned by
+    `convert` is reused by the subsequent calls.
+
+    :param input_shape: input image shape (number of samples, number of beams)
+    :param angles: beam angles [rad], measured from the OZ axis, one per beam
+    :param radii: distance of each beam sample from the apex [m]
+    :param apex: position of the beams apex (oz, ox) [m]
+    :param fill_value: value of the output pixels outside the scanned sector
+    :param dtype: output data type
+    :param cache_size: maximum number of cached index maps
+    """
+
+    def __init__(self, input_shape, angles, radii, apex=(0.0, 0.0),
+                 fill_value=0.0, dtype="float32", cache_size=8):
+        n_samples, n_beams = input_shape
+        self.angles = np.asarray(angles, dtype=np.float64)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        if len(self.angles) != n_beams or len(self.radii) != n_samples:
+            raise ValueError(
+                f"Beam geometry ({len(self.radii)} samples, "
+                f"{len(self.angles)} beams) does not match the input shape "
+                f"{input_shape}")
+        if n_beams < 2 or n_samples < 2:
+            raise ValueError("Scan conversion requires at least two beams "
+                             "and two samples per beam.")
+        self.input_shape = tuple(input_shape)
+        self.apex = apex
+        self.fill_value = fill_value
+        self.dtype = np.dtype(dtype)
+        self.cache_size = cache_size
+        self._maps = {}
+        self._current = None
+
+    @staticmethod
+    def from_metadata(metadata: ImageMetadata,
+                      cfg: gui4us.cfg.ScanConversion):
+        """
+        Creates scan converter for the given input image metadata.
+        If the cfg does not provide radii, the samples are assumed to be
+        uniformly distributed over the OZ extent of the input image.
+        """
+        radii = cfg.radii
+        if radii is None:
+            (r_min, r_max), _ = metadata.extents
+            radii = np.linspace(r_min, r_max, metadata.shape[0])
+        # Interpolated values of the integer images are not integers.
+        dtype = np.result_type(metadata.dtype, np.float32)
+        converter = ScanConverter(
+            input_shape=metadata.shape, angles=cfg.angles, radii=radii,
+            apex=cfg.apex, fill_value=cfg.fill_value, dtype=dtype)
+        converter.set_output_grid(cfg.z_grid, cfg.x_grid)
+        return converter
+
+    @property
+    def output_shape(self):
+        return self._current.output.shape
+
+    def set_output_grid(self, z_grid, x_grid):
+        """
+        Sets the output (OZ, OX) grid. The index map for the given grid
+        is reused when it is available in the cache.
+        """
+        z_grid = np.asarray(z_grid, dtype=np.float64)
+        x_grid = np.asarray(x_grid, dtype=np.float64)
+        key = (z_grid[0], z_grid[-1], len(z_grid),
+               x_grid[0], x_grid[-1], len(x_grid))
+        index_map = self._maps.pop(key, None)
+        if index_map is None:
+            index_map = self._compute_index_map(z_grid, x_grid)
+            if len(self._maps) >= self.cache_size:
+                # Drop the least recently used map.
+                del self._maps[next(iter(self._maps))]
+        self._maps[key] = index_map
+        self._current = index_map
+
+    def convert(self, frame):
+        """
+        Converts the given (sample, beam) frame to the current output grid.
+        """
+        index_map = self._current
+        frame = np.asarray(frame, dtype=self.dtype)
+        np.take(frame, index_map.indices, out=index_map.gathered, mode="clip")
+        np.multiply(index_map.gathered, index_map.weights,
+                    out=index_map.gathered)
+        output = index_map.output.reshape(-1)
+        np.sum(index_map.gathered, axis=0, out=output)
+        output[index_map.outside] = self.fill_value
+        return index_map.output
+
+    def get_beam(self, oz, ox):
+        """
+        Returns the number of the beam closest to the given point, None if
+        the point is outside the scanned sector.
+        """
+        apex_z, apex_x = self.apex
+        beam = self._get_fractional_index(
+            np.atleast_1d(np.arctan2(ox-apex_x, oz-apex_z)), self.angles)[0]
+        if np.isnan(beam):
+            return None
+        return int(round(beam))
+
+    def _compute_index_map(self, z_grid, x_grid):
+        n_samples, n_beams = self.input_shape
+        apex_z, apex_x = self.apex
+        zz, xx = np.meshgrid(z_grid-apex_z, x_grid-apex_x, indexing="ij")
+        beam = self._get_fractional_index(np.arctan2(xx, zz).ravel(),
+                                          self.angles)
+        sample = self._get_fractional_index(np.hypot(zz, xx).ravel(),
+                                            self.radii)
+        is_outside = np.isnan(beam) | np.isnan(sample)
+        beam[is_outside] = 0
+        sample[is_outside] = 0
+        b0 = np.minimum(np.floor(beam).astype(np.intp), n_beams-2)
+        s0 = np.minimum(np.floor(sample).astype(np.intp), n_samples-2)
+        wb = beam-b0
+        ws = sample-s0
+        i0 = s0*n_beams+b0
+        indices = np.stack((i0, i0+1, i0+n_beams, i0+n_beams+1))
+        weights = np.stack(((1-ws)*(1-wb), (1-ws)*wb, ws*(1-wb), ws*wb))
+        weights[:, is_outside] = 0
+        weights = weights.astype(self.dtype)
+        output_shape = (len(z_grid), len(x_grid))
+        return _IndexMap(
+            indices=indices,
+            weights=weights,
+            outside=np.flatnonzero(is_outside),
+            gathered=np.zeros(weights.shape, dtype=self.dtype),
+            output=np.zeros(output_shape, dtype=self.dtype))
+
+    def _get_fractional_index(self, values, grid):
+        """
+        Returns (fractional) position of the values on the given monotonic
+        grid, NaN for the values outside the grid.
+        """
+        positions = np.arange(len(grid), dtype=np.float64)
+        if grid[0] > grid[-1]:
+            grid, positions = grid[::-1], positions[::-1]
+        return np.interp(values, grid, positions, left=np.nan, right=np.nan)
@@ -0,0 +1,284 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from matplotlib.backends.backend_qt5agg import FigureCanvas
+from matplotlib.figure import Figure
+from PyQt5.QtCore import QTimer
+
+import gui4us.cfg
+from gui4us.common import ImageMetadata, get_pixel_range
+from gui4us.view.widgets import Label, Panel
+from gui4us.tracing import TRACER
+
+# Columns of the measurements log, for each ROI.
+_LOG_COLUMNS = ("mean", "max", "max_oz", "max_ox", "snr")
+_EVALUATE_SPAN = TRACER.register("MeasurementEngine.evaluate")
+
+
+@dataclass(frozen=True)
+class RoiStatistics:
+    """
+    :param name: ROI name
+    :param mean: mean value
+    :param max: maximum value
+    :param max_position: position (oz, ox) of the maximum value
+    :param snr: peak signal to noise ratio [dB]: 20*log10(max/std), where
+      std is the standard deviation of the ROI values
+    """
+    name: str
+    mean: float
+    max: float
+    max_position: tuple
+    snr: float
+
+
+@dataclass(frozen=True)
+class Measurements:
+    """
+    :param timestamp: time of the measurement (time.time())
+    :param a_scan: values of the selected image line, None if no line
+      was selected
+    :param rois: statistics of each ROI
+    """
+    timestamp: float
+    a_scan: np.ndarray
+    rois: tuple
+
+
+class MeasurementEngine:
+    """
+    Evaluates the A-scan line and ROI statistics on a worker thread.
+
+    Each ROI is converted once to the flat indices of the image pixels;
+    all ROIs are then evaluated with a single gather and segmented
+    reductions. Only the most recently submitted frame is evaluated,
+    the older ones are dropped.
+
+    :param image_metadata: metadata of the input frames
+    """
+
+    def __init__(self, image_metadata: ImageMetadata):
+        self.shape = tuple(image_metadata.shape)
+        self.extents = image_metadata.extents
+        self.dtype = image_metadata.dtype
+        self.rois = []
+        self._indices = np.zeros(0, dtype=np.intp)
+        self._starts = np.zeros(0, dtype=np.intp)
+        self._counts = np.zeros(0, dtype=np.intp)
+        self._line = None
+        # Double buffering: the submitted frame is copied, as the producer
+        # may reuse its memory.
+        self._frames = [np.zeros(self.shape, dtype=self.dtype),
+                        np.zeros(self.shape, dtype=self.dtype)]
+        self._is_new_frame = False
+        self._results = None
+        self._log = None
+        self._is_logging = False
+        self._is_closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_roi(self, roi: gui4us.cfg.Roi):
+        rows = get_pixel_range(roi.oz_range, self.extents[0], self.shape[0])
+        cols = get_pixel_range(roi.ox_range, self.extents[1], self.shape[1])
+        rr, cc = np.meshgrid(np.arange(*rows), np.arange(*cols),
+                             indexing="ij")
+        indices = np.ravel_multi_index((rr.ravel(), cc.ravel()), self.shape)
+        with self._condition:
+            self.rois.append(roi)
+            self._starts = np.append(self._starts, len(self._indices))
+            self._counts = np.append(self._counts, len(indices))
+            self._indices = np.concatenate((self._indices, indices))
+
+    def set_line(self, column):
+        """
+        Sets the image column displayed as the A-scan, None to disable.
+        """
+        with self._condition:
+            self._line = column
+
+    def submit(self, frame):
+        with self._condition:
+            np.copyto(self._frames[0], frame, casting="unsafe")
+            self._is_new_frame = True
+            self._condition.notify()
+
+    def get_results(self) -> Measurements:
+        """
+        Returns the most recent measurements, None if not available yet.
+        """
+        with self._condition:
+            return self._results
+
+    def start_log(self):
+        """
+        Starts logging a new ROI statistics time series.
+
+        Only the evaluated frames are logged: the frames submitted by the
+        display (at most its refresh rate), minus the frames dropped while
+        the engine was busy. The time series is therefore a subsampling
+        of the captured frames, with the timestamps of the evaluation.
+        """
+        with self._condition:
+            self._log = []
+            self._is_logging = True
+
+    def stop_log(self):
+        with self._condition:
+            self._is_logging = False
+
+    def save_log(self, path):
+        """
+        Saves the logged ROI statistics time series to the given CSV file.
+        """
+        self.stop_log()
+        with self._condition:
+            log = self._log
+        if log is None or len(log) == 0:
+            return
+        header = ["time"] + [f"{roi.name}.{column}" for roi in self.rois
+                             for column in _LOG_COLUMNS]
+        np.savetxt(path, np.asarray(log), delimiter=",",
+                   header=",".join(header), comments="")
+
+    def close(self):
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._is_new_frame and not self._is_closed:
+                    self._condition.wait()
+                if self._is_closed:
+                    return
+                self._frames.reverse()
+                self._is_new_frame = False
+                frame = self._frames[1]
+                line = self._line
+                indices, starts, counts = \
+                    self._indices, self._starts, self._counts
+                rois = tuple(self.rois)
+            start = TRACER.begin()
+            a_scan = None
+            if line is not None:
+                a_scan = frame[:, line].copy()
+            statistics = self._evaluate(frame, rois, indices, starts, counts)
+            TRACER.end(_EVALUATE_SPAN, start)
+            results = Measurements(timestamp=time.time(), a_scan=a_scan,
+                                   rois=statistics)
+            with self._condition:
+                self._results = results
+                if self._is_logging:
+                    self._log.append(self._to_log_row(results))
+
+    def _evaluate(self, frame, rois, indices, starts, counts):
+        if len(rois) == 0:
+            return ()
+        values = np.take(frame, indices).astype(np.float64)
+        sums = np.add.reduceat(values, starts)
+        sums_sq = np.add.reduceat(values*values, starts)
+        # NaN values are ignored, the maximum is NaN only if all the ROI
+        # values are NaN.
+        maxima = np.fmax.reduceat(values, starts)
+        means = sums/counts
+        stds = np.sqrt(np.maximum(sums_sq/counts-means*means, 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            snrs = 20*np.log10(np.abs(maxima)/stds)
+        # The first position of the maximum of each ROI; len(values) is
+        # a sentinel for the ROIs without the maximum (all values NaN).
+        is_max = values == np.repeat(maxima, counts)
+        max_positions = np.append(np.flatnonzero(is_max), len(values))
+        positions = max_positions[np.searchsorted(max_positions, starts)]
+        is_found = positions < starts+counts
+        positions = np.minimum(positions, len(values)-1)
+        rows, cols = np.unravel_index(indices[positions], self.shape)
+        oz = np.where(is_found, self._get_coordinates(
+            rows, self.extents[0], self.shape[0]), np.nan)
+        ox = np.where(is_found, self._get_coordinates(
+            cols, self.extents[1], self.shape[1]), np.nan)
+        return tuple(
+            RoiStatistics(name=roi.name, mean=means[i], max=maxima[i],
+                          max_position=(oz[i], ox[i]), snr=snrs[i])
+            for i, roi in enumerate(rois))
+
+    def _to_log_row(self, results):
+        row = [results.timestamp]
+        for s in results.rois:
+            row.extend((s.mean, s.max, s.max_position[0], s.max_position[1],
+                        s.snr))
+        return row
+
+    def _get_coordinates(self, indices, extent, n):
+        start, end = extent
+        return start+(indices+0.5)*(end-start)/n
+
+
+class MeasurementPanel(Panel):
+    """
+    Displays the A-scan under the cursor and the ROI statistics.
+    The widgets are refreshed at the given interval, independently of the
+    frame rate.
+
+    :param cfg: measurements configuration
+    :param image_metadata: metadata of the measured output
+    """
+
+    def __init__(self, cfg: gui4us.cfg.MeasurementsCfg,
+                 image_metadata: ImageMetadata, title="Measurements"):
+        super().__init__(title)
+        self.cfg = cfg
+        self.engine = MeasurementEngine(image_metadata)
+        for roi in cfg.rois:
+            self.engine.add_roi(roi)
+        self.a_scan_line = None
+        if cfg.a_scan:
+            figure = Figure(figsize=(4, 2))
+            self.layout.addWidget(FigureCanvas(figure))
+            ax = figure.subplots()
+            oz_min, oz_max = image_metadata.extents[0]
+            depth = np.linspace(oz_min, oz_max, image_metadata.shape[0])
+            self.a_scan_line, = ax.plot(depth, np.zeros_like(depth))
+            ax.set_title("A-scan")
+            figure.tight_layout()
+        self.roi_labels = []
+        for roi in cfg.rois:
+            label = Label(f"{roi.name}: -")
+            self.add_component(label)
+            self.roi_labels.append(label)
+        self.last_timestamp = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update)
+        self.timer.start(int(cfg.update_interval*1000))
+
+    def submit(self, frame):
+        self.engine.submit(frame)
+
+    def set_cursor_line(self, column):
+        self.engine.set_line(column)
+
+    def close(self):
+        self.timer.stop()
+        self.engine.close()
+
+    def update(self):
+        results = self.engine.get_results()
+        if results is None or results.timestamp == self.last_timestamp:
+            return
+        self.last_timestamp = results.timestamp
+        if self.a_scan_line is not None and results.a_scan is not None:
+            self.a_scan_line.set_ydata(results.a_scan)
+            ax = self.a_scan_line.axes
+            ax.relim()
+            ax.autoscale_view()
+            ax.figure.canvas.draw_idle()
+        for label, s in zip(self.roi_labels, results.rois):
+            label.set_text(
+                f"{s.name}: mean {s.mean:.2f}, max {s.max:.2f} at "
+                f"({s.max_position[0]:.4g}, {s.max_position[1]:.4g}), "
+                f"SNR {s.snr:.1f} dB")
@@ -1,6 +1,14 @@
 import gui4us.view.widgets as widgets
-from gui4us.view.widgets import *
-from gui4us.settings import *
+from gui4us.view.widgets import (
+    CurveEditor,
+    Form,
+    FormField,
+    Panel,
+    Slider,
+    SpinBox,
+    WidgetSequence
+)
+from gui4us.settings import ContinuousRange, Setting, SettingPresentation
 
 
 class SettingsPanel(Panel):
@@ -14,6 +22,7 @@ class SettingsPanel(Panel):
         self.title = title
         self.settings = settings
         self.custom_presentation = custom_presentation
+        self.on_change_callbacks = []
 
         # Init layout
         self.main_form = Form(self.layout)
@@ -58,6 +67,9 @@ class SettingsPanel(Panel):
                 widget_type = Slider
         if is_scalar:
             widget = widget_type(**params)
+        elif is_vector and presentation is None:
+            # A single curve editor, regardless of the number of points.
+            widget = CurveEditor(labels=setting.label, **params)
         elif is_vector:
             widget = WidgetSequence(self.layout,
                                     widget_type, setting.label, **params)
@@ -67,10 +79,18 @@ class SettingsPanel(Panel):
 
         def setter(value):
             self.controller.set_setting(setting.id, [value])
+            for callback in self.on_change_callbacks:
+                callback(setting.id, value)
 
         widget.set_on_change(setter)
         return widget
 
+    def add_on_change_callback(self, callback):
+        """
+        Registers callback(setting_id, value) called after a setting changes.
+        """
+        self.on_change_callbacks.append(callback)
+
 
 
 
@@ -1,43 +1,148 @@
+import datetime
+import logging
+import os
 import sys
+import time
 
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QApplication, QHBoxLayout, QShortcut, QWidget
 from PyQt5 import QtWidgets
 
-from gui4us.controller.controller import *
-from gui4us.view.control import *
-from gui4us.view.display import *
-from gui4us.state_graph import *
+from gui4us.controller.controller import Controller
+from gui4us.view.control import ControlPanel
+from gui4us.view.display import DisplayPanel
+from gui4us.view.cine import CinePanel
+from gui4us.view.measurements import MeasurementPanel
+from gui4us.view.common import OutputBridge, when_ready
+from gui4us.view.widgets import show_error_message
+from gui4us.profiling import NULL_PROFILER
+from gui4us.tracing import TRACER
+from gui4us.state_graph import (
+    Action,
+    State,
+    StateGraph,
+    StateGraphIterator,
+    Transition
+)
 
 APP = None
+_LOGGER = logging.getLogger("gui4us.view")
 
 
-def start_view(*args):
+def start_view(title, cfg, controller, profiler=NULL_PROFILER):
     global APP
-    APP = QApplication(sys.argv)
-    APP.setStyle("Fusion")
-    view = View(*args)
-    view.show()
+    with profiler.phase("ui build"):
+        APP = QApplication(sys.argv)
+        APP.setStyle("Fusion")
+        view = View(title, cfg, controller, profiler=profiler)
+        view.show()
     return APP.exec_()
 
 
 class View(QtWidgets.QMainWindow):
 
-    def __init__(self, title, cfg, controller: Controller):
+    def __init__(self, title, cfg, controller: Controller,
+                 profiler=NULL_PROFILER):
         super().__init__()
         self.controller = controller
+        self.cfg = cfg
+        self.profiler = profiler
         self.text_format = Qt.MarkdownText
-        self.statusBar().showMessage('Configuring...')
+        self.setWindowTitle(title)
+        # Main layout
+        self.main_widget = QWidget()
+        self.setCentralWidget(self.main_widget)
+        self.main_layout = QHBoxLayout(self.main_widget)
+        self.control_panel = None
+        self.display_panel = None
+        self.measurement_panel = None
+        self.cine_panel = None
+        self.overload_bridge = None
+        self.overload_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.overload_label)
+        # The model may still be initializing (session creation, sequence
+        # upload) on the controller thread; the panels are created when the
+        # settings and the image metadata are available.
+        # Runtime tracing switch.
+        self.trace_shortcut = QShortcut(QKeySequence("Ctrl+Shift+T"), self)
+        self.trace_shortcut.activated.connect(self.__toggle_tracing)
+        self.init_results = {}
+        self.init_start_time = time.monotonic()
+        self.init_timer = QTimer()
+        self.init_timer.timeout.connect(self.__show_init_progress)
+        self.init_timer.start(250)
+        self.__show_init_progress()
+        when_ready(controller.get_settings(),
+                   lambda value: self.__on_init_result("settings", value),
+                   self.__on_init_error)
+        when_ready(controller.get_image_metadata(0),
+                   lambda value: self.__on_init_result("image_metadata",
+                                                       value),
+                   self.__on_init_error)
+        when_ready(controller.get_work_mode(),
+                   lambda value: self.__on_init_result("work_mode", value),
+                   self.__on_init_error)
+        self.showMaximized()
+
+    def __toggle_tracing(self):
+        if not TRACER.enabled:
+            TRACER.clear()
+            TRACER.enable()
+            self.statusBar().showMessage(
+                "Tracing, press Ctrl+Shift+T to stop.")
+            return
+        TRACER.disable()
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.abspath(f"gui4us_trace_{timestamp}.json")
+        TRACER.export_chrome_trace(path)
+        self.statusBar().showMessage(f"Trace saved to {path}")
+
+    def __show_init_progress(self):
+        elapsed = time.monotonic()-self.init_start_time
+        self.statusBar().showMessage(
+            f"Initializing the hardware ({elapsed:.0f} s)...")
+
+    def __on_init_result(self, key, value):
+        self.init_results[key] = value
+        if len(self.init_results) == 3:
+            self.init_timer.stop()
+            with self.profiler.phase("ui panels"):
+                self.__create_panels(**self.init_results)
+            # The model is ready: all the startup phases are completed.
+            self.__print_startup_report()
+
+    def __on_init_error(self, error):
+        if not self.init_timer.isActive():
+            # Already reported.
+            return
+        self.init_timer.stop()
+        self.__print_startup_report()
+        self.statusBar().showMessage("Initialization failed.")
+        show_error_message(f"Initialization failed: {error}")
+
+    def __print_startup_report(self):
+        if self.profiler.enabled:
+            print(self.profiler.report())
+
+    def __create_panels(self, settings, image_metadata, work_mode):
+        cfg, controller = self.cfg, self.controller
+        self.statusBar().showMessage("Configuring...")
         try:
-            self.setWindowTitle(title)
-            # Main layout
-            self.main_widget = QWidget()
-            self.setCentralWidget(self.main_widget)
-            self.main_layout = QHBoxLayout(self.main_widget)
-            self.control_panel = ControlPanel(controller)
-            self.display_panel = DisplayPanel(cfg.displays, controller, self)
+            self.control_panel = ControlPanel(controller, settings=settings,
+                                              work_mode=work_mode)
+            self.display_panel = DisplayPanel(cfg.displays, controller, self,
+                                              image_metadata=image_metadata)
 
             self.main_layout.addWidget(self.control_panel.backend_widget)
             self.main_layout.addWidget(self.display_panel.backend_widget)
+            self.measurement_panel = None
+            if cfg.measurements is not None:
+                self.measurement_panel = MeasurementPanel(
+                    cfg.measurements, self.display_panel.image_metadata)
+                self.main_layout.addWidget(
+                    self.measurement_panel.backend_widget)
+                self.__connect_measurements()
 
             # Main application state, enter the init state.
             self.state_graph = StateGraph(
@@ -63,25 +168,74 @@ class View(QtWidgets.QMainWindow):
             # Register callbacks to be called when some events occur.
             self.control_panel.actions_panel.add_on_start_stop_callback(
                 self.on_start_stop_pressed)
-            self.showMaximized()
+            self.control_panel.buffer_panel.add_on_review_callback(
+                self.on_review_pressed)
+            self.control_panel.settings_panel.add_on_change_callback(
+                lambda *args: self.display_panel.reset_filters())
+            self.overload_bridge = OutputBridge(
+                controller.get_output("overload_events"), min_interval=0.5)
+            self.overload_bridge.connect(self.__on_overload_event)
+            self.overload_bridge.start()
             # self.adjustSize()
             # self.setFixedSize(self.size())
 
-        except Exception as e:
-            print(traceback.format_exc())
-            print(e)
+        except Exception:
+            _LOGGER.exception("Cannot create the view panels")
             self.controller.close()
 
+    def __on_overload_event(self, event):
+        is_overloaded, load = event
+        if is_overloaded:
+            self.overload_label.setText(
+                f"<b><font color='red'>Overload (load: {load:.2f})</font></b>")
+        else:
+            self.overload_label.setText("")
+
     def on_start_stop_pressed(self):
         if self.state.is_current_state({"init", "stopped"}):
             self.state.do("start")
         else:
             self.state.do("stop")
 
+    def __connect_measurements(self):
+        panel = self.measurement_panel
+        self.display_panel.add_on_frame_callback(panel.submit)
+        self.display_panel.add_on_cursor_callback(panel.set_cursor_line)
+        # Log the measurements time series alongside the captures.
+        buffer_panel = self.control_panel.buffer_panel
+        buffer_panel.add_on_capture_start_callback(panel.engine.start_log)
+        buffer_panel.add_on_capture_end_callback(panel.engine.stop_log)
+        buffer_panel.add_on_save_callback(
+            lambda filename: panel.engine.save_log(
+                self.__get_measurements_log_path(filename)))
+
+    def __get_measurements_log_path(self, capture_path):
+        if capture_path.endswith(".pkl"):
+            return f"{os.path.splitext(capture_path)[0]}_measurements.csv"
+        # Capture directory.
+        os.makedirs(capture_path, exist_ok=True)
+        return os.path.join(capture_path, "measurements.csv")
+
+    def on_review_pressed(self):
+        # The controller may be busy (e.g. saving), do not block the GUI.
+        when_ready(self.controller.get_capture_buffer(),
+                   self.__open_cine_panel,
+                   lambda error: show_error_message(
+                       f"Cannot review the capture: {error}"))
+
+    def __open_cine_panel(self, capture):
+        if self.cine_panel is not None:
+            self.cine_panel.close()
+        self.cine_panel = CinePanel(capture, self.display_panel.layer_cfg,
+                                    self.display_panel.image_metadata)
+        self.cine_panel.show()
+
     def on_init(self, event):
         self.control_panel.actions_panel.enable()
         self.control_panel.settings_panel.disable()
         self.control_panel.buffer_panel.disable()
+        if self.control_panel.trigger_panel is not None:
+            self.control_panel.trigger_panel.disable()
         self.statusBar().showMessage(
             "Ready, press 'Start' button to start the hardware.")
 
@@ -92,6 +246,8 @@ class View(QtWidgets.QMainWindow):
     def on_started(self, event):
         self.control_panel.settings_panel.enable()
         self.control_panel.buffer_panel.enable()
+        if self.control_panel.trigger_panel is not None:
+            self.control_panel.trigger_panel.enable()
         self.display_panel.start()
         self.control_panel.buffer_panel.start()
         self.statusBar().showMessage("Running.")
@@ -99,9 +255,23 @@ class View(QtWidgets.QMainWindow):
     def on_stopped(self, event):
         self.control_panel.settings_panel.disable()
         self.control_panel.actions_panel.disable()
+        if self.control_panel.trigger_panel is not None:
+            self.control_panel.trigger_panel.stop()
+            self.control_panel.trigger_panel.disable()
         self.statusBar().showMessage("Stopped.")
 
     def closeEvent(self, event):
+        self.init_timer.stop()
+        if self.display_panel is not None:
+            self.display_panel.close()
+        if self.control_panel is not None:
+            self.control_panel.buffer_panel.close()
+            if self.control_panel.trigger_panel is not None:
+                self.control_panel.trigger_panel.close()
+        if self.measurement_panel is not None:
+            self.measurement_panel.close()
+        if self.overload_bridge is not None:
+            self.overload_bridge.stop()
         self.controller.close()
         event.accept()
 
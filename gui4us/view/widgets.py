@@ -1,7 +1,9 @@
 from dataclasses import dataclass
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QPainter, QPen, QPolygonF
 from PyQt5.QtWidgets import (
+    QCheckBox,
     QLabel,
     QPushButton,
     QSlider,
@@ -68,6 +70,22 @@ class PushButton(Widget):
         self.backend_widget.setText(text)
 
 
+class CheckBox(Widget):
+
+    def __init__(self, label, init_value=False, on_change=None):
+        super().__init__(QCheckBox(label))
+        self.backend_widget.setChecked(init_value)
+        if on_change is not None:
+            self.set_on_change(on_change)
+
+    def set_on_change(self, func):
+        self.backend_widget.stateChanged.connect(
+            lambda state: func(self.get_value()))
+
+    def get_value(self):
+        return self.backend_widget.isChecked()
+
+
 class SpinBox(Widget):
 
     def __init__(self, value_range, step, init_value, on_change=None,
@@ -99,7 +117,7 @@ class SpinBox(Widget):
         self.backend_widget.valueChanged.connect(func_wrapper)
 
     def get_value(self):
-        self.backend_widget.value()
+        return self.backend_widget.value()
 
 
 class Slider(Widget):
@@ -180,6 +198,146 @@ class WidgetSequence(Form):
             widget.set_on_change(func_wrapper, disable_on_change=False)
 
 
+class CurveCanvas(QWidget):
+    """
+    Draws the curve (all points in a single paint call) and lets the user
+    edit it with the mouse:
+
+    - drag: sets the values of all points crossed by the cursor,
+    - shift+drag: moves all points up/down.
+
+    The on_change callback is called once, with all the values, when the
+    drag gesture ends.
+    """
+    MARGIN = 10
+
+    def __init__(self, value_range, step, init_value, labels=None,
+                 on_change=None):
+        super().__init__()
+        self.vmin, self.vmax = value_range
+        self.step = step
+        self.values = np.asarray(init_value, dtype=np.float64).copy()
+        self.labels = labels
+        self.on_change = on_change
+        self.active_point = None
+        self._gesture_start_values = None
+        self._gesture_start_y = None
+        self._last_point = None
+        self.setMinimumHeight(150)
+        self.setMinimumWidth(200)
+
+    def set_values(self, values):
+        self.values[:] = values
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), self.palette().base())
+        points = [QPointF(self._to_x(i), self._to_y(v))
+                  for i, v in enumerate(self.values)]
+        painter.setPen(QPen(self.palette().text().color(), 1.5))
+        painter.drawPolyline(QPolygonF(points))
+        painter.setBrush(self.palette().highlight())
+        painter.setPen(Qt.NoPen)
+        for p in points:
+            painter.drawEllipse(p, 3, 3)
+        if self.active_point is not None:
+            i = self.active_point
+            label = self.labels[i] if self.labels is not None else str(i)
+            painter.setPen(self.palette().text().color())
+            painter.drawText(self.MARGIN, self.MARGIN+10,
+                             f"{label}: {self.values[i]:.1f}")
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if event.button() != Qt.LeftButton or not self.isEnabled():
+            return
+        self._gesture_start_values = self.values.copy()
+        self._gesture_start_y = event.y()
+        self._last_point = None
+        self._edit(event)
+
+    def mouseMoveEvent(self, event):
+        if self._gesture_start_values is not None:
+            self._edit(event)
+
+    def mouseReleaseEvent(self, event):
+        if self._gesture_start_values is None:
+            return
+        is_changed = not np.array_equal(self.values,
+                                        self._gesture_start_values)
+        self._gesture_start_values = None
+        self.active_point = None
+        self.update()
+        if is_changed and self.on_change is not None:
+            self.on_change(self.values.tolist())
+
+    def _edit(self, event):
+        i = self._to_index(event.x())
+        value = self._to_value(event.y())
+        if event.modifiers() & Qt.ShiftModifier:
+            offset = value-self._to_value(self._gesture_start_y)
+            self.values[:] = self._snap(self._gesture_start_values+offset)
+        else:
+            # Set all points between the previous and the current position.
+            if self._last_point is None:
+                self._last_point = (i, value)
+            i0, v0 = self._last_point
+            lo, hi = min(i0, i), max(i0, i)
+            indices = np.arange(lo, hi+1)
+            self.values[lo:hi+1] = self._snap(
+                np.interp(indices, [i0, i] if i0 <= i else [i, i0],
+                          [v0, value] if i0 <= i else [value, v0]))
+            self._last_point = (i, value)
+        self.active_point = i
+        self.update()
+
+    def _snap(self, values):
+        values = np.round((values-self.vmin)/self.step)*self.step+self.vmin
+        return np.clip(values, self.vmin, self.vmax)
+
+    def _to_x(self, i):
+        width = self.width()-2*self.MARGIN
+        return self.MARGIN+i*width/max(len(self.values)-1, 1)
+
+    def _to_y(self, value):
+        height = self.height()-2*self.MARGIN
+        return self.MARGIN+(self.vmax-value)*height/(self.vmax-self.vmin)
+
+    def _to_index(self, x):
+        width = self.width()-2*self.MARGIN
+        i = round((x-self.MARGIN)*(len(self.values)-1)/max(width, 1))
+        return int(np.clip(i, 0, len(self.values)-1))
+
+    def _to_value(self, y):
+        height = self.height()-2*self.MARGIN
+        return self.vmax-(y-self.MARGIN)*(self.vmax-self.vmin)/max(height, 1)
+
+
+class CurveEditor(Widget):
+    """
+    A single widget for editing vector settings (e.g. TGC curve). Emits one
+    update with the whole vector per drag gesture.
+    """
+
+    def __init__(self, value_range, step, init_value, labels=None,
+                 on_change=None, data_type="float"):
+        super().__init__(CurveCanvas(value_range, step, init_value,
+                                     labels=labels))
+        if on_change is not None:
+            self.set_on_change(on_change)
+
+    def set_on_change(self, func):
+        self.backend_widget.on_change = func
+
+    def get_value(self):
+        return self.backend_widget.values.tolist()
+
+    def set_value(self, value):
+        self.backend_widget.set_values(value)
+
+
 class Panel:
 
     def __init__(self, title, layout="v"):
@@ -0,0 +1,54 @@
+"""
+Import-time budget of the modules imported on startup, before the
+environment and the display backend are selected.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Maximum import time of gui4us.view and gui4us.controller [s].
+_BUDGET = 0.1
+# Modules that should be loaded only when needed.
+_HEAVY_MODULES = ("numpy", "PyQt5", "matplotlib", "arrus", "scipy", "cupy",
+                  "http.server")
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import gui4us.view
+import gui4us.controller
+elapsed = time.perf_counter()-start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def _measure():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (_ROOT, env.get("PYTHONPATH", None)) if p)
+    result = subprocess.run([sys.executable, "-c", _SCRIPT], env=env,
+                            cwd=_ROOT, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def imported_modules():
+    return _measure()["modules"]
+
+
+@pytest.mark.parametrize("module", _HEAVY_MODULES)
+def test_heavy_modules_are_not_imported(module, imported_modules):
+    assert module not in imported_modules
+
+
+def test_import_time_budget():
+    # The best of a few runs, to ignore the disk cache and the load of
+    # the machine.
+    elapsed = min(_measure()["elapsed"] for _ in range(3))
+    assert elapsed < _BUDGET, \
+        f"Importing gui4us.view and gui4us.controller took " \
+        f"{elapsed*1e3:.0f} ms, the budget is {_BUDGET*1e3:.0f} ms."